@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+from django.conf import settings
+from django.templatetags.static import static
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Sources are read from these directories of the asset directory, and
+# bundles and their manifest written to BUNDLE_DIR next to them
+SOURCE_DIRS = ('css', 'js')
+BUNDLE_DIR = 'bundles'
+MANIFEST_NAME = 'manifest.json'
+
+_STRING = r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+_COMMENT_OR_STRING = re.compile(rf'({_STRING})|/\*.*?\*/', re.S)
+_STRING_ONLY = re.compile(rf'({_STRING})')
+
+
+def asset_dir():
+    return Path(getattr(settings, 'ASSET_DIR', settings.STATICFILES_DIRS[0]))
+
+
+def _squeeze_css(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+    text = re.sub(r': ', ':', text)
+    return text.replace(';}', '}')
+
+
+def minify_css(css):
+    """
+    Drop comments and redundant whitespace, leaving strings alone.
+    """
+    css = _COMMENT_OR_STRING.sub(lambda m: m.group(1) or '', css)
+    parts = _STRING_ONLY.split(css)
+    # split() puts the strings at odd positions
+    return ''.join(part if i % 2 else _squeeze_css(part) for i, part in enumerate(parts)).strip()
+
+
+def minify_js(js):
+    """
+    Drop indentation, blank lines and whole-line comments. Statements are
+    never joined, so automatic semicolon insertion is unaffected.
+    """
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+MINIFIERS = {'css': minify_css, 'js': minify_js}
+
+
+def write_compressed(path, content):
+    """
+    Write content to path with gzip (and brotli, if installed) variants
+    for servers that serve precompressed files.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    Path(f'{path}.gz').write_bytes(gzip.compress(content, 9, mtime=0))
+    if brotli is not None:
+        Path(f'{path}.br').write_bytes(brotli.compress(content))
+
+
+def build(root=None):
+    """
+    Minify every source file into a content-hashed bundle and write the
+    manifest mapping source names to bundle names. Bundles no longer in
+    the manifest are removed. Returns [(name, bundle, source bytes, bundle bytes)].
+    """
+    root = Path(root or asset_dir())
+    manifest, built = {}, []
+    for kind in SOURCE_DIRS:
+        for path in sorted((root / kind).rglob(f'*.{kind}')):
+            name = path.relative_to(root).as_posix()
+            source = path.read_text(encoding='utf-8')
+            content = MINIFIERS[kind](source).encode()
+            digest = hashlib.sha256(content).hexdigest()[:12]
+            bundle = f'{BUNDLE_DIR}/{Path(name).with_suffix("")}.{digest}.{kind}'
+            write_compressed(root / bundle, content)
+            manifest[name] = bundle
+            built.append((name, bundle, len(source.encode()), len(content)))
+    bundle_dir = root / BUNDLE_DIR
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+    (bundle_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    current = {root / bundle for bundle in manifest.values()}
+    for path in bundle_dir.rglob('*.*'):
+        if path.name != MANIFEST_NAME and path.with_suffix('') not in current and path not in current:
+            path.unlink()
+    load_manifest.cache_clear()
+    return built
+
+
+@lru_cache(maxsize=None)
+def load_manifest():
+    try:
+        return json.loads((asset_dir() / BUNDLE_DIR / MANIFEST_NAME).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(name):
+    """
+    Return the URL of a static asset, pointing at its bundle when bundles
+    are in use and one has been built.
+    """
+    if getattr(settings, 'USE_ASSET_BUNDLES', False):
+        name = load_manifest().get(name, name)
+    return static(name)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from assets import bundles
+
+
+class Command(BaseCommand):
+    help = 'Build minified, content-hashed and precompressed bundles of the static CSS and JS'
+
+    def handle(self, *args, **options):
+        built = bundles.build()
+        for name, bundle, source_size, size in built:
+            self.stdout.write(f'{name} -> {bundle} ({source_size} -> {size} bytes)')
+        if bundles.brotli is None:
+            self.stdout.write('brotli is not installed; only gzip variants were written')
+        self.stdout.write(self.style.SUCCESS(f'Successfully built {len(built)} bundles'))
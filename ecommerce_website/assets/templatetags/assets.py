@@ -0,0 +1,23 @@
+from django import template
+from django.utils.html import format_html
+from assets.bundles import asset_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def asset(name):
+    """
+    Usage: {% asset 'css/base.css' %}
+    """
+    return asset_url(name)
+
+
+@register.simple_tag
+def stylesheet(name):
+    return format_html('<link rel="stylesheet" href="{}">', asset_url(name))
+
+
+@register.simple_tag
+def script(name):
+    return format_html('<script src="{}"></script>', asset_url(name))
@@ -0,0 +1,67 @@
+import gzip
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from django.template import Context, Template
+from django.test import SimpleTestCase, override_settings
+from . import bundles
+
+
+class MinifyTests(SimpleTestCase):
+    def test_minify_css(self):
+        css = """
+        /* Cards */
+        .card > .title,
+        .card:hover {
+            content: '  a ; }  ';
+            margin: 0 auto;
+            width: calc(100% - 2rem);
+        }
+        @media (max-width: 768px) { .card { display: none; } }
+        """
+        self.assertEqual(
+            bundles.minify_css(css),
+            ".card>.title,.card:hover{content:'  a ; }  ';margin:0 auto;width:calc(100% - 2rem)}"
+            "@media (max-width:768px){.card{display:none}}")
+
+    def test_minify_js(self):
+        js = "\n    // Toggle\n    if (a) {\n        b('// not a comment');\n    }\n\n"
+        self.assertEqual(bundles.minify_js(js), "if (a) {\nb('// not a comment');\n}")
+
+
+class BuildTests(SimpleTestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.addCleanup(bundles.load_manifest.cache_clear)
+        (self.root / 'css' / 'shop').mkdir(parents=True)
+        self.source = self.root / 'css' / 'shop' / 'cart.css'
+        self.source.write_text('.cart {\n    color: red;\n}\n')
+
+    def manifest(self):
+        return json.loads((self.root / 'bundles' / 'manifest.json').read_text())
+
+    def test_build(self):
+        bundles.build(self.root)
+        bundle = self.root / self.manifest()['css/shop/cart.css']
+        self.assertRegex(bundle.name, r'^cart\.[0-9a-f]{12}\.css$')
+        self.assertEqual(bundle.read_text(), '.cart{color:red}')
+        self.assertEqual(gzip.decompress(Path(f'{bundle}.gz').read_bytes()), b'.cart{color:red}')
+
+        # A changed source gets a new name and the old bundle goes
+        self.source.write_text('.cart { color: blue; }')
+        bundles.build(self.root)
+        self.assertFalse(bundle.exists())
+        self.assertFalse(Path(f'{bundle}.gz').exists())
+        self.assertTrue((self.root / self.manifest()['css/shop/cart.css']).exists())
+
+    def test_template_tags(self):
+        template = Template("{% load assets %}{% stylesheet 'css/shop/cart.css' %}")
+        with override_settings(ASSET_DIR=self.root, USE_ASSET_BUNDLES=False):
+            bundles.build()
+            self.assertEqual(template.render(Context()),
+                             '<link rel="stylesheet" href="/static/css/shop/cart.css">')
+        with override_settings(ASSET_DIR=self.root, USE_ASSET_BUNDLES=True):
+            self.assertEqual(template.render(Context()),
+                             f'<link rel="stylesheet" href="/static/{self.manifest()["css/shop/cart.css"]}">')
@@ -1,3 +1,14 @@
 from django.contrib import admin
+from .models import Cart, CartItem
 
-# Register your models here.
+class CartItemInline(admin.TabularInline):
+    model = CartItem
+    raw_id_fields = ['product']
+    extra = 0
+
+@admin.register(Cart)
+class CartAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'key', 'created', 'updated']
+    list_filter = ['created', 'updated']
+    raw_id_fields = ['user']
+    inlines = [CartItemInline]
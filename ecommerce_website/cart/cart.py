@@ -1,87 +1,131 @@
 from decimal import Decimal
-from django.conf import settings
 from products.models import Product
+from .storage import get_storage
+
+
+def get_cart(request):
+    """
+    Return the cart of the request, shared by the views and templates
+    rendering it so products are loaded at most once per request.
+    """
+    if not hasattr(request, '_cart'):
+        request._cart = Cart(request)
+    return request._cart
+
 
 class Cart:
+    """
+    The CART_STORAGE backend holds only {product id: {'quantity', 'price'}};
+    products, Decimal prices and totals are derived on first use and kept
+    on the instance until the cart changes.
+    """
     def __init__(self, request):
         """
         Initialize the cart.
         """
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # save an empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.storage = get_storage(request)
+        self._cart = None
+        self._items = None
+        self._count = None
+        self._total = None
+
+    @property
+    def cart(self):
+        if self._cart is None:
+            self._cart = self.storage.load()
+        return self._cart
 
     def add(self, product, quantity=1, override_quantity=False):
         """
         Add a product to the cart or update its quantity.
         """
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 0,
-                                     'price': str(product.price)}
-        if override_quantity:
-            self.cart[product_id]['quantity'] = quantity
+        if override_quantity and str(product.id) in self.cart:
+            self.storage.update(product.id, quantity)
         else:
-            self.cart[product_id]['quantity'] += quantity
-        self.save()
+            self.storage.add(product.id, product.price, quantity)
+        self.changed()
 
-    def save(self):
-        # mark the session as "modified" to make sure it gets saved
-        self.session.modified = True
+    def changed(self):
+        # Reloaded from the storage on next use
+        self._cart = self._items = self._count = self._total = None
 
     def remove(self, product):
         """
         Remove a product from the cart.
         """
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
-            self.save()
+        if str(product.id) in self.cart:
+            self.storage.remove(product.id)
+            self.changed()
 
     def update(self, product, quantity):
         """
         Update product quantity.
         """
-        product_id = str(product.id)
-        if product_id in self.cart and quantity > 0:
-            self.cart[product_id]['quantity'] = quantity
-            self.save()
+        if str(product.id) in self.cart and quantity > 0:
+            self.storage.update(product.id, quantity)
+            self.changed()
+
+    def items(self):
+        """
+        Return the cart's items with their products, fetched from the
+        database on first use. Products that no longer exist are left out.
+        """
+        if self._items is None:
+            products = Product.objects.filter(id__in=self.cart.keys()) \
+                .select_related('category', 'primary_image').in_bulk()
+            self._items = []
+            for product_id, entry in self.cart.items():
+                product = products.get(int(product_id))
+                if product is None:
+                    continue
+                price = Decimal(entry['price'])
+                self._items.append({
+                    'product': product,
+                    'quantity': entry['quantity'],
+                    'price': price,
+                    'total_price': price * entry['quantity'],
+                })
+        return self._items
 
     def __iter__(self):
         """
-        Iterate over the items in the cart and get the products from the database.
+        Iterate over the items in the cart.
         """
-        product_ids = self.cart.keys()
-        # get the product objects and add them to the cart
-        products = Product.objects.filter(id__in=product_ids)
-
-        cart = self.cart.copy()
-        for product in products:
-            cart[str(product.id)]['product'] = product
+        return iter(self.items())
 
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+    def totals(self):
+        """
+        Return (item count, total price) of the products items() returns,
+        in one pass. Without items loaded, only the ids of the products
+        still there are fetched; prices are the ones the cart holds.
+        """
+        if self._count is None:
+            if self._items is not None:
+                lines = [(item['quantity'], item['total_price']) for item in self._items]
+            else:
+                existing = set(Product.objects.filter(id__in=self.cart.keys()).order_by()
+                               .values_list('id', flat=True))
+                lines = [(entry['quantity'], Decimal(entry['price']) * entry['quantity'])
+                         for product_id, entry in self.cart.items() if int(product_id) in existing]
+            self._count = sum(quantity for quantity, total in lines)
+            self._total = sum((total for quantity, total in lines), Decimal(0))
+        return self._count, self._total
 
     def __len__(self):
         """
         Count all items in the cart.
         """
-        return sum(item['quantity'] for item in self.cart.values())
+        return self.totals()[0]
 
     def get_total_price(self):
         """
         Calculate the total cost of items in cart.
         """
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return self.totals()[1]
 
     def clear(self):
         """
-        Remove cart from session.
+        Remove cart from the storage.
         """
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
\ No newline at end of file
+        self.storage.clear()
+        self.changed()
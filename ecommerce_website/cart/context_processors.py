@@ -1,4 +1,6 @@
-from .cart import Cart
+from django.utils.functional import SimpleLazyObject
+from .cart import get_cart
 
 def cart(request):
-    return {'cart': Cart(request)}
\ No newline at end of file
+    # Pages that never show the cart don't load it
+    return {'cart': SimpleLazyObject(lambda: get_cart(request))}
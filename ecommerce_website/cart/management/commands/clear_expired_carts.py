@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from cart.storage import DatabaseCartStorage
+
+
+class Command(BaseCommand):
+    help = ('Delete anonymous carts of the database cart storage that have not '
+            'changed for CART_ANONYMOUS_MAX_AGE_DAYS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of carts deleted per transaction')
+
+    def handle(self, *args, **options):
+        deleted = DatabaseCartStorage.clear_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} expired carts'))
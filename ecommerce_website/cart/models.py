@@ -2,5 +2,44 @@ from django.db import models
 from django.conf import settings
 from products.models import Product
 
-# Cart is implemented using sessions, not models
-# This file is kept for Django app structure consistency
+
+class Cart(models.Model):
+    """
+    A cart kept by DatabaseCartStorage: a user's, or an anonymous visitor's
+    identified by the key stored in their session.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                on_delete=models.CASCADE,
+                                related_name='cart',
+                                null=True, blank=True)
+    key = models.CharField(max_length=32, unique=True, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Expiry of anonymous carts
+            models.Index(fields=['updated'], condition=models.Q(user__isnull=True),
+                         name='cart_anonymous_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'Cart {self.id}'
+
+
+class CartItem(models.Model):
+    cart = models.ForeignKey(Cart,
+                             related_name='items',
+                             on_delete=models.CASCADE)
+    product = models.ForeignKey(Product,
+                                related_name='+',
+                                on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=0)
+    # Price when the product was first added
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        unique_together = ['cart', 'product']
+
+    def __str__(self):
+        return str(self.id)
@@ -0,0 +1,12 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from .storage import get_storage
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    if request is None:
+        return
+    get_storage(request).merge(user)
+    # A cart loaded before login belonged to the anonymous visitor
+    request.__dict__.pop('_cart', None)
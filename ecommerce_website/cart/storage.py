@@ -0,0 +1,271 @@
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Cart, CartItem
+
+
+def get_storage(request):
+    """
+    Return the CART_STORAGE backend for the request.
+    """
+    return import_string(getattr(settings, 'CART_STORAGE', 'cart.storage.SessionCartStorage'))(request)
+
+
+def max_age():
+    return timedelta(days=getattr(settings, 'CART_ANONYMOUS_MAX_AGE_DAYS', 30))
+
+
+class BaseCartStorage:
+    """
+    Keeps carts as {product id: {'quantity': int, 'price': str}}.
+
+    add() creates or increments an item, keeping the price of an existing
+    one; update() only changes items already in the cart.
+    """
+    def __init__(self, request):
+        self.request = request
+        self.session = request.session
+
+    def load(self):
+        raise NotImplementedError
+
+    def add(self, product_id, price, quantity):
+        raise NotImplementedError
+
+    def update(self, product_id, quantity):
+        raise NotImplementedError
+
+    def remove(self, product_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def merge(self, user):
+        """
+        Move the anonymous cart of the session into the cart of the user
+        who just logged in.
+        """
+
+
+class SessionCartStorage(BaseCartStorage):
+    """
+    Keeps the cart in the session; every change rewrites the session.
+    """
+    def load(self):
+        return self.session.get(settings.CART_SESSION_ID) or {}
+
+    def _save(self, cart):
+        self.session[settings.CART_SESSION_ID] = cart
+        self.session.modified = True
+
+    def add(self, product_id, price, quantity):
+        cart = self.load()
+        item = cart.setdefault(str(product_id), {'quantity': 0, 'price': str(price)})
+        item['quantity'] += quantity
+        self._save(cart)
+
+    def update(self, product_id, quantity):
+        cart = self.load()
+        if str(product_id) in cart:
+            cart[str(product_id)]['quantity'] = quantity
+            self._save(cart)
+
+    def remove(self, product_id):
+        cart = self.load()
+        if cart.pop(str(product_id), None) is not None:
+            self._save(cart)
+
+    def clear(self):
+        self.session.pop(settings.CART_SESSION_ID, None)
+        self.session.modified = True
+
+    # The session, and the cart in it, survives login
+
+
+class ServerCartStorage(BaseCartStorage):
+    """
+    Base of stores keeping carts outside the session, by user or, for
+    anonymous visitors, by a random key the session holds.
+    """
+    def anonymous_key(self, create=False):
+        key = self.session.get(settings.CART_SESSION_ID)
+        if not isinstance(key, str):
+            key = None
+        if key is None and create:
+            key = self.session[settings.CART_SESSION_ID] = uuid.uuid4().hex
+        return key
+
+    def forget_anonymous_key(self):
+        self.session.pop(settings.CART_SESSION_ID, None)
+
+
+class DatabaseCartStorage(ServerCartStorage):
+    """
+    Keeps carts in the Cart and CartItem tables, changing one item row
+    per change.
+    """
+    def _owner(self, create=False):
+        user = self.request.user
+        if user.is_authenticated:
+            return {'user': user}
+        key = self.anonymous_key(create)
+        return {'key': key, 'user': None} if key else None
+
+    def _touch(self, owner):
+        # Keeps the cart from expiring while it is in use
+        Cart.objects.filter(**owner).update(updated=timezone.now())
+
+    def _cart_id(self):
+        owner = self._owner(create=True)
+        cart, created = Cart.objects.get_or_create(**owner)
+        if not created:
+            self._touch(owner)
+        return cart.pk
+
+    def load(self):
+        owner = self._owner()
+        if owner is None:
+            return {}
+        items = CartItem.objects.filter(**{f'cart__{field}': value for field, value in owner.items()})
+        return {str(product_id): {'quantity': quantity, 'price': str(price)}
+                for product_id, quantity, price in items.order_by('id')
+                .values_list('product_id', 'quantity', 'price')}
+
+    def add(self, product_id, price, quantity):
+        with transaction.atomic():
+            cart_id = self._cart_id()
+            # Insert at zero and increment, so concurrent adds both count
+            CartItem.objects.bulk_create([CartItem(cart_id=cart_id, product_id=product_id, price=price)],
+                                         ignore_conflicts=True)
+            CartItem.objects.filter(cart_id=cart_id, product_id=product_id) \
+                .update(quantity=F('quantity') + quantity)
+
+    def update(self, product_id, quantity):
+        owner = self._owner()
+        if owner is not None:
+            if CartItem.objects.filter(product_id=product_id,
+                                       **{f'cart__{field}': value for field, value in owner.items()}) \
+                    .update(quantity=quantity):
+                self._touch(owner)
+
+    def remove(self, product_id):
+        owner = self._owner()
+        if owner is not None:
+            if CartItem.objects.filter(product_id=product_id,
+                                       **{f'cart__{field}': value for field, value in owner.items()}) \
+                    .delete()[0]:
+                self._touch(owner)
+
+    def clear(self):
+        owner = self._owner()
+        if owner is not None:
+            Cart.objects.filter(**owner).delete()
+        self.forget_anonymous_key()
+
+    def merge(self, user):
+        key = self.anonymous_key()
+        if key is None:
+            return
+        self.forget_anonymous_key()
+        anonymous = Cart.objects.filter(key=key, user=None).first()
+        if anonymous is None:
+            return
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user)
+            existing = dict(cart.items.values_list('product_id', 'id'))
+            for item in anonymous.items.all():
+                if item.product_id in existing:
+                    CartItem.objects.filter(pk=existing[item.product_id]) \
+                        .update(quantity=F('quantity') + item.quantity)
+            anonymous.items.exclude(product__in=list(existing)).update(cart=cart)
+            anonymous.delete()
+
+    @staticmethod
+    def clear_expired(batch_size=1000):
+        """
+        Delete anonymous carts unchanged for CART_ANONYMOUS_MAX_AGE_DAYS, in
+        batches. Returns the number of carts deleted.
+        """
+        expired = Cart.objects.filter(user=None, updated__lt=timezone.now() - max_age())
+        deleted = 0
+        while True:
+            ids = list(expired.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            with transaction.atomic():
+                CartItem.objects.filter(cart__in=ids).delete()
+                Cart.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+
+
+class CacheCartStorage(ServerCartStorage):
+    """
+    Keeps each cart as one cache entry, expiring after
+    CART_ANONYMOUS_MAX_AGE_DAYS without changes.
+    """
+    def _cache(self):
+        return caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+
+    def _key(self, create=False):
+        user = self.request.user
+        if user.is_authenticated:
+            return f'cart:user:{user.pk}'
+        key = self.anonymous_key(create)
+        return f'cart:anonymous:{key}' if key else None
+
+    def load(self):
+        return self._load(self._key())
+
+    def _load(self, key):
+        return self._cache().get(key, {}) if key else {}
+
+    def _save(self, key, cart):
+        self._cache().set(key, cart, int(max_age().total_seconds()))
+
+    def add(self, product_id, price, quantity):
+        key = self._key(create=True)
+        cart = self._load(key)
+        item = cart.setdefault(str(product_id), {'quantity': 0, 'price': str(price)})
+        item['quantity'] += quantity
+        self._save(key, cart)
+
+    def update(self, product_id, quantity):
+        key = self._key()
+        cart = self._load(key)
+        if str(product_id) in cart:
+            cart[str(product_id)]['quantity'] = quantity
+            self._save(key, cart)
+
+    def remove(self, product_id):
+        key = self._key()
+        cart = self._load(key)
+        if cart.pop(str(product_id), None) is not None:
+            self._save(key, cart)
+
+    def clear(self):
+        key = self._key()
+        if key:
+            self._cache().delete(key)
+        self.forget_anonymous_key()
+
+    def merge(self, user):
+        key = self.anonymous_key()
+        if key is None:
+            return
+        self.forget_anonymous_key()
+        anonymous = self._load(f'cart:anonymous:{key}')
+        if not anonymous:
+            return
+        user_key = f'cart:user:{user.pk}'
+        cart = self._load(user_key)
+        for product_id, item in anonymous.items():
+            cart.setdefault(product_id, {'quantity': 0, 'price': item['price']})
+            cart[product_id]['quantity'] += item['quantity']
+        self._save(user_key, cart)
+        self._cache().delete(f'cart:anonymous:{key}')
@@ -1,3 +1,188 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from products.models import Category, Product
+from .models import Cart, CartItem
 
-# Create your tests here.
+
+class CartTestsMixin:
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Mugs')
+        cls.products = [Product.objects.create(name=f'Mug {i}', price=i + 1, category=category)
+                        for i in range(5)]
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def add(self, product, quantity=1, override=False):
+        data = {'quantity': quantity}
+        if override:
+            data['override'] = 'on'
+        self.client.post(reverse('cart:cart_add', args=[product.id]), data)
+
+    def contents(self):
+        cart = self.client.get(reverse('cart:cart_detail')).context['cart']
+        return {item['product'].name: item['quantity'] for item in cart}
+
+    def test_add_update_remove(self):
+        self.add(self.products[0], 2)
+        self.add(self.products[0], 3)
+        self.add(self.products[1])
+        self.assertEqual(self.contents(), {'Mug 0': 5, 'Mug 1': 1})
+        self.add(self.products[1], 4, override=True)
+        self.client.post(reverse('cart:cart_update', args=[self.products[0].id]), {'quantity': 2})
+        self.assertEqual(self.contents(), {'Mug 0': 2, 'Mug 1': 4})
+        self.client.post(reverse('cart:cart_remove', args=[self.products[0].id]))
+        self.assertEqual(self.contents(), {'Mug 1': 4})
+
+    def test_cart_page_loads_products_once(self):
+        for product in self.products:
+            self.add(product)
+        self.add(self.products[0])
+        response = self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual(response.context['cart'].get_total_price(), 16)
+        self.assertEqual(len(response.context['cart']), 6)
+        self.assertContains(response, f'id="quantity-{self.products[0].id}"')
+
+        # The view and the template both iterate the cart
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'FROM "products_product"' in query['sql']]), 1)
+
+    def test_deleted_products_are_left_out(self):
+        self.add(self.products[0])
+        self.add(self.products[1])
+        self.products[1].delete()
+        response = self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual([item['product'] for item in response.context['cart']], [self.products[0]])
+        # Counted and totalled from the same products
+        self.assertEqual((len(response.context['cart']), response.context['cart'].get_total_price()), (1, 1))
+        response = self.post_json('cart_add_json', self.products[0], quantity=2)
+        self.assertEqual((response.json()['count'], response.json()['total_price']), (3, '3.00'))
+
+    def test_pages_without_a_cart_do_not_create_a_session(self):
+        response = self.client.get(reverse('products:product_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def post_json(self, name, product, **data):
+        return self.client.post(reverse(f'cart:{name}', args=[product.id]), data)
+
+    def test_json_changes_return_deltas(self):
+        self.add(self.products[1], 2)
+        response = self.post_json('cart_add_json', self.products[0], quantity=3)
+        self.assertEqual(response.json(), {
+            'product_id': self.products[0].id,
+            'item': {'quantity': 3, 'price': '1.00', 'total_price': '3.00'},
+            'count': 5,
+            'total_price': '7.00',
+        })
+        response = self.post_json('cart_update_json', self.products[0], quantity=1)
+        self.assertEqual((response.json()['item']['quantity'], response.json()['total_price']), (1, '5.00'))
+        response = self.post_json('cart_remove_json', self.products[0])
+        self.assertEqual((response.json()['item'], response.json()['count']), (None, 2))
+
+    def test_json_changes_of_cart_items_do_not_fetch_the_product(self):
+        self.add(self.products[0])
+        self.add(self.products[1])
+        for name, data in (('cart_add_json', {'quantity': 1}), ('cart_update_json', {'quantity': 4}),
+                           ('cart_remove_json', {})):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_json(name, self.products[0], **data)
+            self.assertEqual(response.status_code, 200)
+            # Only the ids of the cart's products, once, for the totals
+            products = [query['sql'] for query in queries.captured_queries
+                        if 'FROM "products_product"' in query['sql']]
+            self.assertEqual(len(products), 1)
+            self.assertNotIn('"products_product"."name"', products[0])
+
+    def test_json_errors(self):
+        self.assertEqual(self.post_json('cart_add_json', self.products[0], quantity=50).status_code, 400)
+        self.assertEqual(self.client.post(reverse('cart:cart_add_json', args=[999]),
+                                          {'quantity': 1}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('cart:cart_add_json', args=[999])).status_code, 405)
+
+    def test_anonymous_cart_merges_into_user_cart_on_login(self):
+        self.client.force_login(self.user)
+        self.add(self.products[0], 1)
+        self.add(self.products[1], 1)
+        self.client.logout()
+        self.add(self.products[1], 2)
+        self.add(self.products[2], 3)
+        self.client.login(username='shopper', password='secret')
+        self.assertEqual(self.contents(), {'Mug 0': 1, 'Mug 1': 3, 'Mug 2': 3})
+
+
+@override_settings(CART_STORAGE='cart.storage.SessionCartStorage')
+class SessionCartTests(CartTestsMixin, TestCase):
+    def test_session_only_holds_quantities_and_prices(self):
+        self.add(self.products[0], 2)
+        self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual(self.client.session[settings.CART_SESSION_ID],
+                         {str(self.products[0].id): {'quantity': 2, 'price': '1.00'}})
+
+    def test_anonymous_cart_merges_into_user_cart_on_login(self):
+        # The session cart is not kept after logout, but survives login
+        self.add(self.products[2], 3)
+        self.client.login(username='shopper', password='secret')
+        self.assertEqual(self.contents(), {'Mug 2': 3})
+
+
+@override_settings(CART_STORAGE='cart.storage.DatabaseCartStorage')
+class DatabaseCartTests(CartTestsMixin, TestCase):
+    def test_changes_do_not_rewrite_the_session(self):
+        self.add(self.products[0])
+        with CaptureQueriesContext(connection) as queries:
+            self.add(self.products[0])
+            self.add(self.products[1])
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('UPDATE "django_session"')])
+        self.assertEqual(CartItem.objects.get(product=self.products[0]).quantity, 2)
+
+    def test_user_cart_is_kept_across_logins(self):
+        self.client.force_login(self.user)
+        self.add(self.products[0], 2)
+        self.client.logout()
+        self.assertEqual(self.contents(), {})
+        self.client.force_login(self.user)
+        self.assertEqual(self.contents(), {'Mug 0': 2})
+
+    def test_clear_expired_carts(self):
+        Cart.objects.create(key='fresh')
+        self.client.force_login(self.user)
+        self.add(self.products[1])
+        stale = Cart.objects.create(key='stale')
+        CartItem.objects.create(cart=stale, product=self.products[0], quantity=1, price=1)
+        Cart.objects.filter(pk=stale.pk).update(updated=timezone.now() - timedelta(days=31))
+        Cart.objects.filter(user=self.user).update(updated=timezone.now() - timedelta(days=365))
+        call_command('clear_expired_carts', stdout=StringIO())
+        self.assertFalse(Cart.objects.filter(pk=stale.pk).exists())
+        self.assertEqual(Cart.objects.count(), 2)
+
+    def test_changes_keep_carts_from_expiring(self):
+        self.add(self.products[0])
+        self.add(self.products[1])
+        for change in (lambda: self.add(self.products[0], 2, override=True),
+                       lambda: self.client.post(reverse('cart:cart_update', args=[self.products[0].id]),
+                                                {'quantity': 3}),
+                       lambda: self.client.post(reverse('cart:cart_remove', args=[self.products[1].id]))):
+            Cart.objects.update(updated=timezone.now() - timedelta(days=31))
+            change()
+            call_command('clear_expired_carts', stdout=StringIO())
+            self.assertTrue(Cart.objects.exists())
+
+
+@override_settings(CART_STORAGE='cart.storage.CacheCartStorage')
+class CacheCartTests(CartTestsMixin, TestCase):
+    pass
@@ -8,4 +8,7 @@ urlpatterns = [
     path('add/<int:product_id>/', views.cart_add, name='cart_add'),
     path('remove/<int:product_id>/', views.cart_remove, name='cart_remove'),
     path('update/<int:product_id>/', views.cart_update, name='cart_update'),
-]
\ No newline at end of file
+    path('api/add/<int:product_id>/', views.cart_add_json, name='cart_add_json'),
+    path('api/remove/<int:product_id>/', views.cart_remove_json, name='cart_remove_json'),
+    path('api/update/<int:product_id>/', views.cart_update_json, name='cart_update_json'),
+]
@@ -1,12 +1,15 @@
+from decimal import Decimal
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.http import require_POST
 from products.models import Product
-from .cart import Cart
+from orders.recommendations import recommended_products
+from .cart import get_cart
 from .forms import CartAddProductForm
 
 @require_POST
 def cart_add(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     form = CartAddProductForm(request.POST)
     if form.is_valid():
@@ -18,14 +21,14 @@ def cart_add(request, product_id):
 
 @require_POST
 def cart_remove(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     cart.remove(product)
     return redirect('cart:cart_detail')
 
 @require_POST
 def cart_update(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     form = CartAddProductForm(request.POST)
     if form.is_valid():
@@ -34,9 +37,79 @@ def cart_update(request, product_id):
     return redirect('cart:cart_detail')
 
 def cart_detail(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     for item in cart:
         item['update_quantity_form'] = CartAddProductForm(initial={
             'quantity': item['quantity'],
-            'override': True})
-    return render(request, 'cart/detail.html', {'cart': cart})
+            'override': True}, auto_id=f'%s-{item["product"].id}')
+    return render(request, 'cart/detail.html', {
+        'cart': cart,
+        'recommended_products': recommended_products(cart.cart.keys()),
+    })
+
+
+# JSON variants of the cart changes, answering with the changed line and
+# the cart totals instead of redirecting to the cart page
+
+def _cart_product(cart, product_id):
+    """
+    Return the product to change. Products already in the cart only need
+    their id and the price the cart holds, so they aren't fetched.
+    """
+    entry = cart.cart.get(str(product_id))
+    if entry is not None:
+        return Product(id=product_id, price=Decimal(entry['price']))
+    return Product.objects.only('id', 'price').filter(id=product_id).first()
+
+def _cart_delta(cart, product_id):
+    entry = cart.cart.get(str(product_id))
+    item = None
+    if entry is not None:
+        price = Decimal(entry['price'])
+        item = {
+            'quantity': entry['quantity'],
+            'price': str(price),
+            'total_price': str(price * entry['quantity']),
+        }
+    count, total_price = cart.totals()
+    return JsonResponse({
+        'product_id': product_id,
+        'item': item,
+        'count': count,
+        'total_price': str(total_price),
+    })
+
+def _invalid(form):
+    return JsonResponse({'error': ' '.join(error for errors in form.errors.values() for error in errors)},
+                        status=400)
+
+def _not_found():
+    return JsonResponse({'error': 'No such product.'}, status=404)
+
+@require_POST
+def cart_add_json(request, product_id):
+    cart = get_cart(request)
+    form = CartAddProductForm(request.POST)
+    if not form.is_valid():
+        return _invalid(form)
+    product = _cart_product(cart, product_id)
+    if product is None:
+        return _not_found()
+    cd = form.cleaned_data
+    cart.add(product=product, quantity=cd['quantity'], override_quantity=cd['override'])
+    return _cart_delta(cart, product_id)
+
+@require_POST
+def cart_remove_json(request, product_id):
+    cart = get_cart(request)
+    cart.remove(Product(id=product_id))
+    return _cart_delta(cart, product_id)
+
+@require_POST
+def cart_update_json(request, product_id):
+    cart = get_cart(request)
+    form = CartAddProductForm(request.POST)
+    if not form.is_valid():
+        return _invalid(form)
+    cart.update(product=Product(id=product_id), quantity=form.cleaned_data['quantity'])
+    return _cart_delta(cart, product_id)
@@ -0,0 +1,237 @@
+import codecs
+import csv
+import json
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from products.importer import refresh_derived, update_rows, upsert_categories
+from products.models import Category, Product
+
+# Columns of exports, and the ones an import may set
+EXPORT_FIELDS = ('id', 'slug', 'name', 'category', 'price', 'stock', 'available', 'description')
+IMPORT_FIELDS = ('name', 'slug', 'category', 'price', 'stock', 'available', 'description')
+
+FORMATS = ('csv', 'jsonl')
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'off', ''}
+
+# Errors listed in the import report; the rest are only counted
+MAX_REPORTED_ERRORS = 200
+
+
+def format_for(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return extension if extension in FORMATS else None
+
+
+def read_rows(upload, file_format):
+    """
+    Yield (line number, row dict) from an uploaded CSV or JSONL file,
+    reading it line by line.
+    """
+    lines = codecs.iterdecode(upload, 'utf-8-sig')
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else None
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValidationError(f'"{value}" is not a yes/no value.')
+
+
+def clean_row(row):
+    """
+    Validate one row and return (key, values): key is ('id', pk) or
+    ('slug', slug), values the fields to set. Columns missing from the
+    row are left unchanged. Raises ValidationError.
+    """
+    if row is None:
+        raise ValidationError('Not a JSON object.')
+    opts = Product._meta
+    values = {}
+    for name in IMPORT_FIELDS:
+        if name not in row or row[name] is None:
+            continue
+        value = row[name]
+        if name == 'category':
+            values[name] = str(value).strip() or None
+        elif name == 'available':
+            values[name] = parse_bool(value)
+        else:
+            field = opts.get_field(name)
+            value = str(value).strip() if name != 'description' else str(value)
+            if value == '' and name != 'description':
+                raise ValidationError(f'{name} cannot be empty.')
+            try:
+                values[name] = field.clean(value, None)
+            except ValidationError as e:
+                raise ValidationError(f'{name}: {" ".join(e.messages)}')
+    pk = str(row.get('id') or '').strip()
+    if pk:
+        if not pk.isdigit():
+            raise ValidationError(f'"{pk}" is not a product id.')
+        return ('id', int(pk)), values
+    if 'name' not in values:
+        raise ValidationError('Rows without an id need a name.')
+    values['slug'] = slugify(values.get('slug') or values['name'])
+    return ('slug', values['slug']), values
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+class ProductImport:
+    """
+    Applies an uploaded product file in chunks.
+
+    Each chunk is validated, looked up with one query per key type and
+    written with bulk_create and a single executemany() UPDATE inside a
+    transaction. Invalid rows are skipped and reported with their line
+    number; the rest of the file is still applied.
+    """
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.report = ImportReport()
+
+    def run(self, upload, file_format):
+        chunk = []
+        for line, row in read_rows(upload, file_format):
+            self.report.rows += 1
+            try:
+                chunk.append((line, *clean_row(row)))
+            except ValidationError as e:
+                self.report.error(line, ' '.join(e.messages))
+            if len(chunk) >= self.chunk_size:
+                self.apply(chunk)
+                chunk = []
+        if chunk:
+            self.apply(chunk)
+        self.report.errors.sort()
+        return self.report
+
+    def apply(self, chunk):
+        ids = {value for (kind, value) in (key for line, key, values in chunk) if kind == 'id'}
+        slugs = {value for (kind, value) in (key for line, key, values in chunk) if kind == 'slug'}
+        existing = {('id', p.pk): p for p in Product.objects.filter(pk__in=ids)}
+        existing.update({('slug', p.slug): p for p in Product.objects.filter(slug__in=slugs)})
+        categories = self.categories({values['category'] for line, key, values in chunk
+                                      if values.get('category')})
+        now = timezone.now()
+        to_create, to_update, changed = {}, {}, {'updated'}
+        for line, key, values in chunk:
+            if 'category' in values:
+                name = values.pop('category')
+                values['category_id'] = categories[name].pk if name else None
+            if key in to_create:
+                # Repeated new product: the last row wins
+                for field, value in values.items():
+                    setattr(to_create[key], field, value)
+                continue
+            product = existing.get(key)
+            if product is None:
+                if key[0] == 'id':
+                    self.report.error(line, f'No product with id {key[1]}.')
+                    continue
+                if 'price' not in values:
+                    self.report.error(line, 'New products need a price.')
+                    continue
+                to_create[key] = Product(**values)
+                continue
+            differences = {field for field, value in values.items()
+                           if getattr(product, field) != value}
+            if not differences:
+                self.report.unchanged += 1
+                continue
+            for field in differences:
+                setattr(product, field, values[field])
+            product.updated = now
+            changed.update(differences)
+            to_update[product.pk] = product
+        with transaction.atomic():
+            created = Product.objects.bulk_create(list(to_create.values()))
+            updated = list(to_update.values())
+            if updated:
+                update_rows(updated, sorted(changed))
+        self.report.created += len(created)
+        self.report.updated += len(updated)
+        if created or updated:
+            refresh_derived(created + updated)
+
+    @staticmethod
+    def categories(names):
+        """
+        Return {name: Category} matching existing categories by name or
+        slug and creating the rest.
+        """
+        found = {}
+        for category in Category.objects.all():
+            found[category.name] = category
+            found.setdefault(category.slug, category)
+        missing = {name for name in names if name not in found}
+        found.update(upsert_categories(missing))
+        return found
+
+
+class Echo:
+    """
+    File-like object whose write() returns the value, for streaming csv.writer output.
+    """
+    def write(self, value):
+        return value
+
+
+def export_rows(products):
+    for product in products.select_related('category').order_by('id').iterator(chunk_size=2000):
+        yield {
+            'id': product.id,
+            'slug': product.slug,
+            'name': product.name,
+            'category': product.category.name if product.category_id else '',
+            'price': product.price,
+            'stock': product.stock,
+            'available': product.available,
+            'description': product.description,
+        }
+
+
+def export_csv(products):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in export_rows(products):
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+
+def export_jsonl(products):
+    for row in export_rows(products):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
@@ -2,6 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from products.models import Product, Category, ProductImage
 from orders.models import Order, OrderItem
+from . import bulk
 
 class ProductForm(forms.ModelForm):
     class Meta:
@@ -41,4 +42,13 @@ class OrderStatusForm(forms.ModelForm):
         }
 
 class OrderNoteForm(forms.Form):
-    note = forms.CharField(widget=forms.Textarea(attrs={'rows': 4}))
\ No newline at end of file
+    note = forms.CharField(widget=forms.Textarea(attrs={'rows': 4}))
+
+class ProductImportForm(forms.Form):
+    file = forms.FileField(help_text='A .csv or .jsonl file with a header row of product fields')
+    
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if bulk.format_for(upload.name) is None:
+            raise ValidationError('Upload a .csv or .jsonl file.')
+        return upload
@@ -1,3 +1,154 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+from orders.tests import create_order
+from products.models import Category, Product
+from products.tests import QueryPlanTestCase
+from . import bulk
 
-# Create your tests here.
+
+class DashboardQueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cls.category = Category.objects.create(name='Lamps')
+        products = [Product.objects.create(name=f'Lamp {i}', price=i + 1, stock=i,
+                                           category=cls.category) for i in range(10)]
+        for i in range(5):
+            create_order(cls.staff, products[i:i + 2], paid=i % 2 == 0)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.staff)
+
+    # Overall totals and page counts read every row they count
+    PRODUCT_COUNT = 'SELECT COUNT(*) AS "__count" FROM "products_product"'
+    ORDER_COUNT = 'SELECT COUNT(*) AS "__count" FROM "orders_order"'
+    REVENUE = 'SELECT (CAST(SUM("orders_order"."total")'
+
+    def test_dashboard_home(self):
+        self.assertNoFullScans(reverse('dashboard:dashboard_home'),
+                               allowed=[self.PRODUCT_COUNT, self.ORDER_COUNT, self.REVENUE])
+
+    def test_product_management(self):
+        url = reverse('dashboard:product_management')
+        self.assertNoFullScans(url, allowed=[self.PRODUCT_COUNT])
+        self.assertNoFullScans(f'{url}?category={self.category.id}')
+        self.assertNoFullScans(f'{url}?stock=low')
+
+    def test_order_management(self):
+        url = reverse('dashboard:order_management')
+        for query in ['', '?status=pending', '?payment=paid', '?sort=total_desc',
+                      '?min_total=5&sort=total_asc']:
+            self.assertNoFullScans(url + query, allowed=[self.ORDER_COUNT])
+
+    def test_orders_by_total(self):
+        url = reverse('dashboard:order_management')
+        response = self.client.get(f'{url}?sort=total_desc&min_total=5&max_total=abc')
+        self.assertEqual([order.total for order in response.context['orders']], [11, 9, 7, 5])
+        response = self.client.get(f'{url}?sort=total_asc&max_total=5')
+        self.assertEqual([order.total for order in response.context['orders']], [3, 5])
+
+    def test_total_revenue(self):
+        response = self.client.get(reverse('dashboard:dashboard_home'))
+        self.assertEqual(response.context['total_revenue'], 3 + 7 + 11)
+
+
+class ProductBulkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cls.lamps = Category.objects.create(name='Lamps')
+        cls.lamp = Product.objects.create(name='Desk Lamp', price=20, stock=3, category=cls.lamps)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def upload(self, name, content):
+        response = self.client.post(reverse('dashboard:product_import'),
+                                    {'file': SimpleUploadedFile(name, content.encode())})
+        self.assertEqual(response.status_code, 200)
+        return response.context['report']
+
+    def test_csv_import_creates_and_updates_products(self):
+        report = self.upload('products.csv', (
+            'id,name,category,price,stock,available\n'
+            f'{self.lamp.id},Desk Lamp,Lamps,25.00,3,yes\n'
+            ',Floor Lamp,Lamps,80,2,yes\n'
+            ',Oak Desk,Desks,300,1,no\n'
+        ))
+        self.assertEqual((report.rows, report.created, report.updated, report.error_count), (3, 2, 1, 0))
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.lamp.price, self.lamp.stock), (25, 3))
+        desk = Product.objects.get(slug='oak-desk')
+        self.assertEqual((desk.category.name, desk.price, desk.available), ('Desks', 300, False))
+        # Importing the same file again changes nothing
+        report = self.upload('products.csv', (
+            'id,price\n'
+            f'{self.lamp.id},25.00\n'
+        ))
+        self.assertEqual((report.updated, report.unchanged), (0, 1))
+
+    def test_invalid_rows_write_nothing(self):
+        report = self.upload('products.csv', (
+            'id,name,price,stock\n'
+            f'{self.lamp.id},Renamed Lamp,cheap,4\n'
+            ',Floor Lamp,,2\n'
+            '999999,Ghost,10,1\n'
+            f'{self.lamp.id},Renamed Lamp,30,yes\n'
+            ',Floor Lamp,80,2\n'
+        ))
+        self.assertEqual(report.error_count, 4)
+        self.assertEqual([line for line, message in report.errors], [2, 3, 4, 5])
+        self.assertEqual(report.created, 1)
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.lamp.name, self.lamp.price, self.lamp.stock), ('Desk Lamp', 20, 3))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_jsonl_import_reports_lines_that_are_not_objects(self):
+        report = self.upload('products.jsonl', (
+            '{"name": "Floor Lamp", "price": "80"}\n'
+            'not json\n'
+            '\n'
+            '["Floor Lamp"]\n'
+        ))
+        self.assertEqual((report.created, report.error_count), (1, 2))
+        self.assertEqual([line for line, message in report.errors], [2, 4])
+
+    def test_imports_refresh_derived_data(self):
+        with mock.patch('dashboard.bulk.refresh_derived') as refresh_derived:
+            self.upload('products.csv', f'id,stock\n{self.lamp.id},9\n')
+            self.upload('products.csv', f'id,stock\n{self.lamp.id},9\n')
+            self.upload('products.csv', f'id,stock\n{self.lamp.id},x\n')
+        # Only the import that changed something
+        refresh_derived.assert_called_once()
+        self.assertEqual(refresh_derived.call_args.args[0], [self.lamp])
+        # Bulk writes skip save signals, so new products are only
+        # searchable through the refresh
+        self.upload('products.csv', 'name,price\nFloor Lamp,80\n')
+        response = self.client.get(reverse('products:product_search'), {'q': 'floor'})
+        self.assertEqual([product.name for product in response.context['products']], ['Floor Lamp'])
+        response = self.client.get(reverse('products:product_autocomplete'), {'q': 'floo'})
+        self.assertIn('Floor Lamp', [result['label'] for result in response.json()['results']])
+
+    def test_export_import_round_trip(self):
+        Product.objects.create(name='Oak, "Solid" Desk', price='199.99', stock=0, available=False,
+                               description='Line one\nLine two')
+        before = list(Product.objects.order_by('id').values())
+        for file_format in bulk.FORMATS:
+            response = self.client.get(reverse('dashboard:product_export'), {'format': file_format})
+            self.assertIn(f'.{file_format}"', response['Content-Disposition'])
+            exported = b''.join(response.streaming_content).decode()
+            report = self.upload(f'products.{file_format}', exported)
+            self.assertEqual((report.rows, report.unchanged, report.error_count), (2, 2, 0))
+            self.assertEqual(list(Product.objects.order_by('id').values()), before)
+        # Edited and imported back
+        response = self.client.get(reverse('dashboard:product_export'),
+                                   {'format': 'csv', 'category': self.lamps.id})
+        exported = b''.join(response.streaming_content).decode()
+        self.assertEqual(exported.count('\r\n'), 2)
+        self.upload('products.csv', exported.replace('20.00', '22.50'))
+        self.lamp.refresh_from_db()
+        self.assertEqual(str(self.lamp.price), '22.50')
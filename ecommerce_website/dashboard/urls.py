@@ -12,10 +12,16 @@ urlpatterns = [
     path('products/add/', views.product_add, name='product_add'),
     path('products/edit/<int:product_id>/', views.product_edit, name='product_edit'),
     path('products/delete/<int:product_id>/', views.product_delete, name='product_delete'),
+    path('products/import/', views.product_import, name='product_import'),
+    path('products/export/', views.product_export, name='product_export'),
     
     # Order management
     path('orders/', views.order_management, name='order_management'),
     path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
     path('orders/<int:order_id>/update-status/', views.update_order_status, name='update_order_status'),
     path('orders/<int:order_id>/add-note/', views.add_order_note, name='add_order_note'),
+    
+    # Background tasks
+    path('tasks/', views.task_queue, name='task_queue'),
+    path('tasks/<int:task_id>/retry/', views.retry_task, name='retry_task'),
 ]
\ No newline at end of file
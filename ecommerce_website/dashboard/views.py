@@ -5,12 +5,31 @@ from django.contrib import messages
 from django.db.models import Q, Sum, Count
 from django.utils.text import slugify
 from django.utils import timezone
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from datetime import timedelta
+from decimal import Decimal, InvalidOperation
 
-from products.models import Product, Category, ProductImage
-from orders.models import Order, OrderItem
-from .forms import ProductForm, OrderStatusForm, OrderNoteForm
+from products.models import Product
+from products import cache
+from orders.models import ArchivedOrder, Order, OrderItem
+from tasks.models import Task
+from tasks import queue
+from .forms import ProductForm, OrderStatusForm, OrderNoteForm, ProductImportForm
+from . import bulk
+
+# Products with less stock than this are listed as low stock
+LOW_STOCK = 5
+
+# Tasks listed on the background tasks page
+TASKS_SHOWN = 50
+
+# Orderings offered on the order management page
+ORDER_SORTS = {
+    'newest': ('-created', '-id'),
+    'oldest': ('created', 'id'),
+    'total_desc': ('-total', '-id'),
+    'total_asc': ('total', 'id'),
+}
 
 # Helper function to check if user is staff
 def is_staff(user):
@@ -21,8 +40,11 @@ def is_staff(user):
 def dashboard_home(request):
     # Get counts for dashboard overview
     total_products = Product.objects.count()
-    total_orders = Order.objects.count()
+    # Archived orders count through their summaries
+    total_orders = Order.objects.count() + ArchivedOrder.objects.count()
     recent_orders = Order.objects.order_by('-created')[:5]
+    total_revenue = sum(orders.filter(paid=True).aggregate(revenue=Sum('total'))['revenue'] or 0
+                        for orders in (Order.objects, ArchivedOrder.objects))
     
     # Get orders from the last 30 days
     thirty_days_ago = timezone.now() - timedelta(days=30)
@@ -32,15 +54,20 @@ def dashboard_home(request):
     pending_orders = Order.objects.filter(status='pending').count()
     
     # Get low stock products (less than 5 items)
-    low_stock_products = Product.objects.filter(stock__lt=5).count()
+    low_stock = Product.objects.filter(stock__lt=LOW_STOCK)
+    low_stock_count = low_stock.count()
+    low_stock_products = low_stock.select_related('category').order_by('stock', 'id')[:10]
     
     context = {
         'total_products': total_products,
         'total_orders': total_orders,
+        'total_revenue': total_revenue,
         'recent_orders': recent_orders,
         'recent_orders_count': recent_orders_count,
         'pending_orders': pending_orders,
+        'low_stock_count': low_stock_count,
         'low_stock_products': low_stock_products,
+        'cache_stats': cache.stats(),
     }
     
     return render(request, 'dashboard/dashboard_home.html', context)
@@ -48,19 +75,28 @@ def dashboard_home(request):
 @login_required
 @user_passes_test(is_staff)
 def product_management(request):
-    products = Product.objects.all().order_by('-created')
-    categories = Category.objects.all()
+    products = Product.objects.for_cards().order_by('-created')
+    categories = cache.get_categories()
     
     # Filter by category if requested
     category_id = request.GET.get('category')
     if category_id:
         products = products.filter(category_id=category_id)
     
+    # Filter by stock level if requested
+    stock = request.GET.get('stock')
+    if stock == 'low':
+        products = products.filter(stock__lt=LOW_STOCK)
+    elif stock == 'out':
+        products = products.filter(stock=0)
+    
     # Search functionality
     search_query = request.GET.get('search')
     if search_query:
         products = products.filter(name__icontains=search_query)
     
+    products = Paginator(products, 20).get_page(request.GET.get('page'))
+    
     context = {
         'products': products,
         'categories': categories,
@@ -90,7 +126,7 @@ def product_add(request):
         messages.success(request, f'Product "{product.name}" has been added successfully.')
         return redirect('dashboard:product_management')
     
-    categories = Category.objects.all()
+    categories = cache.get_categories()
     return render(request, 'dashboard/product_form.html', {
         'categories': categories,
         'title': 'Add Product'
@@ -117,7 +153,7 @@ def product_edit(request, product_id):
         messages.success(request, f'Product "{product.name}" has been updated successfully.')
         return redirect('dashboard:product_management')
     
-    categories = Category.objects.all()
+    categories = cache.get_categories()
     return render(request, 'dashboard/product_form.html', {
         'product': product,
         'categories': categories,
@@ -137,10 +173,58 @@ def product_delete(request, product_id):
     
     return render(request, 'dashboard/product_confirm_delete.html', {'product': product})
 
+@login_required
+@user_passes_test(is_staff)
+def product_import(request):
+    report = None
+    if request.method == 'POST':
+        form = ProductImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            report = bulk.ProductImport().run(upload, bulk.format_for(upload.name))
+            messages.success(request, f'Imported {report.rows} rows: {report.created} created, '
+                                      f'{report.updated} updated, {report.error_count} with errors.')
+    else:
+        form = ProductImportForm()
+    
+    return render(request, 'dashboard/product_import.html', {
+        'form': form,
+        'report': report,
+        'fields': bulk.IMPORT_FIELDS,
+    })
+
+@login_required
+@user_passes_test(is_staff)
+def product_export(request):
+    file_format = request.GET.get('format')
+    if file_format not in bulk.FORMATS:
+        file_format = 'csv'
+    products = Product.objects.all()
+    category_id = request.GET.get('category')
+    if category_id:
+        products = products.filter(category_id=category_id)
+    
+    if file_format == 'csv':
+        response = StreamingHttpResponse(bulk.export_csv(products), content_type='text/csv')
+    else:
+        response = StreamingHttpResponse(bulk.export_jsonl(products), content_type='application/x-ndjson')
+    filename = f'products-{timezone.now():%Y%m%d-%H%M%S}.{file_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def _amount(value):
+    try:
+        return Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+
 @login_required
 @user_passes_test(is_staff)
 def order_management(request):
-    orders = Order.objects.all().order_by('-created')
+    sort = request.GET.get('sort')
+    if sort not in ORDER_SORTS:
+        sort = 'newest'
+    orders = Order.objects.select_related('user').order_by(*ORDER_SORTS[sort])
     
     # Filter by status if requested
     status = request.GET.get('status')
@@ -153,6 +237,14 @@ def order_management(request):
         paid = payment == 'paid'
         orders = orders.filter(paid=paid)
     
+    # Filter by order total, from the stored totals
+    min_total = _amount(request.GET.get('min_total'))
+    if min_total is not None:
+        orders = orders.filter(total__gte=min_total)
+    max_total = _amount(request.GET.get('max_total'))
+    if max_total is not None:
+        orders = orders.filter(total__lte=max_total)
+    
     # Search functionality
     search_query = request.GET.get('search')
     if search_query:
@@ -168,10 +260,13 @@ def order_management(request):
             last_name__icontains=search_query
         )
     
+    orders = Paginator(orders, 20).get_page(request.GET.get('page'))
+    
     context = {
         'orders': orders,
         'selected_status': status,
         'selected_payment': payment,
+        'selected_sort': sort,
         'search_query': search_query,
     }
     
@@ -180,7 +275,7 @@ def order_management(request):
 @login_required
 @user_passes_test(is_staff)
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.select_related('user').with_items(), id=order_id)
     
     return render(request, 'dashboard/order_detail.html', {'order': order})
 
@@ -218,3 +313,35 @@ def add_order_note(request, order_id):
             messages.success(request, 'Note added successfully.')
             
     return redirect('dashboard:order_detail', order_id=order.id)
+
+@login_required
+@user_passes_test(is_staff)
+def task_queue(request):
+    counts = dict(Task.objects.order_by().values_list('state').annotate(Count('id')))
+    tasks = Task.objects.order_by('-created', '-id')
+    
+    # Filter by state if requested
+    state = request.GET.get('state')
+    if state in dict(Task.STATE_CHOICES):
+        tasks = tasks.filter(state=state)
+    else:
+        state = None
+    
+    context = {
+        'counts': [(value, label, counts.get(value, 0)) for value, label in Task.STATE_CHOICES],
+        'tasks': tasks[:TASKS_SHOWN],
+        'selected_state': state,
+    }
+    
+    return render(request, 'dashboard/task_queue.html', context)
+
+@login_required
+@user_passes_test(is_staff)
+def retry_task(request, task_id):
+    if request.method == 'POST':
+        if queue.retry(task_id):
+            messages.success(request, f'Task #{task_id} will be run again.')
+        else:
+            messages.error(request, f'Task #{task_id} has not failed.')
+    
+    return redirect('dashboard:task_queue')
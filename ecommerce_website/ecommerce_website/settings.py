@@ -44,6 +44,8 @@ INSTALLED_APPS = [
     "orders",
     "payment",
     "dashboard",
+    "assets",
+    "tasks",
 ]
 
 MIDDLEWARE = [
@@ -85,10 +87,43 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # Seconds a connection waits for another one's write to finish
+            "timeout": 20,
+        },
+        # A file rather than in memory, so tests of concurrent checkouts and
+        # task workers can open a connection per thread
+        "TEST": {
+            "NAME": BASE_DIR / "test_db.sqlite3",
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Shared by every process, so a change made in one drops the entries
+    # all of them cached (see products.checks). Run createcachetable to
+    # create its table, or point it at Redis or Memcached in production.
+    "catalogue": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "catalogue_cache",
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        },
+    },
+    "template_fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "template_fragments",
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -127,12 +162,86 @@ STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 STATICFILES_DIRS = [BASE_DIR / "static"]
 
+# Asset bundles
+# build_assets writes minified, content-hashed and precompressed copies of
+# static/css and static/js to static/bundles; templates link to them when on
+USE_ASSET_BUNDLES = not DEBUG
+
 # Media files
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
 # Cart settings
 CART_SESSION_ID = 'cart'
+# Where carts are kept: cart.storage.SessionCartStorage, DatabaseCartStorage
+# (kept across devices and logouts) or CacheCartStorage
+CART_STORAGE = 'cart.storage.DatabaseCartStorage'
+CART_CACHE_ALIAS = 'default'
+# Anonymous carts unchanged this long are removed by clear_expired_carts,
+# or expire from the cache storage
+CART_ANONYMOUS_MAX_AGE_DAYS = 30
+
+# Catalogue settings
+PRODUCTS_PER_PAGE = 24
+CATALOGUE_CACHE_ALIAS = 'catalogue'
+CATALOGUE_CACHE_TIMEOUT = 60 * 60
+# Fragment keys include the product's timestamps, so edits never serve stale HTML
+PRODUCT_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+# Resized image variants are generated by a background thread pool
+PRODUCT_IMAGE_VARIANTS_ASYNC = True
+PRODUCT_IMAGE_WORKERS = 2
+
+# Search settings
+SEARCH_RESULTS_PER_PAGE = 24
+# Text search configuration used for stemming on PostgreSQL
+PRODUCT_SEARCH_LANGUAGE = 'english'
+AUTOCOMPLETE_LIMIT = 8
+# Seconds before the in-process autocomplete index is rebuilt from the database,
+# in the background while the old one keeps serving
+AUTOCOMPLETE_INDEX_MAX_AGE = 5 * 60
+
+# Catalogue feed settings
+# Products fetched per database round trip while streaming the feed
+CATALOGUE_FEED_CHUNK_SIZE = 2000
+
+# Order settings
+# Minutes stock stays reserved for an unpaid order; at least 30 so Stripe
+# checkout sessions can be given the same lifetime
+STOCK_RESERVATION_MINUTES = 60
+# Orders per order history page
+ORDERS_PER_PAGE = 10
+# Delivered and cancelled orders older than this are moved to archive files
+ORDER_ARCHIVE_AFTER_DAYS = 730
+ORDER_ARCHIVE_ROOT = BASE_DIR / "archive"
+
+# Background task settings
+# Tasks each runworker process runs at once, in threads
+TASK_WORKER_CONCURRENCY = 4
+# Seconds an idle worker waits before looking for due tasks again
+TASK_POLL_INTERVAL = 1
+# Seconds a task stays claimed unless its worker renews the claim, which
+# running workers do every third of this
+TASK_LEASE_SECONDS = 300
+# Seconds before the first retry of a failed task, doubling per retry
+TASK_RETRY_DELAY = 10
+TASK_RETRY_MAX_DELAY = 60 * 60
+# Days succeeded tasks, and their idempotency keys, are kept
+TASK_KEEP_DAYS = 7
+
+# Recommendation settings
+# Co-purchased products kept per product, and how many are shown
+RECOMMENDATIONS_PER_PRODUCT = 10
+RECOMMENDATIONS_SHOWN = 4
+# Orders with more distinct products than this are left out of the counts
+RECOMMENDATIONS_MAX_BASKET = 50
+RECOMMENDATIONS_CACHE_TIMEOUT = 60 * 60
+
+# Bestseller settings
+# Days of paid orders counted when the rankings are refreshed
+BESTSELLER_WINDOW_DAYS = 90
+BESTSELLERS_SHOWN = 8
+CATEGORY_BESTSELLERS_SHOWN = 3
+BESTSELLERS_CACHE_TIMEOUT = 60 * 15
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
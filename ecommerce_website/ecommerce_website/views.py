@@ -1,12 +1,15 @@
 from django.shortcuts import render
-from products.models import Product, Category
+from products import cache
+from products.conditional import catalogue_condition
+from orders import bestsellers
 
+@catalogue_condition
 def home(request):
-    # Get featured products (for simplicity, we'll just get the latest products)
-    featured_products = Product.objects.filter(available=True)[:8]
+    # Feature the bestsellers, topped up from the catalogue in a new shop
+    featured_products = bestsellers.top_products(fill=True)
     
     # Get all categories
-    categories = Category.objects.all()
+    categories = cache.get_categories()
     
     return render(request, 'home.html', {
         'featured_products': featured_products,
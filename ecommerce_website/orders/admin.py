@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem
+from .models import ArchivedOrder, Order, OrderItem
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -9,9 +9,15 @@ class OrderItemInline(admin.TabularInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'first_name', 'last_name', 'email',
-                    'address', 'postal_code', 'city', 'paid',
+                    'address', 'postal_code', 'city', 'total', 'paid',
                     'created', 'updated', 'status']
     list_filter = ['paid', 'created', 'updated', 'status']
     search_fields = ['first_name', 'last_name', 'email', 'address']
     inlines = [OrderItemInline]
     list_editable = ['paid', 'status']
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'created', 'status', 'paid', 'total', 'archive', 'archived']
+    list_filter = ['paid', 'status', 'created']
+    raw_id_fields = ['user']
@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from itertools import groupby, islice
+from pathlib import Path
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from products.models import Product
+from .models import ArchivedOrder, Order, OrderItem
+from . import totals
+
+# Old orders are moved out of the order tables into gzipped JSON lines
+# files, one directory per month of placement under ORDER_ARCHIVE_ROOT:
+#
+#     2023/04/orders-20250101T030000.jsonl.gz
+#
+# Each line holds an order and its lines. An ArchivedOrder summary stays
+# behind for reports, naming the file to restore the order from.
+
+# Orders in these states don't change any more
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+
+
+def archive_root():
+    return Path(getattr(settings, 'ORDER_ARCHIVE_ROOT', settings.BASE_DIR / 'archive'))
+
+
+def archivable(before=None):
+    """
+    Return the finished orders placed before the given time, by default
+    ORDER_ARCHIVE_AFTER_DAYS ago.
+    """
+    if before is None:
+        before = timezone.now() - timedelta(days=getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 730))
+    return Order.objects.filter(created__lt=before, status__in=ARCHIVABLE_STATUSES) \
+        .exclude(stock='reserved')
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _dump(obj):
+    # value_to_string keeps full precision, as in products.pagination
+    return {field.attname: None if field.value_from_object(obj) is None else field.value_to_string(obj)
+            for field in obj._meta.concrete_fields}
+
+
+def _load(model, values):
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    return model(**{name: None if value is None else fields[name].to_python(value)
+                    for name, value in values.items()})
+
+
+def read(path):
+    """
+    Yield (order, [lines]) from an archive file as unsaved instances.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            yield _load(Order, record['order']), [_load(OrderItem, item) for item in record['items']]
+
+
+def _write(path, orders, batch_size):
+    """
+    Stream the orders with their lines into a new archive file and return
+    the number written. The file only gets its name once complete.
+    """
+    partial = path.with_name(f'{path.name}.partial')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    with gzip.open(partial, 'wt', encoding='utf-8') as f:
+        for batch in _batches(orders.order_by('id').iterator(chunk_size=batch_size), batch_size):
+            items = OrderItem.objects.filter(order__in=[order.id for order in batch]).order_by('order_id', 'id')
+            lines = {order_id: list(rows) for order_id, rows in
+                     groupby(items.iterator(chunk_size=batch_size), key=lambda item: item.order_id)}
+            for order in batch:
+                f.write(json.dumps({'order': _dump(order),
+                                    'items': [_dump(item) for item in lines.get(order.id, [])]}) + '\n')
+            written += len(batch)
+    if not written:
+        partial.unlink()
+        return 0
+    with open(partial, 'rb') as f:
+        os.fsync(f.fileno())
+    partial.replace(path)
+    return written
+
+
+def _delete_lines(order_ids):
+    # A plain DELETE rather than QuerySet.delete(), which would collect the
+    # lines and send their delete signals, recomputing the totals of orders
+    # that are going away
+    if not order_ids:
+        return
+    table = connection.ops.quote_name(OrderItem._meta.db_table)
+    column = connection.ops.quote_name(OrderItem._meta.get_field('order').column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(order_ids))})',
+                       list(order_ids))
+
+
+def _remove(path, name, started, batch_size):
+    """
+    Delete the orders of a complete archive file from the order tables,
+    leaving summaries. Orders changed since archiving started are kept;
+    a later run archives them again.
+    """
+    removed = 0
+    for batch in _batches(read(path), batch_size):
+        with transaction.atomic():
+            ids = set(Order.objects.filter(id__in=[order.id for order, items in batch], updated__lt=started)
+                      .values_list('id', flat=True))
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(id=order.id, user_id=order.user_id, created=order.created, status=order.status,
+                              paid=order.paid, item_count=order.item_count, total=order.total, archive=name)
+                for order, items in batch if order.id in ids])
+            _delete_lines(ids)
+            Order.objects.filter(id__in=ids).delete()
+        removed += len(ids)
+    return removed
+
+
+def archive(before=None, batch_size=500):
+    """
+    Move archivable orders to one new archive file per month they were
+    placed in. Memory use depends on the batch size, not on the number of
+    orders. Returns the number of orders archived.
+    """
+    started = timezone.now()
+    orders = archivable(before).filter(updated__lt=started)
+    archived = 0
+    for month in orders.datetimes('created', 'month'):
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        name = f'{month:%Y/%m}/orders-{started:%Y%m%dT%H%M%S}.jsonl.gz'
+        path = archive_root() / name
+        if _write(path, orders.filter(created__gte=month, created__lt=next_month), batch_size):
+            archived += _remove(path, name, started, batch_size)
+    return archived
+
+
+def restore(name, order_ids=None, batch_size=500):
+    """
+    Put archived orders from an archive file back into the order tables,
+    all of them or those with the given ids. Lines of products deleted
+    since are left out and the totals of their orders recomputed. Returns
+    the number restored.
+    """
+    restored = 0
+    for batch in _batches(read(archive_root() / name), batch_size):
+        ids = [order.id for order, items in batch]
+        if order_ids is not None:
+            ids = [order_id for order_id in ids if order_id in order_ids]
+        with transaction.atomic():
+            # Only orders archived to this file and not restored yet
+            summaries = ArchivedOrder.objects.filter(id__in=ids, archive=name)
+            wanted = set(summaries.values_list('id', flat=True))
+            orders = [order for order, items in batch if order.id in wanted]
+            # Inserting sets created and updated to now, so they're put back after
+            stamps = [(order.created, order.updated) for order in orders]
+            Order.objects.bulk_create(orders)
+            for order, (created, updated) in zip(orders, stamps):
+                order.created, order.updated = created, updated
+            Order.objects.bulk_update(orders, ['created', 'updated'])
+            # Lines of products deleted since archiving go, as the product's
+            # deletion took them from orders that weren't archived
+            lines = [item for order, items in batch if order.id in wanted for item in items]
+            products = set(Product.objects.filter(id__in={item.product_id for item in lines})
+                           .values_list('id', flat=True))
+            OrderItem.objects.bulk_create([item for item in lines if item.product_id in products])
+            totals.recalculate(Order.objects.filter(
+                id__in={item.order_id for item in lines if item.product_id not in products}))
+            summaries.delete()
+        restored += len(orders)
+    return restored
@@ -0,0 +1,94 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from products import cache
+from products.models import Product
+from .models import OrderItem, ProductSales
+
+# Namespace of the ranked id lists in the catalogue cache
+CACHE_NAMESPACE = 'bestsellers'
+
+
+def refresh(batch_size=2000):
+    """
+    Recompute sales of every product from the paid orders placed within
+    BESTSELLER_WINDOW_DAYS, dropping older sales from the rankings.
+    """
+    since = timezone.now() - timedelta(days=getattr(settings, 'BESTSELLER_WINDOW_DAYS', 90))
+    totals = OrderItem.objects.filter(order__paid=True, order__created__gte=since) \
+        .values('product_id', 'product__category_id').annotate(units=Sum('quantity'))
+    with transaction.atomic():
+        ProductSales.objects.all().delete()
+        ProductSales.objects.bulk_create(
+            (ProductSales(product_id=row['product_id'], category_id=row['product__category_id'],
+                          units=row['units']) for row in totals.iterator()),
+            batch_size=batch_size)
+    cache.invalidate(CACHE_NAMESPACE)
+    return ProductSales.objects.count()
+
+
+def record_order(order_id):
+    """
+    Add the units of a newly paid order to the rankings.
+    """
+    units = Counter()
+    categories = {}
+    for product_id, category_id, quantity in OrderItem.objects.filter(order_id=order_id) \
+            .values_list('product_id', 'product__category_id', 'quantity'):
+        units[product_id] += quantity
+        categories[product_id] = category_id
+    if not units:
+        return
+    with transaction.atomic():
+        ProductSales.objects.bulk_create(
+            [ProductSales(product_id=product_id, category_id=categories[product_id])
+             for product_id in units],
+            ignore_conflicts=True)
+        for product_id, quantity in units.items():
+            ProductSales.objects.filter(product_id=product_id).update(units=F('units') + quantity)
+    cache.invalidate(CACHE_NAMESPACE)
+
+
+def move_category(product_id, category_id):
+    """
+    Rank a product's sales under the category it was moved to.
+    """
+    if ProductSales.objects.filter(product_id=product_id).exclude(category_id=category_id) \
+            .update(category_id=category_id):
+        transaction.on_commit(lambda: cache.invalidate(CACHE_NAMESPACE))
+
+
+def ranked_ids(category_id=None, limit=8):
+    """
+    Return the ids of the best selling available products, through the
+    catalogue cache.
+    """
+    key = cache.key(CACHE_NAMESPACE, f'{category_id or "all"}:{limit}')
+    ids = cache.get_cache().get(key)
+    if ids is None:
+        sales = ProductSales.objects.filter(units__gt=0, product__available=True)
+        if category_id:
+            # The product's own category is checked too, in case a bulk
+            # update moved it without the signal keeping this in step
+            sales = sales.filter(category_id=category_id, product__category_id=category_id)
+        ids = list(sales.order_by('-units', 'product_id').values_list('product_id', flat=True)[:limit])
+        cache.get_cache().set(key, ids, getattr(settings, 'BESTSELLERS_CACHE_TIMEOUT', 60 * 15))
+    return ids
+
+
+def top_products(category=None, limit=None, fill=False):
+    """
+    Return the best selling products, overall or in a category. With
+    fill, a shop with too few sales is topped up with its newest products.
+    """
+    limit = limit or getattr(settings, 'BESTSELLERS_SHOWN', 8)
+    ids = ranked_ids(category.id if category else None, limit)
+    products = Product.objects.available().for_cards()
+    found = products.in_bulk(ids) if ids else {}
+    ranked = [found[product_id] for product_id in ids if product_id in found]
+    if fill and len(ranked) < limit:
+        ranked += products.exclude(id__in=ids).order_by('-created')[:limit - len(ranked)]
+    return ranked
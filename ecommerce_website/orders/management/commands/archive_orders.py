@@ -0,0 +1,22 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders import archive
+
+
+class Command(BaseCommand):
+    help = 'Move finished orders older than ORDER_ARCHIVE_AFTER_DAYS to compressed archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Archive orders placed more than this many days ago instead')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of orders read and deleted per query')
+
+    def handle(self, *args, **options):
+        before = None
+        if options['days'] is not None:
+            before = timezone.now() - timedelta(days=options['days'])
+        self.stdout.write(f'Archiving orders to {archive.archive_root()}...')
+        archived = archive.archive(before=before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully archived {archived} orders'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from orders import totals
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Store the subtotal, item count and total of orders from their lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of orders summed and written per query')
+        parser.add_argument('--missing', action='store_true',
+                            help='Only orders without a stored item count')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['missing']:
+            orders = orders.filter(item_count=0)
+        self.stdout.write('Summing order lines...')
+        updated = totals.recalculate(orders, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully updated {updated} orders'))
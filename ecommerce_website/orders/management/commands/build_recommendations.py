@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from orders import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Recompute "frequently bought together" recommendations from paid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of rows written per query')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Counting co-purchases in paid orders...')
+        pairs, products = recommendations.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully stored {pairs} co-purchase counts for {products} products'))
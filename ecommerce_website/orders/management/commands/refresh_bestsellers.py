@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from orders import bestsellers
+
+
+class Command(BaseCommand):
+    help = 'Recompute the bestseller rankings from recent paid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of rows written per query')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Counting units sold in paid orders...')
+        products = bestsellers.refresh(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully ranked {products} products'))
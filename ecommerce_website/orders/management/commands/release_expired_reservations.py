@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from orders import stock
+
+
+class Command(BaseCommand):
+    help = 'Return the stock held by unpaid orders whose reservation has run out'
+
+    def handle(self, *args, **options):
+        total = 0
+        # Released in batches until none are left
+        while True:
+            released = stock.release_expired()
+            total += released
+            if not released:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Successfully released {total} reservations'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from orders import archive
+from orders.models import ArchivedOrder
+
+
+class Command(BaseCommand):
+    help = 'Put archived orders back into the order tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archives', nargs='*',
+                            help='Archive files, relative to ORDER_ARCHIVE_ROOT, to restore all orders of')
+        parser.add_argument('--order', type=int, action='append', dest='order_ids',
+                            help='Restore only this order; may be repeated')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of orders inserted per query')
+
+    def handle(self, *args, **options):
+        order_ids = set(options['order_ids'] or ()) or None
+        archives = options['archives']
+        if not archives:
+            if order_ids is None:
+                raise CommandError('Name the archive files or the orders to restore.')
+            archives = sorted(set(ArchivedOrder.objects.filter(id__in=order_ids)
+                                  .values_list('archive', flat=True)))
+        restored = 0
+        for name in archives:
+            if not (archive.archive_root() / name).exists():
+                raise CommandError(f'No archive file {name}')
+            restored += archive.restore(name, order_ids=order_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully restored {restored} orders'))
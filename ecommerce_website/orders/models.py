@@ -1,6 +1,15 @@
 from django.db import models
 from django.conf import settings
-from products.models import Product
+from products.models import Category, Product
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        """
+        Load the lines of the orders with their products in one more query.
+        """
+        return self.prefetch_related(models.Prefetch(
+            'items', queryset=OrderItem.objects.select_related('product__primary_image').order_by('id')))
+
 
 class Order(models.Model):
     STATUS_CHOICES = (
@@ -27,17 +36,61 @@ class Order(models.Model):
                              default='pending')
     paid = models.BooleanField(default=False)
     stripe_id = models.CharField(max_length=250, blank=True)
+    # Stock held for the order until it is paid or the hold runs out
+    STOCK_CHOICES = (
+        ('reserved', 'Reserved'),
+        ('released', 'Released'),
+        ('taken', 'Taken'),
+    )
+    stock = models.CharField(max_length=10, choices=STOCK_CHOICES, blank=True)
+    reserved_until = models.DateTimeField(null=True, blank=True)
+    # Sums of the lines, kept by orders.totals
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    
+    objects = OrderQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created']
         indexes = [
             models.Index(fields=['-created']),
+            # Order history, and the dashboard order filters, newest first
+            models.Index(fields=['user', '-created'], name='order_user_created_idx'),
+            models.Index(fields=['status', '-created'], name='order_status_created_idx'),
+            models.Index(fields=['paid', '-created'], name='order_paid_created_idx'),
+            # Orders by amount, and the revenue of paid orders from the index alone
+            models.Index(fields=['total'], name='order_total_idx'),
+            models.Index(fields=['paid', 'total'], name='order_paid_total_idx'),
+            # Expired stock reservations
+            models.Index(fields=['reserved_until'], condition=models.Q(stock='reserved'),
+                         name='order_reserved_until_idx'),
         ]
     
     def __str__(self):
         return f'Order {self.id}'
     
+    # Only orders.stock and orders.totals change these, with their own
+    # updates, so saving an instance loaded earlier must not write them back
+    STOCK_FIELDS = ('stock', 'reserved_until')
+    TOTAL_FIELDS = ('subtotal', 'item_count', 'total')
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key
+                                       and field.name not in self.STOCK_FIELDS + self.TOTAL_FIELDS]
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember whether co-purchases were already counted for this order
+        instance._was_paid = instance.paid
+        return instance
+    
     def get_total_cost(self):
+        # Loads the lines; lists of orders should show the stored total
         return sum(item.get_cost() for item in self.items.all())
     
     def get_stripe_url(self):
@@ -67,3 +120,77 @@ class OrderItem(models.Model):
     
     def get_cost(self):
         return self.price * self.quantity
+
+
+class CoPurchase(models.Model):
+    """
+    Number of paid orders containing both products: one cell of the sparse
+    item-to-item co-occurrence matrix, stored for both orderings of a pair.
+    """
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    other = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    orders = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('product', 'other')
+        indexes = [
+            # Top neighbours of a product
+            models.Index(fields=['product', '-orders']),
+        ]
+
+
+class Recommendation(models.Model):
+    """
+    The top co-purchased products of a product, best first.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='+',
+                                   on_delete=models.CASCADE)
+    neighbours = models.JSONField(default=list)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class ProductSales(models.Model):
+    """
+    Units of a product sold in paid orders within the bestseller window,
+    indexed for ranking overall and within the product's category.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='sales',
+                                   on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name='+', null=True, blank=True,
+                                 on_delete=models.SET_NULL)
+    units = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = 'product sales'
+        indexes = [
+            models.Index(fields=['-units', 'product'], name='sales_rank_idx'),
+            models.Index(fields=['category', '-units', 'product'], name='sales_category_rank_idx'),
+        ]
+
+
+class ArchivedOrder(models.Model):
+    """
+    What reports need of an order moved to the archive by orders.archive;
+    the order and its lines are in the archive file.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='archived_orders', null=True,
+                             blank=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Order.STATUS_CHOICES)
+    paid = models.BooleanField(default=False)
+    item_count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Relative to ORDER_ARCHIVE_ROOT
+    archive = models.CharField(max_length=200)
+    archived = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created']
+        indexes = [
+            models.Index(fields=['user', '-created'], name='archived_user_created_idx'),
+            models.Index(fields=['paid', 'total'], name='archived_paid_total_idx'),
+        ]
+    
+    def __str__(self):
+        return f'Archived order {self.id}'
@@ -0,0 +1,158 @@
+import heapq
+from collections import Counter, defaultdict
+from itertools import groupby, permutations
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from products import cache
+from products.models import Product
+from .models import CoPurchase, OrderItem, Recommendation
+
+
+def _top_k():
+    return getattr(settings, 'RECOMMENDATIONS_PER_PRODUCT', 10)
+
+
+def _max_basket():
+    return getattr(settings, 'RECOMMENDATIONS_MAX_BASKET', 50)
+
+
+# Namespace of the neighbour lists in the catalogue cache
+CACHE_NAMESPACE = 'recommendations'
+
+
+def _cache_key(product_id):
+    return cache.key(CACHE_NAMESPACE, product_id)
+
+
+def paid_baskets():
+    """
+    Yield the distinct product ids of every paid order, one order at a time.
+    """
+    items = OrderItem.objects.filter(order__paid=True).order_by('order_id') \
+        .values_list('order_id', 'product_id')
+    for order_id, rows in groupby(items.iterator(chunk_size=5000), key=lambda row: row[0]):
+        yield {product_id for order_id, product_id in rows}
+
+
+def count_pairs(baskets):
+    """
+    Return a Counter of (product, other) co-occurrences over the baskets.
+
+    Baskets larger than RECOMMENDATIONS_MAX_BASKET are skipped: they add
+    quadratically many pairs and say little about any one of them.
+    """
+    counts = Counter()
+    max_basket = _max_basket()
+    for basket in baskets:
+        if 1 < len(basket) <= max_basket:
+            counts.update(permutations(sorted(basket), 2))
+    return counts
+
+
+def top_neighbours(counts, k):
+    """
+    Return {product: [other, ...]} keeping the k most co-purchased others,
+    ties broken by lower id.
+    """
+    by_product = defaultdict(list)
+    for (product_id, other_id), orders in counts.items():
+        by_product[product_id].append((orders, other_id))
+    return {
+        product_id: [other_id for orders, other_id in
+                     heapq.nsmallest(k, pairs, key=lambda pair: (-pair[0], pair[1]))]
+        for product_id, pairs in by_product.items()
+    }
+
+
+def rebuild(batch_size=2000):
+    """
+    Recompute the whole co-occurrence matrix and every product's top
+    neighbours from paid orders.
+    """
+    counts = count_pairs(paid_baskets())
+    neighbours = top_neighbours(counts, _top_k())
+    with transaction.atomic():
+        CoPurchase.objects.all().delete()
+        CoPurchase.objects.bulk_create(
+            (CoPurchase(product_id=p, other_id=o, orders=n) for (p, o), n in counts.items()),
+            batch_size=batch_size)
+        Recommendation.objects.all().delete()
+        Recommendation.objects.bulk_create(
+            (Recommendation(product_id=p, neighbours=ids) for p, ids in neighbours.items()),
+            batch_size=batch_size)
+    cache.invalidate(CACHE_NAMESPACE)
+    return len(counts), len(neighbours)
+
+
+def record_order(order_id):
+    """
+    Add the co-purchases of a newly paid order and refresh the top
+    neighbours of its products.
+
+    Orders that stop being paid are not subtracted; the next rebuild
+    corrects for them.
+    """
+    product_ids = sorted(set(OrderItem.objects.filter(order_id=order_id)
+                             .values_list('product_id', flat=True)))
+    if not 1 < len(product_ids) <= _max_basket():
+        return
+    with transaction.atomic():
+        # Insert missing cells at zero, then increment all of them, so
+        # concurrent orders sharing a pair can't lose a count
+        CoPurchase.objects.bulk_create(
+            [CoPurchase(product_id=p, other_id=o) for p, o in permutations(product_ids, 2)],
+            ignore_conflicts=True)
+        CoPurchase.objects.filter(product__in=product_ids, other__in=product_ids) \
+            .exclude(product=F('other')).update(orders=F('orders') + 1)
+        refresh_neighbours(product_ids)
+    cache.get_cache().delete_many([_cache_key(product_id) for product_id in product_ids])
+    cache.touch()
+
+
+def refresh_neighbours(product_ids):
+    k = _top_k()
+    for product_id in product_ids:
+        neighbours = list(CoPurchase.objects.filter(product_id=product_id)
+                          .order_by('-orders', 'other_id').values_list('other_id', flat=True)[:k])
+        Recommendation.objects.update_or_create(product_id=product_id,
+                                                defaults={'neighbours': neighbours})
+
+
+def neighbour_ids(product_ids):
+    """
+    Return {product id: [neighbour ids]} through the catalogue cache.
+    """
+    keys = {product_id: _cache_key(product_id) for product_id in product_ids}
+    cached = cache.get_cache().get_many(keys.values())
+    found = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+    missing = [product_id for product_id in product_ids if product_id not in found]
+    if missing:
+        loaded = dict(Recommendation.objects.filter(product_id__in=missing)
+                      .values_list('product_id', 'neighbours'))
+        loaded = {product_id: loaded.get(product_id, []) for product_id in missing}
+        cache.get_cache().set_many(
+            {keys[product_id]: ids for product_id, ids in loaded.items()},
+            getattr(settings, 'RECOMMENDATIONS_CACHE_TIMEOUT', 60 * 60))
+        found.update(loaded)
+    return found
+
+
+def recommended_products(product_ids, limit=None):
+    """
+    Return available products frequently bought with the given ones,
+    excluding them. Neighbours shared by several of the products rank by
+    their best position in any list.
+    """
+    limit = limit or getattr(settings, 'RECOMMENDATIONS_SHOWN', 4)
+    product_ids = [int(product_id) for product_id in product_ids]
+    ranks = {}
+    for neighbours in neighbour_ids(product_ids).values():
+        for rank, other_id in enumerate(neighbours):
+            if other_id not in product_ids:
+                ranks[other_id] = min(rank, ranks.get(other_id, rank))
+    if not ranks:
+        return []
+    ordered = sorted(ranks, key=lambda other_id: (ranks[other_id], other_id))
+    products = Product.objects.available().for_cards().in_bulk(ordered)
+    return [products[other_id] for other_id in ordered if other_id in products][:limit]
@@ -0,0 +1,56 @@
+from django.db import transaction
+from products.models import Product
+from .models import OrderItem
+from . import stock, totals
+
+
+class OrderNotPlaced(Exception):
+    """
+    Raised with the products that stop an order from being placed; nothing
+    is saved.
+    """
+    message = 'Some products in your cart can no longer be ordered'
+
+    def __init__(self, product_ids, names=()):
+        super().__init__(f'{self.message}: {product_ids}')
+        self.product_ids = product_ids
+        self.names = list(names)
+
+
+class UnavailableProducts(OrderNotPlaced):
+    message = 'No longer available'
+
+
+class OutOfStock(OrderNotPlaced):
+    message = 'Not enough stock left'
+
+
+def place_order(order, quantities):
+    """
+    Save a new order with {product id: quantity} lines and reserve their
+    stock, in one transaction and a fixed number of queries however many
+    lines there are.
+
+    Lines are priced from the products as they are now, not from the
+    prices the cart was filled at.
+    """
+    products = Product.objects.only('id', 'name', 'price', 'available').in_bulk(list(quantities))
+    unavailable = [product_id for product_id in quantities
+                   if product_id not in products or not products[product_id].available]
+    if unavailable:
+        raise UnavailableProducts(unavailable, [products[product_id].name for product_id in unavailable
+                                                if product_id in products])
+    with transaction.atomic():
+        try:
+            # Taken before the order is inserted, which saves it with the reservation
+            stock.reserve(order, quantities)
+        except stock.InsufficientStock as e:
+            raise OutOfStock(e.product_ids, [products[product_id].name for product_id in e.product_ids])
+        lines = [OrderItem(product=products[product_id], price=products[product_id].price, quantity=quantity)
+                 for product_id, quantity in quantities.items()]
+        totals.set_totals(order, *totals.line_totals((line.price, line.quantity) for line in lines))
+        order.save()
+        for line in lines:
+            line.order = order
+        OrderItem.objects.bulk_create(lines)
+    return order
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from tasks.queue import enqueue
+from products.models import Product
+from .models import Order, OrderItem
+from . import bestsellers, stock, tasks, totals
+
+
+@receiver(post_save, sender=Order)
+def record_paid_order(sender, instance, raw=False, **kwargs):
+    # Count each order once, when it first becomes paid
+    if raw or not instance.paid or getattr(instance, '_was_paid', False):
+        return
+    instance._was_paid = True
+    order_id = instance.id
+    stock.confirm(order_id)
+    # Queued with the payment, and counted by the task worker
+    enqueue(tasks.record_co_purchases, key=f'co-purchases:{order_id}', order_id=order_id)
+    enqueue(tasks.record_sales, key=f'sales:{order_id}', order_id=order_id)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, raw=False, **kwargs):
+    # Lines changed one at a time, e.g. in the admin; bulk changes call
+    # orders.totals themselves
+    if not raw:
+        totals.recalculate(Order.objects.filter(pk=instance.order_id))
+
+
+@receiver(post_save, sender=Product)
+def move_product_sales(sender, instance, created=False, raw=False, **kwargs):
+    # Sales are ranked per category from a copy of the product's category
+    if not created and not raw:
+        bestsellers.move_category(instance.pk, instance.category_id)
@@ -0,0 +1,173 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+from products import cache
+from products.models import Product
+from .models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+# Stock is held with a conditional UPDATE (stock >= quantity) instead of
+# SELECT ... FOR UPDATE, so product rows are only locked from that one
+# statement to the end of its transaction; checkouts of a hot product
+# don't queue behind each other's whole request.
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough stock for products {product_ids}')
+        self.product_ids = product_ids
+
+
+def reservation_timeout():
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_MINUTES', 60))
+
+
+def _invalidate(product_ids):
+    # Cached product pages show the stock
+    transaction.on_commit(lambda: [cache.invalidate_product(product_id) for product_id in product_ids])
+
+
+def _per_product(quantities):
+    return Case(*[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+                output_field=PositiveIntegerField())
+
+
+def take(quantities):
+    """
+    Take {product id: quantity} out of stock, all or nothing, in one
+    UPDATE however many products there are. Raises InsufficientStock
+    naming the products that are short.
+    """
+    if not quantities:
+        return
+    quantity = _per_product(quantities)
+    try:
+        # A savepoint, so a partial update is undone even if the caller
+        # carries on with its transaction
+        with transaction.atomic():
+            taken = Product.objects.filter(pk__in=list(quantities), stock__gte=quantity) \
+                .update(stock=F('stock') - quantity, updated=timezone.now())
+            if taken < len(quantities):
+                raise InsufficientStock(list(quantities))
+    except InsufficientStock:
+        enough = set(Product.objects.filter(pk__in=list(quantities), stock__gte=quantity)
+                     .values_list('id', flat=True))
+        # Stock that came back in the meantime still counts as short this time
+        raise InsufficientStock(sorted(set(quantities) - enough) or sorted(quantities))
+    _invalidate(list(quantities))
+
+
+def put_back(quantities):
+    if not quantities:
+        return
+    quantity = _per_product(quantities)
+    Product.objects.filter(pk__in=list(quantities)) \
+        .update(stock=F('stock') + quantity, updated=timezone.now())
+    _invalidate(list(quantities))
+
+
+def order_quantities(order_id):
+    quantities = Counter()
+    for product_id, quantity in OrderItem.objects.filter(order_id=order_id) \
+            .values_list('product_id', 'quantity'):
+        quantities[product_id] += quantity
+    return quantities
+
+
+def reserve(order, quantities):
+    """
+    Take the stock of a new order and hold it for the reservation timeout.
+    An order not saved yet gets the reservation when it is inserted.
+
+    If some products are short, expired reservations holding them are
+    released first and the order is tried once more.
+    """
+    try:
+        take(quantities)
+    except InsufficientStock as e:
+        if not release_expired(product_ids=e.product_ids):
+            raise
+        take(quantities)
+    order.stock = 'reserved'
+    order.reserved_until = timezone.now() + reservation_timeout()
+    if order.pk is not None:
+        Order.objects.filter(pk=order.pk).update(stock=order.stock, reserved_until=order.reserved_until)
+
+
+def hold(order):
+    """
+    Extend the reservation of an unpaid order, reserving its stock again
+    if the reservation was released. Returns False if that isn't possible.
+    """
+    reserved_until = timezone.now() + reservation_timeout()
+    if Order.objects.filter(pk=order.pk, paid=False, stock='reserved') \
+            .update(reserved_until=reserved_until):
+        order.reserved_until = reserved_until
+        return True
+    try:
+        with transaction.atomic():
+            if not Order.objects.filter(pk=order.pk, paid=False, stock='released') \
+                    .update(stock='reserved', reserved_until=reserved_until, status='pending'):
+                # Paid orders, and older orders without a reservation, need no hold
+                return order.paid or order.stock == ''
+            take(order_quantities(order.pk))
+    except InsufficientStock:
+        return False
+    order.stock, order.reserved_until, order.status = 'reserved', reserved_until, 'pending'
+    return True
+
+
+def release(order_id):
+    """
+    Return the stock held by an unpaid order and cancel it. Returns False
+    if the order holds no reservation, e.g. because it was paid meanwhile.
+    """
+    with transaction.atomic():
+        # Claiming the release with a conditional update makes it happen once
+        if not Order.objects.filter(pk=order_id, paid=False, stock='reserved') \
+                .update(stock='released', reserved_until=None, status='cancelled'):
+            return False
+        put_back(order_quantities(order_id))
+    return True
+
+
+def release_expired(product_ids=None, limit=100):
+    """
+    Release reservations past their timeout, optionally only those holding
+    some of the given products. Returns the number released.
+    """
+    expired = Order.objects.filter(stock='reserved', paid=False, reserved_until__lt=timezone.now())
+    if product_ids is not None:
+        expired = expired.filter(id__in=OrderItem.objects.filter(product__in=product_ids)
+                                 .values('order_id'))
+    released = 0
+    for order_id in expired.order_by('reserved_until').values_list('id', flat=True)[:limit]:
+        released += release(order_id)
+    return released
+
+
+def confirm(order_id):
+    """
+    Keep the stock of a newly paid order for good.
+
+    If the reservation ran out before the payment came in, the stock is
+    taken again when there is enough; otherwise the order is paid but
+    oversold, which is logged for the shop to sort out.
+    """
+    with transaction.atomic():
+        if Order.objects.filter(pk=order_id, stock='reserved').update(stock='taken', reserved_until=None):
+            return True
+        if not Order.objects.filter(pk=order_id, stock='released').update(stock='taken'):
+            return True
+        try:
+            take(order_quantities(order_id))
+        except InsufficientStock as e:
+            logger.warning('Order %s was paid after its stock reservation expired and '
+                           'products %s are out of stock', order_id, e.product_ids)
+            return False
+    return True
@@ -0,0 +1,12 @@
+from tasks.queue import task
+from . import bestsellers, recommendations
+
+
+@task()
+def record_co_purchases(order_id):
+    recommendations.record_order(order_id)
+
+
+@task()
+def record_sales(order_id):
+    bestsellers.record_order(order_id)
@@ -1,3 +1,512 @@
-from django.test import TestCase
+import gzip
+import json
+import statistics
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from products import cache
+from products.models import Category, Product
+from products.tests import QueryPlanTestCase
+from tasks import queue
+from .models import ArchivedOrder, CoPurchase, Order, OrderItem, Recommendation
+from .recommendations import recommended_products
+from . import archive, bestsellers, stock
 
-# Create your tests here.
+
+def create_order(user, products, **kwargs):
+    order = Order.objects.create(user=user, first_name='Ada', last_name='Lovelace',
+                                 email='ada@example.com', address='1 Main St',
+                                 postal_code='12345', city='London', **kwargs)
+    for product in products:
+        OrderItem.objects.create(order=order, product=product, price=product.price)
+    return order
+
+
+ADDRESS = {'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com',
+           'address': '1 Main St', 'postal_code': '12345', 'city': 'London'}
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.lamp = Product.objects.create(name='Lamp', price=10, stock=3)
+        cls.desk = Product.objects.create(name='Desk', price=100, stock=1)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def checkout(self, *lines):
+        for product, quantity in lines:
+            self.client.post(reverse('cart:cart_add', args=[product.id]), {'quantity': quantity})
+        return self.client.post(reverse('orders:order_create'), ADDRESS)
+
+    def stock_of(self, product):
+        return Product.objects.get(pk=product.pk).stock
+
+    def test_order_reserves_stock(self):
+        response = self.checkout((self.lamp, 2), (self.desk, 1))
+        self.assertRedirects(response, reverse('payment:process'), fetch_redirect_response=False)
+        order = Order.objects.get()
+        self.assertEqual((order.stock, self.stock_of(self.lamp), self.stock_of(self.desk)), ('reserved', 1, 0))
+        self.assertGreater(order.reserved_until, timezone.now())
+
+    def test_insufficient_stock_creates_no_order(self):
+        response = self.checkout((self.lamp, 2), (self.desk, 2))
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual((self.stock_of(self.lamp), self.stock_of(self.desk)), (3, 1))
+
+    def test_canceled_payment_releases_stock(self):
+        self.checkout((self.lamp, 2))
+        self.client.get(reverse('payment:canceled'))
+        order = Order.objects.get()
+        self.assertEqual((order.stock, order.status, self.stock_of(self.lamp)), ('released', 'cancelled', 3))
+        # Paying later holds it again
+        self.assertTrue(stock.hold(order))
+        self.assertEqual((Order.objects.get().status, self.stock_of(self.lamp)), ('pending', 1))
+
+    def test_expired_reservations_are_released(self):
+        self.checkout((self.desk, 1))
+        Order.objects.update(reserved_until=timezone.now() - timedelta(minutes=1))
+        call_command('release_expired_reservations', stdout=StringIO())
+        self.assertEqual((Order.objects.get().stock, self.stock_of(self.desk)), ('released', 1))
+
+    def test_checkout_reclaims_expired_reservations(self):
+        self.checkout((self.desk, 1))
+        Order.objects.update(reserved_until=timezone.now() - timedelta(minutes=1))
+        self.checkout((self.desk, 1))
+        self.assertEqual(list(Order.objects.order_by('id').values_list('stock', flat=True)),
+                         ['released', 'reserved'])
+        self.assertEqual(self.stock_of(self.desk), 0)
+
+    def test_payment_keeps_stock(self):
+        self.checkout((self.lamp, 2))
+        order = Order.objects.get()
+        order.paid = True
+        order.save()
+        order = Order.objects.get()
+        self.assertEqual((order.stock, order.reserved_until, self.stock_of(self.lamp)), ('taken', None, 1))
+        self.assertFalse(stock.release(order.id))
+
+    def test_payment_after_release_takes_stock_again(self):
+        self.checkout((self.lamp, 2))
+        stale = Order.objects.get()
+        stock.release(stale.id)
+        stale.paid = True
+        stale.save()
+        order = Order.objects.get()
+        self.assertEqual((order.stock, self.stock_of(self.lamp)), ('taken', 1))
+
+
+class OrderPlacementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.products = [Product.objects.create(name=f'Cup {i}', price=i + 1, stock=10) for i in range(30)]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def fill_cart(self, products):
+        for product in products:
+            self.client.post(reverse('cart:cart_add', args=[product.id]), {'quantity': 2})
+
+    def checkout_queries(self, lines):
+        self.fill_cart(self.products[:lines])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('orders:order_create'), ADDRESS)
+        self.assertRedirects(response, reverse('payment:process'), fetch_redirect_response=False)
+        return len(queries)
+
+    def test_checkout_queries_do_not_grow_with_the_cart(self):
+        small = self.checkout_queries(1)
+        self.assertEqual(self.checkout_queries(30), small)
+        order = Order.objects.latest('id')
+        self.assertEqual(order.items.count(), 30)
+        self.assertEqual(order.get_total_cost(), 2 * sum(range(1, 31)))
+        self.assertEqual((order.total, order.item_count), (order.get_total_cost(), 60))
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 6)
+
+    def test_lines_are_priced_from_current_products(self):
+        self.fill_cart(self.products[:2])
+        Product.objects.filter(pk=self.products[0].pk).update(price=50)
+        self.client.post(reverse('orders:order_create'), ADDRESS)
+        prices = dict(OrderItem.objects.values_list('product_id', 'price'))
+        self.assertEqual(prices, {self.products[0].id: 50, self.products[1].id: 2})
+
+    def test_unavailable_products_stop_the_order(self):
+        self.fill_cart(self.products[:2])
+        Product.objects.filter(pk=self.products[1].pk).update(available=False)
+        response = self.client.post(reverse('orders:order_create'), ADDRESS, follow=True)
+        self.assertContains(response, 'Cup 1')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 10)
+
+    def test_json_api(self):
+        url = reverse('orders:order_create_json')
+        self.assertEqual(self.client.post(url, ADDRESS).status_code, 400)
+        self.fill_cart(self.products[:2])
+        response = self.client.post(url, {**ADDRESS, 'email': 'nope'})
+        self.assertIn('email', response.json()['fields'])
+
+        Product.objects.filter(pk=self.products[1].pk).update(stock=1)
+        response = self.client.post(url, ADDRESS)
+        self.assertEqual((response.status_code, response.json()['product_ids']), (409, [self.products[1].id]))
+
+        Product.objects.filter(pk=self.products[1].pk).update(stock=2)
+        response = self.client.post(url, ADDRESS)
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual((response.json()['order_id'], order.stock), (order.id, 'reserved'))
+        self.assertEqual(self.client.session['order_id'], order.id)
+        self.assertEqual(self.client.post(url, ADDRESS).status_code, 400)
+
+        self.client.logout()
+        self.assertEqual(self.client.post(url, ADDRESS).status_code, 401)
+
+
+class OrderTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.products = [Product.objects.create(name=f'Pen {i}', price=i + 1) for i in range(3)]
+
+    def totals(self, order):
+        order = Order.objects.get(pk=order.pk)
+        return order.subtotal, order.item_count, order.total
+
+    def test_totals_follow_line_changes(self):
+        order = create_order(self.user, self.products)
+        self.assertEqual(self.totals(order), (6, 3, 6))
+        item = order.items.get(product=self.products[2])
+        item.quantity = 4
+        item.save()
+        self.assertEqual(self.totals(order), (15, 6, 15))
+        item.delete()
+        self.assertEqual(self.totals(order), (3, 2, 3))
+        # Saving an order loaded earlier keeps the stored totals
+        order.status = 'processing'
+        order.save()
+        self.assertEqual(self.totals(order), (3, 2, 3))
+
+    def test_backfill(self):
+        orders = [create_order(self.user, self.products[:i]) for i in range(4)]
+        Order.objects.update(subtotal=0, item_count=0, total=0)
+        with CaptureQueriesContext(connection) as queries:
+            call_command('backfill_order_totals', batch_size=2, stdout=StringIO())
+        # The ids, then per batch of two one aggregate and one update
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'SAVEPOINT' not in query['sql']]), 5)
+        self.assertEqual([self.totals(order) for order in orders],
+                         [(0, 0, 0), (1, 1, 1), (3, 2, 3), (6, 3, 6)])
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.products = [Product.objects.create(name=f'Pen {i}', price=i + 1) for i in range(5)]
+
+    def order(self, *indexes, paid=True):
+        return create_order(self.user, [self.products[i] for i in indexes], paid=paid)
+
+    def matrix(self):
+        return (sorted(CoPurchase.objects.values_list('product_id', 'other_id', 'orders')),
+                sorted(Recommendation.objects.values_list('product_id', 'neighbours')))
+
+    def test_paid_orders_update_recommendations(self):
+        pens = [product.id for product in self.products]
+        self.order(0, 1, 2)
+        self.order(0, 2)
+        self.order(0, 3, paid=False)
+        self.order(4)
+        # Counted by the task worker, not while paying
+        self.assertFalse(CoPurchase.objects.exists())
+        queue.run_pending()
+        self.assertEqual(CoPurchase.objects.get(product_id=pens[0], other_id=pens[2]).orders, 2)
+        self.assertEqual(CoPurchase.objects.get(product_id=pens[1], other_id=pens[0]).orders, 1)
+        self.assertFalse(CoPurchase.objects.filter(product_id=pens[3]).exists())
+        self.assertEqual(Recommendation.objects.get(product_id=pens[0]).neighbours, [pens[2], pens[1]])
+        self.assertEqual(recommended_products([pens[0]]), [self.products[2], self.products[1]])
+        self.assertEqual(recommended_products([pens[1], pens[2]]), [self.products[0]])
+
+        # An order paid later changes the cached lists
+        order = Order.objects.get(items__product=self.products[3])
+        order.paid = True
+        order.save()
+        order.save()
+        queue.run_pending()
+        self.assertEqual(recommended_products([pens[3]]), [self.products[0]])
+        self.products[2].available = False
+        self.products[2].save()
+        self.assertEqual(recommended_products([pens[0]]), [self.products[1], self.products[3]])
+
+    @override_settings(RECOMMENDATIONS_PER_PRODUCT=2, RECOMMENDATIONS_MAX_BASKET=3)
+    def test_rebuild_matches_incremental_recording(self):
+        for basket in [(0, 1, 2), (0, 2), (1, 3), (0, 1, 2, 3), (2, 3, 4), (3, 4), (4,)]:
+            self.order(*basket)
+        self.order(1, 4, paid=False)
+        queue.run_pending()
+        incremental = self.matrix()
+        # Baskets over the maximum size are left out
+        self.assertFalse(CoPurchase.objects.filter(orders__gt=2).exists())
+        self.assertEqual(len(incremental[1]), 5)
+        self.assertTrue(all(len(neighbours) <= 2 for product_id, neighbours in incremental[1]))
+        CoPurchase.objects.all().delete()
+        call_command('build_recommendations', stdout=StringIO())
+        self.assertEqual(self.matrix(), incremental)
+
+
+class BestsellerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.pens = Category.objects.create(name='Pens')
+        cls.inks = Category.objects.create(name='Inks')
+        cls.products = [Product.objects.create(name=f'Pen {i}', price=i + 1, category=cls.pens)
+                        for i in range(4)]
+        cls.ink = Product.objects.create(name='Ink', price=3, category=cls.inks)
+
+    def setUp(self):
+        caches[settings.CATALOGUE_CACHE_ALIAS].clear()
+
+    def sell(self, product, quantity, **kwargs):
+        order = create_order(self.user, [product], paid=True, **kwargs)
+        order.items.update(quantity=quantity)
+        queue.run_pending()
+        return order
+
+    def test_rankings_follow_paid_orders(self):
+        self.sell(self.products[1], 2)
+        self.sell(self.ink, 5)
+        self.sell(self.products[2], 3)
+        create_order(self.user, [self.products[0]])
+        self.assertEqual(bestsellers.top_products(), [self.ink, self.products[2], self.products[1]])
+        self.assertEqual(bestsellers.top_products(self.pens), [self.products[2], self.products[1]])
+        self.assertEqual(bestsellers.top_products(limit=1), [self.ink])
+        # A sale drops the cached rankings
+        self.sell(self.products[1], 2)
+        self.assertEqual(bestsellers.top_products(self.pens), [self.products[1], self.products[2]])
+        self.products[1].available = False
+        self.products[1].save()
+        self.assertEqual(bestsellers.top_products(self.pens), [self.products[2]])
+
+    def test_fill_with_newest_products(self):
+        self.sell(self.products[0], 1)
+        Product.objects.filter(pk=self.products[2].pk).update(created=timezone.now() + timedelta(days=1))
+        self.assertEqual(bestsellers.top_products(limit=3, fill=True),
+                         [self.products[0], self.products[2], self.ink])
+        self.assertEqual(bestsellers.top_products(limit=3), [self.products[0]])
+
+    def test_moving_a_product_moves_its_sales(self):
+        self.sell(self.products[0], 4)
+        self.sell(self.ink, 1)
+        self.assertEqual(bestsellers.top_products(self.pens), [self.products[0]])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].category = self.inks
+            self.products[0].save()
+        self.assertEqual(bestsellers.top_products(self.pens), [])
+        self.assertEqual(bestsellers.top_products(self.inks), [self.products[0], self.ink])
+        # A bulk move leaves the copy behind, but not in the old category's ranking
+        Product.objects.filter(pk=self.ink.pk).update(category=self.pens)
+        cache.invalidate(bestsellers.CACHE_NAMESPACE)
+        self.assertEqual(bestsellers.top_products(self.inks), [self.products[0]])
+        bestsellers.refresh()
+        self.assertEqual(bestsellers.top_products(self.pens), [self.ink])
+
+    @override_settings(BESTSELLER_WINDOW_DAYS=30)
+    def test_refresh_drops_old_sales(self):
+        old = self.sell(self.products[0], 5)
+        Order.objects.filter(pk=old.pk).update(created=timezone.now() - timedelta(days=31))
+        self.sell(self.products[1], 1)
+        self.assertEqual(bestsellers.top_products(), [self.products[0], self.products[1]])
+        call_command('refresh_bestsellers', stdout=StringIO())
+        self.assertEqual(bestsellers.top_products(), [self.products[1]])
+
+
+class OrderPageQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.products = [Product.objects.create(name=f'Plate {i}', price=i + 1) for i in range(8)]
+        cls.orders = [create_order(cls.user, cls.products[:i % 8 + 1]) for i in range(25)]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_history_pages(self):
+        url = reverse('orders:order_history')
+        # Session, user, one page of orders and the cart in the header
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        newest_first = self.orders[::-1]
+        self.assertEqual(list(response.context['orders']), newest_first[:10])
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'cursor': response.context['page'].next_cursor})
+        self.assertEqual(list(response.context['orders']), newest_first[10:20])
+        response = self.client.get(url, {'cursor': response.context['page'].next_cursor})
+        self.assertEqual(list(response.context['orders']), newest_first[20:])
+        self.assertFalse(response.context['page'].has_next)
+        response = self.client.get(url, {'cursor': response.context['page'].previous_cursor})
+        self.assertEqual(list(response.context['orders']), newest_first[10:20])
+        self.assertEqual(self.client.get(url, {'cursor': 'junk'}).status_code, 200)
+
+    def test_detail_loads_lines_at_once(self):
+        for order in (self.orders[0], self.orders[7]):
+            # Session, user, the order, its lines with their products and the cart
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('orders:order_detail', args=[order.id]))
+            self.assertContains(response, 'Plate 0')
+
+    def test_dashboard_detail_loads_lines_at_once(self):
+        self.user.is_staff = True
+        self.user.save()
+        for order in (self.orders[0], self.orders[7]):
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse('dashboard:order_detail', args=[order.id]))
+            self.assertContains(response, 'Plate 0')
+
+
+class OrderArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.products = [Product.objects.create(name=f'Bowl {i}', price=i + 1) for i in range(3)]
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.enterContext(override_settings(ORDER_ARCHIVE_ROOT=root.name))
+
+    def placed(self, days_ago, products, **kwargs):
+        order = create_order(self.user, products, **kwargs)
+        created = timezone.now() - timedelta(days=days_ago)
+        Order.objects.filter(pk=order.pk).update(created=created, updated=created)
+        return Order.objects.get(pk=order.pk)
+
+    def test_archive_and_restore(self):
+        old = [self.placed(800, self.products[:2], status='delivered', paid=True),
+               self.placed(800, self.products[2:], status='cancelled'),
+               self.placed(900, self.products, status='delivered', paid=True)]
+        open_order = self.placed(800, self.products, status='shipped', paid=True)
+        recent = self.placed(10, self.products, status='delivered', paid=True)
+
+        call_command('archive_orders', batch_size=2, stdout=StringIO())
+        self.assertEqual(list(Order.objects.order_by('id')), [open_order, recent])
+        self.assertEqual(OrderItem.objects.count(), 6)
+        summaries = ArchivedOrder.objects.in_bulk()
+        self.assertEqual(set(summaries), {order.id for order in old})
+        self.assertEqual((summaries[old[0].id].total, summaries[old[0].id].paid), (3, True))
+
+        # One file per month the orders were placed in
+        names = sorted({summary.archive for summary in summaries.values()})
+        self.assertEqual(len(names), 2)
+        self.assertEqual(names[0][:8], f'{old[2].created:%Y/%m}/')
+        with gzip.open(archive.archive_root() / summaries[old[0].id].archive, 'rt') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records[0]['items']) + len(records[1]['items']), 3)
+
+        # Reports include the archived orders
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('dashboard:dashboard_home'))
+        self.assertEqual((response.context['total_orders'], response.context['total_revenue']), (5, 3 + 6 + 6 + 6))
+
+        call_command('restore_orders', order=[old[0].id], stdout=StringIO())
+        restored = Order.objects.get(pk=old[0].pk)
+        self.assertEqual((restored.created, restored.updated, restored.total), (old[0].created, old[0].updated, 3))
+        self.assertEqual(sorted(restored.items.values_list('product_id', flat=True)),
+                         [product.id for product in self.products[:2]])
+        self.assertFalse(ArchivedOrder.objects.filter(pk=old[0].pk).exists())
+
+        call_command('restore_orders', *names, stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(OrderItem.objects.count(), 12)
+        self.assertFalse(ArchivedOrder.objects.exists())
+
+    def test_restore_leaves_out_lines_of_deleted_products(self):
+        order = self.placed(800, self.products, status='delivered', paid=True)
+        archive.archive()
+        Product.objects.filter(pk=self.products[1].pk).delete()
+        name = ArchivedOrder.objects.get().archive
+        self.assertEqual(archive.restore(name), 1)
+        restored = Order.objects.get(pk=order.pk)
+        self.assertEqual(sorted(restored.items.values_list('product_id', flat=True)),
+                         [self.products[0].id, self.products[2].id])
+        self.assertEqual((restored.total, restored.item_count, restored.updated), (4, 2, order.updated))
+
+    def test_nothing_to_archive(self):
+        self.placed(10, self.products, status='delivered')
+        self.assertEqual(archive.archive(), 0)
+        self.assertEqual(list(archive.archive_root().rglob('*')), [])
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    ATTEMPTS = 40
+    STOCK = 100
+
+    def test_no_oversell_under_contention(self):
+        product = Product.objects.create(name='Hot lamp', price=10, stock=self.STOCK)
+        sold, latencies, errors = [], [], []
+        start = threading.Barrier(self.THREADS)
+
+        def buy():
+            try:
+                start.wait()
+                for _ in range(self.ATTEMPTS):
+                    began = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            stock.take({product.pk: 1})
+                        sold.append(1)
+                    except stock.InsufficientStock:
+                        pass
+                    latencies.append(time.perf_counter() - began)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(sold), self.STOCK)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 0)
+        # No checkout waits behind the others for long
+        self.assertLess(statistics.quantiles(latencies, n=100)[98], 1.0)
+        self.assertLess(max(latencies), 5.0)
+
+
+class OrderQueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        products = [Product.objects.create(name=f'Product {i}', price=i + 1) for i in range(5)]
+        for i in range(5):
+            cls.order = create_order(cls.user, products[:i + 1], paid=i % 2 == 0)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_order_history(self):
+        self.assertNoFullScans(reverse('orders:order_history'))
+
+    def test_order_detail(self):
+        self.assertNoFullScans(reverse('orders:order_detail', args=[self.order.id]))
@@ -0,0 +1,50 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
+from .models import Order, OrderItem
+
+# Orders keep the sums of their lines in subtotal, item_count and total, so
+# lists of orders can show, sort and filter by amount without loading items.
+
+
+def line_totals(lines):
+    """
+    Return (subtotal, item count) of (price, quantity) pairs.
+    """
+    subtotal, item_count = Decimal('0.00'), 0
+    for price, quantity in lines:
+        subtotal += price * quantity
+        item_count += quantity
+    return subtotal, item_count
+
+
+def set_totals(order, subtotal, item_count):
+    order.subtotal = subtotal
+    order.item_count = item_count
+    # Nothing is added to the lines yet, e.g. shipping
+    order.total = subtotal
+
+
+def recalculate(orders, batch_size=1000):
+    """
+    Rewrite the stored totals of the given orders from their lines, with
+    one grouped aggregate and one bulk update per batch. Returns the number
+    of orders updated.
+    """
+    order_ids = list(orders.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+        sums = {row['order_id']: row for row in OrderItem.objects.filter(order__in=batch)
+                .values('order_id').order_by()
+                .annotate(subtotal=Sum(F('price') * F('quantity'),
+                                       output_field=DecimalField(max_digits=12, decimal_places=2)),
+                          item_count=Sum('quantity'))}
+        updated = []
+        for order_id in batch:
+            order = Order(id=order_id)
+            row = sums.get(order_id, {})
+            set_totals(order, row.get('subtotal') or Decimal('0.00'), row.get('item_count') or 0)
+            updated.append(order)
+        with transaction.atomic():
+            Order.objects.bulk_update(updated, Order.TOTAL_FIELDS)
+    return len(order_ids)
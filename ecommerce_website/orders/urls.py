@@ -5,6 +5,7 @@ app_name = 'orders'
 
 urlpatterns = [
     path('create/', views.order_create, name='order_create'),
+    path('api/create/', views.order_create_json, name='order_create_json'),
     path('history/', views.order_history, name='order_history'),
     path('detail/<int:order_id>/', views.order_detail, name='order_detail'),
 ]
\ No newline at end of file
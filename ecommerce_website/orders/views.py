@@ -1,31 +1,43 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
 from django.urls import reverse
-from .models import OrderItem, Order
+from django.views.decorators.http import require_POST
+from .models import Order
 from .forms import OrderCreateForm
-from cart.cart import Cart
+from .services import OrderNotPlaced, place_order
+from cart.cart import get_cart
+from products.pagination import InvalidCursor, KeysetPaginator
+
+def _place_cart_order(request, form, cart):
+    """
+    Place the order of the validated form for the cart, then empty the
+    cart and remember the order for payment.
+    """
+    order = form.save(commit=False)
+    order.user = request.user
+    place_order(order, {int(product_id): entry['quantity'] for product_id, entry in cart.cart.items()})
+    cart.clear()
+    request.session['order_id'] = order.id
+    return order
 
 @login_required
 def order_create(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     if len(cart) == 0:
         return redirect('cart:cart_detail')
         
     if request.method == 'POST':
         form = OrderCreateForm(request.POST)
         if form.is_valid():
-            order = form.save(commit=False)
-            order.user = request.user
-            order.save()
-            for item in cart:
-                OrderItem.objects.create(order=order,
-                                        product=item['product'],
-                                        price=item['price'],
-                                        quantity=item['quantity'])
-            # Clear the cart
-            cart.clear()
-            # Set the order in the session
-            request.session['order_id'] = order.id
+            try:
+                _place_cart_order(request, form, cart)
+            except OrderNotPlaced as e:
+                messages.error(request, f'{e.message}: {", ".join(e.names) or "a product in your cart"}. '
+                                        'Please change your cart.')
+                return redirect('cart:cart_detail')
             # Redirect for payment
             return redirect(reverse('payment:process'))
     else:
@@ -48,12 +60,44 @@ def order_create(request):
         form = OrderCreateForm(initial=initial_data)
     return render(request, 'orders/create.html', {'cart': cart, 'form': form})
 
+@require_POST
+def order_create_json(request):
+    """
+    Place an order for the cart from the same fields as the checkout form,
+    answering with the new order instead of redirecting to payment.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Please log in to place an order.'}, status=401)
+    cart = get_cart(request)
+    if len(cart) == 0:
+        return JsonResponse({'error': 'Your cart is empty.'}, status=400)
+    form = OrderCreateForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Please correct the order details.', 'fields': form.errors},
+                            status=400)
+    try:
+        order = _place_cart_order(request, form, cart)
+    except OrderNotPlaced as e:
+        return JsonResponse({'error': f'{e.message}.', 'product_ids': e.product_ids}, status=409)
+    return JsonResponse({
+        'order_id': order.id,
+        'reserved_until': order.reserved_until,
+        'payment_url': reverse('payment:process'),
+    }, status=201)
+
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user)
-    return render(request, 'orders/history.html', {'orders': orders})
+    # Newest first, seeking on the user's order index rather than counting
+    # and skipping rows
+    paginator = KeysetPaginator(Order.objects.filter(user=request.user), ('-created', '-id'),
+                                getattr(settings, 'ORDERS_PER_PAGE', 10))
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page = paginator.page()
+    return render(request, 'orders/history.html', {'orders': page.object_list, 'page': page})
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(Order.objects.with_items(), id=order_id, user=request.user)
     return render(request, 'orders/detail.html', {'order': order})
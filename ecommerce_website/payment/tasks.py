@@ -0,0 +1,16 @@
+from orders.models import Order
+from tasks.queue import task
+
+
+@task()
+def fulfil_checkout(order_id, payment_intent):
+    """
+    Mark the order of a completed Stripe checkout session as paid.
+    """
+    order = Order.objects.filter(id=order_id).first()
+    if order is None or order.paid:
+        return
+    order.paid = True
+    order.stripe_id = payment_intent or ''
+    order.status = 'processing'
+    order.save()
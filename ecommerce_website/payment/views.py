@@ -1,4 +1,5 @@
 import stripe
+from datetime import timedelta
 from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
@@ -6,10 +7,16 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse
 from orders.models import Order
+from orders import stock
+from tasks.queue import enqueue
+from .tasks import fulfil_checkout
 
 # Configure Stripe API key
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# Shortest lifetime Stripe accepts for a checkout session
+STRIPE_MIN_SESSION = timedelta(minutes=30)
+
 @login_required
 def payment_process(request):
     # Get the order ID from the session or query parameters
@@ -23,7 +30,7 @@ def payment_process(request):
         return redirect('orders:order_history')
     
     # Get the order object
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.with_items(), id=order_id)
     
     # Check if the order belongs to the current user
     if order.user != request.user:
@@ -35,6 +42,12 @@ def payment_process(request):
         messages.info(request, 'This order has already been paid.')
         return redirect('orders:order_detail', order_id=order.id)
     
+    # Keep the stock held while the customer pays, or hold it again after
+    # an abandoned payment
+    if not stock.hold(order):
+        messages.error(request, 'Some products in this order are no longer in stock.')
+        return redirect('orders:order_detail', order_id=order.id)
+    
     # Create Stripe checkout session
     if request.method == 'POST':
         try:
@@ -61,7 +74,10 @@ def payment_process(request):
                 customer_email=order.email,
                 success_url=request.build_absolute_uri(reverse('payment:success')) + f'?session_id={{CHECKOUT_SESSION_ID}}&order_id={order.id}',
                 cancel_url=request.build_absolute_uri(reverse('payment:canceled')),
-                metadata={'order_id': order.id}
+                metadata={'order_id': order.id},
+                # Checkout can't outlive the stock reservation
+                **({'expires_at': int(order.reserved_until.timestamp())}
+                   if order.reserved_until and stock.reservation_timeout() >= STRIPE_MIN_SESSION else {})
             )
             
             # Store the session ID in the session
@@ -126,6 +142,9 @@ def payment_canceled(request):
     # If there's an order ID in the session, redirect to the order detail page
     if 'order_id' in request.session:
         order_id = request.session['order_id']
+        # Give the abandoned order's stock back; paying later holds it again
+        if Order.objects.filter(id=order_id, user=request.user).exists():
+            stock.release(order_id)
         return redirect('orders:order_detail', order_id=order_id)
     
     return render(request, 'payment/canceled.html')
@@ -154,13 +173,9 @@ def stripe_webhook(request):
         # Get the order ID from the session metadata
         order_id = session.get('metadata', {}).get('order_id')
         if order_id:
-            try:
-                order = Order.objects.get(id=order_id)
-                order.paid = True
-                order.stripe_id = session.payment_intent
-                order.status = 'processing'
-                order.save()
-            except Order.DoesNotExist:
-                pass
+            # Answer Stripe straight away; Stripe resends events, which the
+            # event id as idempotency key ignores
+            enqueue(fulfil_checkout, key=f'stripe:{event["id"]}',
+                    order_id=int(order_id), payment_intent=session.get('payment_intent'))
     
     return HttpResponse(status=200)
@@ -23,6 +23,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ['available', 'created', 'updated', 'category']
     list_editable = ['price', 'stock', 'available']
     prepopulated_fields = {'slug': ('name',)}
+    readonly_fields = Product.DERIVED_FIELDS
     inlines = [ProductImageInline, ReviewInline]
 
 @admin.register(Review)
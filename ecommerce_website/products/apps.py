@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.core.checks import Tags, register
+from django.db.models.signals import post_migrate
 
 
 class ProductsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "products"
+
+    def ready(self):
+        from . import checks, signals
+        register(checks.check_catalogue_cache, Tags.caches)
+        post_migrate.connect(signals.install_search_index, sender=self)
@@ -0,0 +1,161 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.db import connection
+from .models import Category, Product
+
+
+def normalize(text):
+    return ' '.join((text or '').casefold().split())
+
+
+def index_keys(name):
+    """
+    Return the keys a name is found under: the full name and every
+    trailing part of it starting at a word, so 'Running Shoes' matches
+    both 'run' and 'sho'.
+    """
+    words = normalize(name).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex:
+    """
+    In-memory prefix index over product and category names.
+
+    Keys are kept in a sorted list of (key, kind, id) tuples per kind, so a
+    lookup is a binary search for the prefix followed by a short scan, and
+    categories are found however many products share the prefix.
+    """
+    KINDS = ('category', 'product')
+
+    def __init__(self):
+        self._keys = {kind: [] for kind in self.KINDS}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.built_at = None
+
+    def build(self, entries):
+        """
+        Replace the whole index with (kind, id, label, url) entries.
+        """
+        keys = {kind: [] for kind in self.KINDS}
+        payloads = {}
+        for kind, pk, label, url in entries:
+            entry_keys = [(key, kind, pk) for key in index_keys(label)]
+            keys[kind].extend(entry_keys)
+            payloads[kind, pk] = {'type': kind, 'label': label, 'url': url, 'keys': entry_keys}
+        for kind_keys in keys.values():
+            kind_keys.sort()
+        with self._lock:
+            self._keys = keys
+            self._entries = payloads
+            self.built_at = time.monotonic()
+
+    def add(self, kind, pk, label, url):
+        with self._lock:
+            self._remove(kind, pk)
+            entry_keys = [(key, kind, pk) for key in index_keys(label)]
+            for key in entry_keys:
+                insort(self._keys[kind], key)
+            self._entries[kind, pk] = {'type': kind, 'label': label, 'url': url, 'keys': entry_keys}
+
+    def remove(self, kind, pk):
+        with self._lock:
+            self._remove(kind, pk)
+
+    def _remove(self, kind, pk):
+        entry = self._entries.pop((kind, pk), None)
+        if entry:
+            keys = self._keys[kind]
+            for key in entry['keys']:
+                i = bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    del keys[i]
+
+    def lookup(self, prefix, limit=8):
+        """
+        Return up to limit entries with a name or name word starting with
+        prefix, categories first, each kind by name.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        with self._lock:
+            for kind in self.KINDS:
+                keys, found = self._keys[kind], {}
+                i = bisect_left(keys, (prefix,))
+                while i < len(keys) and len(found) < limit - len(results):
+                    key, kind, pk = keys[i]
+                    if not key.startswith(prefix):
+                        break
+                    found.setdefault(pk, self._entries[kind, pk])
+                    i += 1
+                results += sorted(found.values(), key=lambda e: e['label'].casefold())
+        return [{'type': e['type'], 'label': e['label'], 'url': e['url']} for e in results]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_index = PrefixIndex()
+_build_lock = threading.Lock()
+
+
+def catalogue_entries():
+    for category in Category.objects.all():
+        yield 'category', category.pk, category.name, category.get_absolute_url()
+    for product in Product.objects.available().only('id', 'name', 'slug').iterator():
+        yield 'product', product.pk, product.name, product.get_absolute_url()
+
+
+def _stale():
+    max_age = getattr(settings, 'AUTOCOMPLETE_INDEX_MAX_AGE', 300)
+    return time.monotonic() - _index.built_at > max_age
+
+
+def _rebuild():
+    try:
+        _index.build(catalogue_entries())
+    finally:
+        connection.close()
+        _build_lock.release()
+
+
+def get_index():
+    """
+    Return the prefix index, building it on first use. Once it is older
+    than AUTOCOMPLETE_INDEX_MAX_AGE, which picks up changes saved by other
+    processes, it is rebuilt in a background thread while requests keep
+    using the current one.
+    """
+    if _index.built_at is None:
+        with _build_lock:
+            if _index.built_at is None:
+                _index.build(catalogue_entries())
+    elif _stale() and _build_lock.acquire(blocking=False):
+        # Released by the rebuild
+        threading.Thread(target=_rebuild, name='autocomplete-rebuild', daemon=True).start()
+    return _index
+
+
+def update_product(product):
+    # Nothing to do until the index is first used; it will be built from the database
+    if _index.built_at is None:
+        return
+    if product.available:
+        _index.add('product', product.pk, product.name, product.get_absolute_url())
+    else:
+        _index.remove('product', product.pk)
+
+
+def update_category(category):
+    if _index.built_at is not None:
+        _index.add('category', category.pk, category.name, category.get_absolute_url())
+
+
+def remove(kind, pk):
+    if _index.built_at is not None:
+        _index.remove(kind, pk)
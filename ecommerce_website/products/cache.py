@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.http import Http404
+from django.utils import timezone
+from .models import CatalogueChanges, Category, Product
+
+# Keys are namespaced by a version number, so a whole group of entries can
+# be dropped by bumping it instead of deleting keys one by one. Versions are
+# only seen by every process if CATALOGUE_CACHE_ALIAS is shared by them,
+# which products.checks enforces.
+CATEGORIES = 'categories'
+PRODUCTS = 'products'
+FACETS = 'facets'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOGUE_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 60 * 60)
+
+
+def _new_version():
+    # A version lost to eviction starts again from the clock, never from a
+    # number whose entries may still be cached
+    return int(time.time() * 1000)
+
+
+def _version(namespace):
+    cache = get_cache()
+    key = f'catalogue:{namespace}:version'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(namespace):
+    cache = get_cache()
+    key = f'catalogue:{namespace}:version'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_version(), None)
+
+
+# Every invalidation also counts as a catalogue change, which conditional
+# GET validators use to tell whether a cached page may still be current.
+# The counter is a database row rather than a cache entry, so a change made
+# by any process moves the validators of all of them.
+CHANGES_ID = 1
+
+
+def touch():
+    """
+    Record that something shown on catalogue pages changed.
+    """
+    now = timezone.now()
+    if not CatalogueChanges.objects.filter(pk=CHANGES_ID).update(counter=F('counter') + 1, changed=now):
+        CatalogueChanges.objects.get_or_create(pk=CHANGES_ID, defaults={'changed': now})
+        CatalogueChanges.objects.filter(pk=CHANGES_ID).update(counter=F('counter') + 1, changed=now)
+
+
+def changes():
+    """
+    Return (counter, time of the last change) for the catalogue.
+    """
+    state, created = CatalogueChanges.objects.get_or_create(pk=CHANGES_ID,
+                                                            defaults={'changed': timezone.now()})
+    return state.counter, state.changed.timestamp()
+
+
+def _key(namespace, name):
+    return f'catalogue:{namespace}:{_version(namespace)}:{name}'
+
+
+def key(namespace, name):
+    """
+    Return the current key of name in a namespace, for other apps keeping
+    catalogue data in this cache.
+    """
+    return _key(namespace, name)
+
+
+def invalidate(namespace):
+    """
+    Drop every entry of a namespace.
+    """
+    _bump(namespace)
+    touch()
+
+
+def _record(kind, hit):
+    with _stats_lock:
+        _stats[f'{kind}_hits' if hit else f'{kind}_misses'] += 1
+
+
+def _get_or_load(kind, namespace, name, loader):
+    cache = get_cache()
+    key = _key(namespace, name)
+    value = cache.get(key)
+    if value is not None:
+        _record(kind, True)
+        return value
+    _record(kind, False)
+    value = loader()
+    cache.set(key, value, _timeout())
+    return value
+
+
+# Negative lookups are cached as this marker so missing slugs/ids don't
+# go to the database every time either.
+MISSING = 'missing'
+
+
+def get_categories():
+    """
+    Return all categories in their default order.
+    """
+    return _get_or_load('categories', CATEGORIES, 'all',
+                        lambda: list(Category.objects.all()))
+
+
+def get_category_or_404(slug):
+    def load():
+        return Category.objects.filter(slug=slug).first() or MISSING
+    category = _get_or_load('category', CATEGORIES, f'slug:{slug}', load)
+    if category == MISSING:
+        raise Http404('No Category matches the given query.')
+    return category
+
+
+def get_product_or_404(product_id):
+    """
+    Return a product with its category and primary image loaded.
+    """
+    def load():
+        return Product.objects.for_cards().filter(pk=product_id).first() or MISSING
+    product = _get_or_load('product', PRODUCTS, product_id, load)
+    if product == MISSING:
+        raise Http404('No Product matches the given query.')
+    return product
+
+
+def get_facet_counts(name, loader):
+    """
+    Return listing facet counts, cached until the catalogue next changes.
+
+    Every product, stock, rating or category change touches the change
+    counter, so keying the counts by it drops them all at once.
+    """
+    counter, changed_at = changes()
+    return _get_or_load('facets', FACETS, f'{counter}:{name}', loader)
+
+
+def invalidate_catalogue():
+    """
+    Drop every cached category and product.
+    """
+    # Products are cached with their category attached, so they go too
+    _bump(CATEGORIES)
+    _bump(PRODUCTS)
+    touch()
+
+
+def invalidate_product(product_id):
+    get_cache().delete(_key(PRODUCTS, product_id))
+    touch()
+
+
+LOOKUPS = ('categories', 'category', 'product', 'facets')
+
+
+def stats():
+    """
+    Return (lookup, hits, misses) counters of this process.
+    """
+    with _stats_lock:
+        return [(lookup, _stats[f'{lookup}_hits'], _stats[f'{lookup}_misses'])
+                for lookup in LOOKUPS]
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Error
+
+# Backends whose entries only the process that wrote them sees
+PROCESS_LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def check_catalogue_cache(app_configs, **kwargs):
+    """
+    Catalogue invalidation bumps versions kept in the catalogue cache, so
+    a cache each process keeps for itself would leave other processes,
+    and management commands' changes, serving stale entries.
+    """
+    alias = getattr(settings, 'CATALOGUE_CACHE_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_BACKENDS:
+        return [Error(
+            f'CATALOGUE_CACHE_ALIAS names the {alias!r} cache, which is local to each process.',
+            hint='Use a backend shared by every process, such as Redis, Memcached or the database cache.',
+            id='products.E001',
+        )]
+    return []
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.middleware.csrf import CSRF_SESSION_KEY
+from django.views.decorators.http import condition
+from cart.cart import get_cart
+from . import cache
+
+
+def _personal_state(request):
+    """
+    Return what besides the catalogue goes into a page for this visitor,
+    or None if the page must be rendered anyway.
+    """
+    if len(get_messages(request)):
+        # Pending messages are shown, and used up, by the next page rendered
+        return None
+    if settings.CSRF_USE_SESSIONS:
+        csrf = request.session.get(CSRF_SESSION_KEY)
+    else:
+        csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    return {
+        'user': request.user.pk,
+        'cart': get_cart(request).cart,
+        'csrf': csrf,
+    }
+
+
+def catalogue_etag(request, *args, **kwargs):
+    """
+    Return an ETag for a catalogue page: the catalogue change counter plus
+    the user, cart and CSRF token the page was rendered with.
+    """
+    state = _personal_state(request)
+    if state is None or state['csrf'] is None:
+        # The page would issue a new CSRF token
+        return None
+    state['changes'] = cache.changes()[0]
+    return hashlib.md5(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def catalogue_last_modified(request, *args, **kwargs):
+    """
+    Return the time of the last catalogue change, for pages that are the
+    same for every anonymous visitor with an empty cart.
+    """
+    state = _personal_state(request)
+    if state is None or state['user'] is not None or state['cart']:
+        return None
+    changed_at = cache.changes()[1]
+    # HTTP dates have whole seconds: a page rendered in the second of the
+    # last change could miss a later change in that same second
+    if time.time() - int(changed_at) < 1:
+        return None
+    return datetime.fromtimestamp(int(changed_at), timezone.utc)
+
+
+# Answers repeat requests for unchanged pages with 304 Not Modified,
+# before the view runs
+catalogue_condition = condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified)
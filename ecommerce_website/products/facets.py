@@ -0,0 +1,129 @@
+from decimal import Decimal
+from django.db.models import Count, Q
+from . import cache
+
+# Price buckets offered as filters, as (key, label, low, high) with high exclusive
+PRICE_RANGES = (
+    ('0-25', 'Under $25', None, Decimal('25')),
+    ('25-50', '$25 to $50', Decimal('25'), Decimal('50')),
+    ('50-100', '$50 to $100', Decimal('50'), Decimal('100')),
+    ('100-250', '$100 to $250', Decimal('100'), Decimal('250')),
+    ('250-', '$250 & above', Decimal('250'), None),
+)
+
+PRICE_KEYS = {key for key, label, low, high in PRICE_RANGES}
+
+RATING_THRESHOLDS = (4, 3, 2, 1)
+
+
+def price_condition(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+class ProductFacets:
+    """
+    Parses the listing filters from the query string and computes the
+    facet counts for them.
+
+    Each facet's counts apply every active filter except its own, so the
+    numbers shown are what the listing would contain if that option were
+    picked. All counts come from a single aggregate query, cached until
+    the catalogue next changes.
+    """
+    def __init__(self, params):
+        self.params = params
+        self.price = params.get('price') if params.get('price') in PRICE_KEYS else None
+        self.in_stock = params.get('in_stock') == '1'
+        try:
+            self.rating = int(params.get('rating', ''))
+        except ValueError:
+            self.rating = None
+        if self.rating not in RATING_THRESHOLDS:
+            self.rating = None
+
+    def conditions(self, exclude=None):
+        """
+        Return the active filters as a Q, leaving out the named facet.
+        """
+        condition = Q()
+        if self.price and exclude != 'price':
+            for key, label, low, high in PRICE_RANGES:
+                if key == self.price:
+                    condition &= price_condition(low, high)
+        if self.in_stock and exclude != 'in_stock':
+            condition &= Q(stock__gt=0)
+        if self.rating and exclude != 'rating':
+            condition &= Q(rating_avg__gte=self.rating)
+        return condition
+
+    def filter(self, queryset):
+        return queryset.filter(self.conditions())
+
+    def counts(self, queryset, categories, category=None):
+        """
+        Return facet options with counts for the given base queryset.
+
+        The base queryset is the whole available catalogue, not narrowed
+        to the current category, so category counts stay meaningful. The
+        counts are cached by category and filters, so it must not vary
+        otherwise.
+        """
+        category_filter = Q(category=category) if category else Q()
+        aggregates = {}
+        for c in categories:
+            aggregates[f'category_{c.id}'] = Count(
+                'id', filter=self.conditions() & Q(category_id=c.id))
+        aggregates['category_all'] = Count('id', filter=self.conditions())
+        for key, label, low, high in PRICE_RANGES:
+            aggregates[f'price_{key}'] = Count(
+                'id', filter=self.conditions('price') & category_filter & price_condition(low, high))
+        aggregates['in_stock'] = Count(
+            'id', filter=self.conditions('in_stock') & category_filter & Q(stock__gt=0))
+        for threshold in RATING_THRESHOLDS:
+            aggregates[f'rating_{threshold}'] = Count(
+                'id', filter=self.conditions('rating') & category_filter & Q(rating_avg__gte=threshold))
+        name = f'{category.id if category else "all"}:{self.price}:{int(self.in_stock)}:{self.rating}'
+        totals = cache.get_facet_counts(name, lambda: queryset.aggregate(**aggregates))
+
+        return {
+            'categories': [(c, totals[f'category_{c.id}']) for c in categories],
+            'category_all': totals['category_all'],
+            'price': [
+                {'key': key, 'label': label, 'count': totals[f'price_{key}'],
+                 'selected': key == self.price,
+                 'query': self.query(price=None if key == self.price else key)}
+                for key, label, low, high in PRICE_RANGES
+            ],
+            'in_stock': {
+                'count': totals['in_stock'], 'selected': self.in_stock,
+                'query': self.query(in_stock=None if self.in_stock else '1'),
+            },
+            'rating': [
+                {'threshold': threshold, 'count': totals[f'rating_{threshold}'],
+                 'selected': threshold == self.rating,
+                 'query': self.query(rating=None if threshold == self.rating else threshold)}
+                for threshold in RATING_THRESHOLDS
+            ],
+        }
+
+    def query(self, **changes):
+        """
+        Return the current filter query string with some values changed.
+        """
+        params = self.params.copy()
+        params.pop('cursor', None)
+        for key, value in changes.items():
+            if value is None:
+                params.pop(key, None)
+            else:
+                params[key] = value
+        return params.urlencode()
+
+    @property
+    def active(self):
+        return bool(self.price or self.in_stock or self.rating)
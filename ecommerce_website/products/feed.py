@@ -0,0 +1,73 @@
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from .models import Product
+from .pagination import KeysetPaginator
+
+# Rows are sent oldest change first, so a sync can resume from the last
+# row it received and picks up rows changed while it was running.
+ORDERING = ('updated', 'id')
+
+
+def latest_update():
+    return Product.objects.aggregate(latest=Max('updated'))['latest']
+
+
+def changed_products(since=None, cursor=None):
+    """
+    Return a (paginator, queryset) of products changed after since,
+    resuming after cursor.
+
+    Deleted products are not reported; consumers notice them by their
+    absence from a full export. Raises InvalidCursor for a bad cursor.
+    """
+    products = Product.objects.for_cards()
+    if since is not None:
+        products = products.filter(updated__gt=since)
+    paginator = KeysetPaginator(products, ORDERING, per_page=None)
+    return paginator, paginator.rows_after(cursor)
+
+
+def serialize(product, build_uri, cursor):
+    image = product.card_image
+    category = product.category
+    return {
+        'id': product.id,
+        'name': product.name,
+        'slug': product.slug,
+        'url': build_uri(product.get_absolute_url()),
+        'category': {
+            'id': category.id, 'name': category.name, 'slug': category.slug,
+        } if category else None,
+        'price': product.price,
+        'stock': product.stock,
+        'available': product.available,
+        'image': build_uri(image.url) if image else None,
+        'rating_avg': product.rating_avg,
+        'rating_count': product.rating_count,
+        'updated': product.updated,
+        'cursor': cursor,
+    }
+
+
+def stream_records(paginator, products, build_uri, chunk_size):
+    """
+    Yield serialized products one at a time, fetching chunk_size rows per
+    database round trip so memory use stays flat for any catalogue size.
+    """
+    for product in products.iterator(chunk_size=chunk_size):
+        yield serialize(product, build_uri, paginator.cursor_for(product))
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def json_array(records):
+    yield '['
+    separator = '\n'
+    for record in records:
+        yield separator + json.dumps(record, cls=DjangoJSONEncoder)
+        separator = ',\n'
+    yield '\n]\n'
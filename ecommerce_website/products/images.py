@@ -0,0 +1,169 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .models import Product, ProductImage
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+# Resized variants generated for every product image: name -> maximum width
+VARIANT_WIDTHS = {
+    'thumbnail': 160,
+    'card': 480,
+    'detail': 960,
+    'zoom': 1600,
+}
+
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+# Which model field holds the source file and which the variants
+SOURCES = {
+    'productimage': (ProductImage, 'image', 'variants'),
+    'product': (Product, 'image', 'image_variants'),
+}
+
+_executor = None
+
+
+def variants_are_stale(instance, field, variants_field):
+    file = getattr(instance, field)
+    variants = getattr(instance, variants_field)
+    return bool(file) and variants.get('source') != file.name
+
+
+def variant_files(variants):
+    """
+    Return the names of the stored files of a variants description.
+    """
+    return [size[ext] for size in variants.get('sizes', {}).values()
+            for ext, pil_format, options in FORMATS if size.get(ext)]
+
+
+def delete_files(storage, names):
+    """
+    Delete stored files once the transaction commits, so a rollback never
+    leaves rows pointing at missing files.
+    """
+    names = [name for name in names if name]
+
+    def delete():
+        for name in names:
+            try:
+                storage.delete(name)
+            except Exception:
+                logger.exception('Could not delete %s', name)
+    if names:
+        transaction.on_commit(delete)
+
+
+def delete_image_files(file, variants):
+    """
+    Delete an image's original file and its variants.
+    """
+    if file:
+        delete_files(file.storage, [file.name, *variant_files(variants)])
+
+
+def generate_variants(file):
+    """
+    Write the resized WebP and JPEG variants of an image file to its storage.
+
+    Returns the variants description stored on the model:
+    {'source': name, 'sizes': {variant: {'width', 'height', 'webp', 'jpeg'}}}
+    """
+    file.open('rb')
+    try:
+        with Image.open(file) as original:
+            original = ImageOps.exif_transpose(original)
+            if original.mode not in ('RGB', 'L'):
+                original = original.convert('RGB')
+            sizes = {}
+            stem, _ = os.path.splitext(file.name)
+            for variant, max_width in VARIANT_WIDTHS.items():
+                width = min(max_width, original.width)
+                height = round(original.height * width / original.width)
+                resized = original.resize((width, height), Image.LANCZOS) \
+                    if width < original.width else original
+                sizes[variant] = {'width': width, 'height': height}
+                for ext, pil_format, options in FORMATS:
+                    buffer = BytesIO()
+                    resized.save(buffer, pil_format, **options)
+                    name = file.storage.save(f'{stem}_{variant}.{ext}', ContentFile(buffer.getvalue()))
+                    sizes[variant][ext] = name
+    finally:
+        file.close()
+    return {'source': file.name, 'sizes': sizes}
+
+
+def build_variants(model_name, pk):
+    """
+    Generate and record the variants of one stored image.
+    """
+    model, field, variants_field = SOURCES[model_name]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not variants_are_stale(instance, field, variants_field):
+        return
+    file = getattr(instance, field)
+    try:
+        variants = generate_variants(file)
+    except Exception:
+        logger.exception('Could not generate variants for %s', file.name)
+        # Record the source anyway so a broken upload isn't retried forever
+        variants = {'source': file.name, 'sizes': {}}
+    # Only record the result if the image wasn't replaced in the meantime
+    if not model.objects.filter(pk=pk, **{field: file.name}).update(**{variants_field: variants}):
+        delete_files(file.storage, variant_files(variants))
+        return
+    # The files of the image this one replaced
+    replaced = getattr(instance, variants_field)
+    if replaced.get('source') and replaced['source'] != file.name:
+        delete_files(file.storage, [replaced['source'], *variant_files(replaced)])
+    product_id = pk if model is Product else instance.product_id
+    Product.objects.filter(pk=product_id).update(updated=timezone.now())
+    cache.invalidate_product(product_id)
+
+
+def _build_in_worker(model_name, pk):
+    try:
+        build_variants(model_name, pk)
+    except Exception:
+        logger.exception('Image variant worker failed for %s %s', model_name, pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(instance):
+    """
+    Generate the variants of a saved image once the transaction commits,
+    in the background worker pool unless PRODUCT_IMAGE_VARIANTS_ASYNC is off.
+    """
+    global _executor
+    model_name = instance._meta.model_name
+    if getattr(settings, 'PRODUCT_IMAGE_VARIANTS_ASYNC', True):
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2),
+                thread_name_prefix='image-variants')
+        transaction.on_commit(lambda: _executor.submit(_build_in_worker, model_name, instance.pk))
+    else:
+        transaction.on_commit(lambda: build_variants(model_name, instance.pk))
+
+
+def picture_source(obj):
+    """
+    Return (file, variants) for a ProductImage, or for a product's card image.
+    """
+    if isinstance(obj, ProductImage):
+        return obj.image, obj.variants
+    if obj.primary_image_id:
+        return obj.primary_image.image, obj.primary_image.variants
+    return obj.image or None, obj.image_variants
@@ -0,0 +1,322 @@
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from urllib.parse import urlparse
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from .models import Category, Product, ProductImage
+from . import autocomplete, cache, search
+
+logger = logging.getLogger(__name__)
+
+FAKESTORE_URL = 'https://fakestoreapi.com/products'
+
+# Stock given to imported products that don't say
+DEFAULT_STOCK = 10
+
+
+def is_url(source):
+    return urlparse(str(source)).scheme in ('http', 'https', 'file')
+
+
+def fetch(url, timeout=10, retries=3):
+    """
+    Return the body at url, retrying connection errors, timeouts and
+    server errors with exponential backoff. Client errors are not retried.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code < 500 or attempt == retries:
+                raise
+        except (urllib.error.URLError, TimeoutError, ConnectionError):
+            if attempt == retries:
+                raise
+        time.sleep(0.5 * 2 ** attempt)
+
+
+def _resolve_image(record, base):
+    # Images in local files may be given relative to the file
+    image = record.get('image')
+    if image and not is_url(image):
+        record['image'] = (base / image).resolve().as_uri()
+    return record
+
+
+def _read_file(path):
+    path = Path(path)
+    with path.open(encoding='utf-8') as f:
+        if path.suffix == '.jsonl':
+            for line in f:
+                if line.strip():
+                    yield _resolve_image(json.loads(line), path.parent)
+            return
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('products', [])
+    for record in data:
+        yield _resolve_image(record, path.parent)
+
+
+def read_source(source, timeout=10, retries=3):
+    """
+    Yield product records from a FakeStore-style API URL, a .json or
+    .jsonl file, or a directory of such files read in name order.
+    """
+    if is_url(source):
+        data = json.loads(fetch(source, timeout, retries))
+        yield from (data.get('products', []) if isinstance(data, dict) else data)
+    elif os.path.isdir(source):
+        for path in sorted(Path(source).iterdir()):
+            if path.suffix in ('.json', '.jsonl'):
+                yield from _read_file(path)
+    elif os.path.exists(source):
+        yield from _read_file(source)
+    else:
+        raise FileNotFoundError(f'No such file, directory or URL: {source}')
+
+
+def _clean(name, value):
+    # Checked per record, as the database would reject the whole batch
+    try:
+        return Product._meta.get_field(name).clean(value, None)
+    except ValidationError as e:
+        raise ValueError(f'{name}: {" ".join(e.messages)}')
+
+
+def normalize(record):
+    """
+    Map a FakeStore or catalogue export record onto Product fields.
+
+    Returns a dict with 'slug', 'fields', 'category' (a name or None) and
+    'image' (a URL or None). Raises ValueError for unusable records.
+    """
+    name = (record.get('name') or record.get('title') or '').strip()
+    if not name:
+        raise ValueError('A product needs a name or title.')
+    try:
+        price = _clean('price', Decimal(str(record['price'])))
+    except (KeyError, InvalidOperation):
+        raise ValueError(f'Invalid price for {name!r}.')
+    fields = {
+        'name': name[:200],
+        'description': record.get('description') or '',
+        'price': price,
+    }
+    if record.get('stock') is not None:
+        fields['stock'] = _clean('stock', record['stock'])
+    if record.get('available') is not None:
+        fields['available'] = bool(record['available'])
+    category = record.get('category')
+    if isinstance(category, dict):
+        category = category.get('name')
+    if category and len(category) > Category._meta.get_field('name').max_length:
+        raise ValueError(f'Category name too long for {name!r}.')
+    return {
+        'slug': slugify(record.get('slug') or name)[:200],
+        'fields': fields,
+        'category': category or None,
+        'image': record.get('image') or None,
+    }
+
+
+def upsert_categories(names):
+    """
+    Return {name: Category} for the names, creating missing ones in one query.
+    """
+    by_slug = {slugify(name): name for name in names}
+    existing = {c.slug: c for c in Category.objects.filter(slug__in=by_slug)}
+    missing = [
+        Category(name=name, slug=slug, description=f'Products in the {name} category')
+        for slug, name in by_slug.items() if slug not in existing
+    ]
+    for category in Category.objects.bulk_create(missing):
+        existing[category.slug] = category
+    return {name: existing[slug] for slug, name in by_slug.items()}
+
+
+def update_rows(objs, fields):
+    """
+    Write fields of model instances with a single executemany() UPDATE.
+
+    bulk_update() compiles a CASE expression per field and row, which costs
+    far more than the database work for batches of thousands of rows.
+    """
+    opts = objs[0]._meta
+    columns = [opts.get_field(name) for name in fields]
+    qn = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        qn(opts.db_table),
+        ', '.join(f'{qn(field.column)} = %s' for field in columns),
+        qn(opts.pk.column))
+    params = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in columns] + [obj.pk]
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def upsert_products(rows):
+    """
+    Create or update the products of normalized rows, matched on slug,
+    with bulk queries. Unchanged products are left alone, as are rows whose
+    slug several products have, since it's unclear which one they mean.
+    Returns ({slug: Product}, created, updated, ambiguous) with lists of
+    the written products and of the slugs left alone.
+    """
+    rows = {row['slug']: row for row in rows}
+    existing, ambiguous = {}, set()
+    for product in Product.objects.filter(slug__in=rows):
+        if product.slug in existing:
+            ambiguous.add(product.slug)
+        existing[product.slug] = product
+    for slug in ambiguous:
+        del rows[slug], existing[slug]
+    categories = upsert_categories({row['category'] for row in rows.values() if row['category']})
+    now = timezone.now()
+    to_create, to_update, changed = [], [], {'updated'}
+    for slug, row in rows.items():
+        fields = dict(row['fields'])
+        if row['category']:
+            fields['category_id'] = categories[row['category']].pk
+        product = existing.get(slug)
+        if product is None:
+            fields.setdefault('stock', DEFAULT_STOCK)
+            to_create.append(Product(slug=slug, **fields))
+            continue
+        differences = {field for field, value in fields.items() if getattr(product, field) != value}
+        if not differences:
+            continue
+        for field in differences:
+            setattr(product, field, fields[field])
+        # Queryset writes don't apply auto_now
+        product.updated = now
+        changed.update(differences)
+        to_update.append(product)
+    Product.objects.bulk_create(to_create)
+    if to_update:
+        update_rows(to_update, sorted(changed))
+    products = {**existing, **{p.slug: p for p in to_create}}
+    return products, to_create, to_update, sorted(ambiguous)
+
+
+def refresh_derived(products):
+    """
+    Update what product save signals would have: the search and
+    autocomplete indexes and the catalogue cache.
+    """
+    products = list(Product.objects.filter(pk__in=[p.pk for p in products]).select_related('category'))
+    search.get_backend().index(products)
+    for product in products:
+        autocomplete.update_product(product)
+    cache.invalidate_catalogue()
+
+
+def image_name(product, url):
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    return f'{product.slug}{ext if ext in (".jpg", ".jpeg", ".png", ".gif", ".webp") else ".jpg"}'
+
+
+class CatalogueImporter:
+    """
+    Imports product records in batches.
+
+    Each batch is written with bulk queries in one transaction, then the
+    images of its products that have none yet are downloaded in a bounded
+    thread pool. Progress is saved to a checkpoint file after every batch
+    so an interrupted import resumes where it stopped; re-importing the
+    same records is harmless either way.
+    """
+    def __init__(self, batch_size=500, workers=8, timeout=10, retries=3,
+                 download_images=True, checkpoint=None, log=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.download_images = download_images
+        self.checkpoint = Path(checkpoint) if checkpoint else None
+        self.log = log or logger.info
+        self.stats = {'created': 0, 'updated': 0, 'skipped': 0, 'images': 0, 'image_errors': 0}
+
+    def run(self, source):
+        done = self._load_checkpoint(source)
+        if done:
+            self.log(f'Resuming after {done} records')
+        batch = []
+        for position, record in enumerate(read_source(source, self.timeout, self.retries), 1):
+            if position <= done:
+                continue
+            try:
+                batch.append(normalize(record))
+            except ValueError as e:
+                self.stats['skipped'] += 1
+                self.log(f'Skipping record {position}: {e}')
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+                self._save_checkpoint(source, position)
+        if batch:
+            self._import_batch(batch)
+        if self.checkpoint and self.checkpoint.exists():
+            self.checkpoint.unlink()
+        return self.stats
+
+    def _import_batch(self, rows):
+        with transaction.atomic():
+            products, created, updated, ambiguous = upsert_products(rows)
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(updated)
+        for slug in ambiguous:
+            self.stats['skipped'] += 1
+            self.log(f'Skipping {slug!r}: several products have this slug')
+        if created or updated:
+            refresh_derived(created + updated)
+        if self.download_images:
+            self._download_images(products, {row['slug']: row['image'] for row in rows
+                                             if row['image'] and row['slug'] in products})
+        self.log(f'Imported {len(products)} products ({len(created)} new, {len(updated)} changed)')
+
+    def _download_images(self, products, urls):
+        have_images = set(ProductImage.objects.filter(
+            product__in=[products[slug] for slug in urls]).values_list('product__slug', flat=True))
+        wanted = {slug: url for slug, url in urls.items() if slug not in have_images}
+        if not wanted:
+            return
+        # Downloads run in the pool; files and rows are saved on this thread
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-import') as pool:
+            futures = {pool.submit(fetch, url, self.timeout, self.retries): slug
+                       for slug, url in wanted.items()}
+            for future in as_completed(futures):
+                slug = futures[future]
+                product = products[slug]
+                try:
+                    content = future.result()
+                except Exception as e:
+                    self.stats['image_errors'] += 1
+                    self.log(f'Could not download image for {product.name}: {e}')
+                    continue
+                image = ProductImage(product=product)
+                image.image.save(image_name(product, wanted[slug]), ContentFile(content), save=True)
+                self.stats['images'] += 1
+
+    def _load_checkpoint(self, source):
+        if not self.checkpoint or not self.checkpoint.exists():
+            return 0
+        state = json.loads(self.checkpoint.read_text())
+        return state['done'] if state.get('source') == str(source) else 0
+
+    def _save_checkpoint(self, source, done):
+        if self.checkpoint:
+            self.checkpoint.write_text(json.dumps({'source': str(source), 'done': done}))
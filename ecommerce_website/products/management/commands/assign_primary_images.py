@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from products.models import Product
+from products import cache
+
+
+class Command(BaseCommand):
+    help = 'Set the primary image of every product that has images but none selected'
+
+    def handle(self, *args, **options):
+        updated = Product.objects.assign_primary_images()
+        cache.invalidate_catalogue()
+        self.stdout.write(self.style.SUCCESS(f'Assigned primary images to {updated} products'))
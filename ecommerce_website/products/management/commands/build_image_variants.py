@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from products.images import SOURCES, build_variants, delete_files, variant_files, variants_are_stale
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized variants of product images that are missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate variants even if they are up to date')
+
+    def handle(self, *args, **options):
+        for model_name, (model, field, variants_field) in SOURCES.items():
+            images = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            if options['force']:
+                # The regenerated files take the place of the current ones
+                for instance in images.only('pk', field, variants_field).iterator():
+                    delete_files(getattr(instance, field).storage,
+                                 variant_files(getattr(instance, variants_field)))
+                images.update(**{variants_field: {}})
+            built = 0
+            for instance in images.only('pk', field, variants_field).iterator():
+                if variants_are_stale(instance, field, variants_field):
+                    build_variants(model_name, instance.pk)
+                    built += 1
+            self.stdout.write(f'Built variants for {built} {model._meta.verbose_name_plural}')
+        self.stdout.write(self.style.SUCCESS('Successfully built image variants'))
@@ -1,84 +1,44 @@
-import json
-import requests
-from django.core.management.base import BaseCommand
-from django.utils.text import slugify
-from products.models import Category, Product, ProductImage
-from django.core.files.base import ContentFile
-import urllib.request
+from django.core.management.base import BaseCommand, CommandError
+from products.importer import FAKESTORE_URL, CatalogueImporter
+
 
 class Command(BaseCommand):
-    help = 'Populate products from FakeStore API'
+    help = 'Populate products from the FakeStore API or local JSON/JSONL files'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default=FAKESTORE_URL,
+                            help='API URL, .json/.jsonl file or directory of them '
+                                 '(default: the FakeStore API)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products written per transaction')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Number of concurrent image downloads')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='Seconds before a request is abandoned')
+        parser.add_argument('--retries', type=int, default=3,
+                            help='Retries for failed requests')
+        parser.add_argument('--no-images', action='store_true',
+                            help='Skip downloading product images')
+        parser.add_argument('--checkpoint',
+                            help='File recording progress, to resume an interrupted import')
     
     def handle(self, *args, **options):
-        self.stdout.write('Fetching products from FakeStore API...')
-        
-        # Fetch categories first
-        categories_url = 'https://fakestoreapi.com/products/categories'
-        categories_response = requests.get(categories_url)
-        categories = categories_response.json()
-        
-        # Create categories
-        category_mapping = {}
-        for category_name in categories:
-            slug = slugify(category_name)
-            category, created = Category.objects.get_or_create(
-                slug=slug,
-                defaults={
-                    'name': category_name,
-                    'description': f'Products in the {category_name} category'
-                }
-            )
-            category_mapping[category_name] = category
-            if created:
-                self.stdout.write(f'Created category: {category_name}')
-            else:
-                self.stdout.write(f'Category already exists: {category_name}')
-        
-        # Fetch products
-        products_url = 'https://fakestoreapi.com/products'
-        products_response = requests.get(products_url)
-        products_data = products_response.json()
-        
-        # Create products
-        for item in products_data:
-            # Get or create the product
-            slug = slugify(item['title'])
-            product, created = Product.objects.get_or_create(
-                slug=slug,
-                defaults={
-                    'name': item['title'],
-                    'description': item['description'],
-                    'price': item['price'],
-                    'category': category_mapping.get(item['category']),
-                    'stock': 10,  # Default stock value
-                    'available': True
-                }
-            )
-            
-            if created:
-                self.stdout.write(f'Created product: {item["title"]}')
-                
-                # Create product image
-                try:
-                    # Get the image from the URL
-                    image_url = item['image']
-                    image_name = f"{slug}.jpg"
-                    
-                    # Create a ProductImage instance
-                    product_image = ProductImage(product=product)
-                    
-                    # Download the image and save it
-                    response = urllib.request.urlopen(image_url)
-                    product_image.image.save(
-                        image_name,
-                        ContentFile(response.read()),
-                        save=True
-                    )
-                    
-                    self.stdout.write(f'Added image for product: {item["title"]}')
-                except Exception as e:
-                    self.stdout.write(f'Error adding image for {item["title"]}: {str(e)}')
-            else:
-                self.stdout.write(f'Product already exists: {item["title"]}')
+        source = options['source']
+        self.stdout.write(f'Importing products from {source}...')
+        importer = CatalogueImporter(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            timeout=options['timeout'],
+            retries=options['retries'],
+            download_images=not options['no_images'],
+            checkpoint=options['checkpoint'],
+            log=self.stdout.write,
+        )
+        try:
+            stats = importer.run(source)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not import from {source}: {e}')
         
-        self.stdout.write(self.style.SUCCESS('Successfully populated products from FakeStore API'))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully populated products: {created} created, {updated} updated, '
+            '{skipped} skipped, {images} images added, {image_errors} image errors'.format(**stats)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from products.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized rating aggregates of every product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products updated per query')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding product ratings from reviews...')
+        rebuild_ratings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt product ratings'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from products import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products indexed per batch')
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        backend.install()
+        self.stdout.write(f'Rebuilding search index with {type(backend).__name__}...')
+        backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt the search index'))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Exists, OuterRef, Q, Subquery
 from django.urls import reverse
 from django.utils.text import slugify
 from django.contrib.auth.models import User
@@ -28,6 +29,25 @@ class Category(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
+class ProductQuerySet(models.QuerySet):
+    def available(self):
+        return self.filter(available=True)
+    
+    def for_cards(self):
+        """
+        Load everything a product card renders in the same query.
+        """
+        return self.select_related('category', 'primary_image')
+    
+    def assign_primary_images(self):
+        """
+        Give products without a primary image their first image, if any.
+        """
+        images = ProductImage.objects.filter(product=OuterRef('pk')).order_by('id')
+        return self.filter(Exists(images), primary_image__isnull=True) \
+            .update(primary_image=Subquery(images.values('id')[:1]))
+
+
 class Product(models.Model):
     # API integration fields
 
@@ -37,6 +57,7 @@ class Product(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200)
     image = models.ImageField(upload_to='products/%Y/%m/%d', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -50,10 +71,51 @@ class Product(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     
+    # Image shown on product cards, kept in sync with the product's images
+    primary_image = models.ForeignKey('ProductImage', related_name='+',
+                                      on_delete=models.SET_NULL, null=True, blank=True)
+    
+    # Review aggregates, maintained incrementally by products.ratings
+    reviews_updated = models.DateTimeField(null=True, blank=True, editable=False)
+    rating_avg = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    
+    # Columns written with queryset updates elsewhere; a plain save() must
+    # not overwrite them with the stale values held by the instance.
+    DERIVED_FIELDS = ('image_variants', 'primary_image', 'reviews_updated', 'rating_avg',
+                      'rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4',
+                      'rating_5')
+    
+    objects = ProductQuerySet.as_manager()
+    
     class Meta:
         ordering = ('name',)
         indexes = [
-            models.Index(fields=['id', 'slug']),
+            # Storefront listings only show available products, so their
+            # indexes leave out the rest. Listing pages and the home page
+            # seek on (name, id), overall and within a category.
+            models.Index(fields=['name', 'id'], condition=Q(available=True),
+                         name='product_listing_idx'),
+            models.Index(fields=['category', 'name', 'id'], condition=Q(available=True),
+                         name='product_category_listing_idx'),
+            # Holds every column the listing facet counts read, so they are
+            # counted from the index without visiting the table. The counts
+            # still read the whole index (see ProductFacets). available is
+            # repeated as a column because SQLite doesn't treat the partial
+            # condition as covering it.
+            models.Index(fields=['category', 'price', 'stock', 'rating_avg', 'available'],
+                         condition=Q(available=True), name='product_facets_idx'),
+            # Catalogue feed, in change order
+            models.Index(fields=['updated', 'id'], name='product_updated_idx'),
+            # Dashboard: low stock, and the product list newest first
+            models.Index(fields=['stock'], name='product_stock_idx'),
+            models.Index(fields=['-created'], name='product_created_idx'),
+            models.Index(fields=['category', '-created'], name='product_category_created_idx'),
         ]
     
     def __str__(self):
@@ -62,17 +124,48 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('products:product_detail', args=[self.id, self.slug])
     
+    @property
+    def card_image(self):
+        """
+        Image file for product cards: the primary image, else the legacy
+        product image.
+        """
+        if self.primary_image_id:
+            return self.primary_image.image
+        return self.image or None
+    
+    @property
+    def rating_histogram(self):
+        """
+        Review counts per star, from 5 stars down to 1.
+        """
+        return [(stars, getattr(self, f'rating_{stars}')) for stars in range(5, 0, -1)]
+    
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        if (not self._state.adding and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.DERIVED_FIELDS
+            ]
         super().save(*args, **kwargs)
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='products/%Y/%m/%d')
+    # Resized copies written by products.images after upload
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    
+    class Meta:
+        ordering = ('id',)
     
     def __str__(self):
         return f"Image for {self.product.name}"
+    
+    def make_primary(self):
+        Product.objects.filter(pk=self.product_id).update(primary_image=self)
 
 class Review(models.Model):
     product = models.ForeignKey(Product, related_name='reviews', on_delete=models.CASCADE)
@@ -84,6 +177,28 @@ class Review(models.Model):
     class Meta:
         ordering = ('-created',)
         unique_together = ('product', 'user')
+        indexes = [
+            # A product's reviews, newest first
+            models.Index(fields=['product', '-created'], name='review_product_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username}'s review for {self.product.name}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the product aggregates currently count for this review
+        instance._counted = (instance.product_id, instance.rating)
+        return instance
+
+class CatalogueChanges(models.Model):
+    """
+    The catalogue change counter kept by products.cache: a single row, so
+    every process and management command counts the same changes.
+    """
+    counter = models.PositiveBigIntegerField(default=0)
+    changed = models.DateTimeField()
+    
+    class Meta:
+        verbose_name_plural = 'catalogue changes'
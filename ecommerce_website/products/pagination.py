@@ -0,0 +1,142 @@
+import base64
+import json
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """
+    One page of a keyset paginated queryset.
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    Seek-method paginator.
+
+    Pages are addressed by an opaque cursor holding the sort key of the
+    first or last row shown, and fetched with a WHERE on that key instead
+    of OFFSET, so every page costs the same index range scan no matter how
+    deep into the listing it is. The ordering fields must be non-null and
+    the last one must be unique (usually the primary key).
+    """
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def page(self, cursor=None):
+        """
+        Return the page the cursor points at, or the first page.
+        """
+        if not cursor:
+            rows = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            return self._forward_page(rows, has_previous=False)
+        direction, values = self.decode_cursor(cursor)
+        if direction == 'next':
+            rows = list(self.queryset.filter(self._seek(values, reverse=False))
+                        .order_by(*self.ordering)[:self.per_page + 1])
+            return self._forward_page(rows, has_previous=True)
+        rows = list(self.queryset.filter(self._seek(values, reverse=True))
+                    .order_by(*self._reversed_ordering())[:self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page][::-1]
+        return KeysetPage(
+            rows,
+            next_cursor=self._cursor('next', rows[-1]) if rows else None,
+            previous_cursor=self._cursor('previous', rows[0]) if has_previous else None,
+        )
+
+    def rows_after(self, cursor=None):
+        """
+        Return the whole ordered queryset, starting after the row the
+        cursor points at, for consumers that read to the end.
+        """
+        queryset = self.queryset.order_by(*self.ordering)
+        if not cursor:
+            return queryset
+        direction, values = self.decode_cursor(cursor)
+        return queryset.filter(self._seek(values, reverse=False))
+
+    def cursor_for(self, obj):
+        """
+        Return the cursor resuming after obj.
+        """
+        return self._cursor('next', obj)
+
+    def _forward_page(self, rows, has_previous):
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(
+            rows,
+            next_cursor=self._cursor('next', rows[-1]) if has_next else None,
+            previous_cursor=self._cursor('previous', rows[0]) if has_previous and rows else None,
+        )
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+
+    def _seek(self, values, reverse):
+        """
+        Build a >= x AND ((a > x) OR (a = x AND b > y) ...) for the sort
+        key. The first term repeats what the rest implies so the database
+        can seek to the start of the range in the index on the key.
+        """
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.ordering, values):
+            field = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            lookup = f'{field}__lt' if descending else f'{field}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[field] = value
+        first = self.ordering[0]
+        descending = first.startswith('-') != reverse
+        field = first.lstrip('-')
+        return Q(**{f'{field}__lte' if descending else f'{field}__gte': values[0]}) & condition
+
+    def _cursor(self, direction, obj):
+        # value_to_string keeps full precision, which JSON encoding of
+        # datetimes and decimals would not
+        model = self.queryset.model
+        values = [model._meta.get_field(field).value_to_string(obj) for field in self.fields]
+        payload = json.dumps([direction, values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, values = json.loads(payload)
+            if direction not in ('next', 'previous') or len(values) != len(self.fields):
+                raise ValueError
+            model = self.queryset.model
+            values = [model._meta.get_field(field).to_python(value)
+                      for field, value in zip(self.fields, values)]
+        except Exception:
+            raise InvalidCursor(cursor)
+        return direction, values
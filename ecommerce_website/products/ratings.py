@@ -0,0 +1,72 @@
+from collections import Counter
+from django.db.models import Count, F, FloatField, Value
+from django.db.models.functions import Cast, Greatest, Now
+from django.utils import timezone
+from .models import Product, Review
+from . import cache
+
+STARS = range(1, 6)
+RATING_FIELDS = ('rating_avg', 'rating_count', *(f'rating_{n}' for n in STARS))
+
+
+def apply_rating_change(product_id, added=None, removed=None):
+    """
+    Adjust a product's rating aggregates for one added and/or removed rating,
+    and mark its reviews as changed.
+
+    The change is a single UPDATE computed from the current column values,
+    so concurrent reviews never overwrite each other's counts.
+    """
+    deltas = Counter()
+    if added:
+        deltas[added] += 1
+    if removed:
+        deltas[removed] -= 1
+    if not any(deltas.values()):
+        Product.objects.filter(pk=product_id).update(reviews_updated=Now())
+        return
+    stars = {n: F(f'rating_{n}') + deltas[n] for n in STARS}
+    count = F('rating_count') + sum(deltas.values())
+    total = sum(n * stars[n] for n in STARS)
+    # The product's rating changed, so it's in the next catalogue feed sync
+    Product.objects.filter(pk=product_id).update(
+        updated=Now(),
+        reviews_updated=Now(),
+        rating_count=count,
+        rating_avg=Cast(total, FloatField()) / Greatest(count, Value(1)),
+        **{f'rating_{n}': stars[n] for n in STARS if deltas[n]},
+    )
+
+
+def rebuild_ratings(batch_size=500):
+    """
+    Recompute the rating aggregates of every product from its reviews.
+    Products whose aggregates were wrong count as changed.
+    """
+    histograms = {}
+    grouped = Review.objects.order_by().values('product_id', 'rating').annotate(n=Count('id'))
+    for row in grouped:
+        histograms.setdefault(row['product_id'], Counter())[row['rating']] = row['n']
+
+    # Only the rating columns, so image and review changes made meanwhile stay
+    fields = (*RATING_FIELDS, 'updated')
+    now = timezone.now()
+    batch = []
+    for product in Product.objects.only('id', *fields).iterator(chunk_size=batch_size):
+        stored = [getattr(product, field) for field in RATING_FIELDS]
+        histogram = histograms.get(product.id, Counter())
+        for n in STARS:
+            setattr(product, f'rating_{n}', histogram[n])
+        product.rating_count = sum(histogram[n] for n in STARS)
+        total = sum(n * histogram[n] for n in STARS)
+        product.rating_avg = total / product.rating_count if product.rating_count else 0
+        if [getattr(product, field) for field in RATING_FIELDS] == stored:
+            continue
+        product.updated = now
+        batch.append(product)
+        if len(batch) >= batch_size:
+            Product.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, fields)
+    cache.invalidate_catalogue()
@@ -0,0 +1,304 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from .models import Product
+
+# Only word characters ever reach the database query, so user input can't
+# break out of the FTS5 / tsquery syntax.
+TERM_RE = re.compile(r'\w+')
+MAX_TERMS = 8
+
+
+def parse_terms(query):
+    """
+    Split a raw search string into lower-cased search terms.
+    """
+    return TERM_RE.findall((query or '').lower())[:MAX_TERMS]
+
+
+class SearchResults:
+    """
+    Lazy, ranked result set for a search query.
+
+    Implements count() and slicing so it can be handed straight to a
+    Paginator; only the requested page is ever fetched from the index.
+    """
+    def __init__(self, backend, terms):
+        self.backend = backend
+        self.terms = terms
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.terms) if self.terms else 0
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        offset = key.start or 0
+        limit = (key.stop - offset) if key.stop is not None else self.count() - offset
+        if not self.terms or limit <= 0:
+            return []
+        ids = self.backend.ranked_ids(self.terms, offset, limit)
+        products = Product.objects.for_cards().in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
+
+
+class SearchBackend:
+    """
+    Base class for the product search index.
+
+    Only available products are kept in the index, so every hit can be
+    shown without going back to the product table to filter.
+    """
+    def install(self):
+        """
+        Create the index structures. Returns True if they were created.
+        """
+        return False
+
+    def index(self, products):
+        raise NotImplementedError
+
+    def remove(self, product_ids):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def count(self, terms):
+        raise NotImplementedError
+
+    def ranked_ids(self, terms, offset, limit):
+        raise NotImplementedError
+
+    def rebuild(self, batch_size=500):
+        """
+        Re-index every product from scratch.
+        """
+        self.clear()
+        products = Product.objects.filter(available=True).select_related('category')
+        batch = []
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                self.index(batch)
+                batch = []
+        if batch:
+            self.index(batch)
+
+    def search(self, query):
+        return SearchResults(self, parse_terms(query))
+
+    @staticmethod
+    def document(product):
+        category = product.category.name if product.category_id else ''
+        return product.name, category, product.description or ''
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    SQLite FTS5 index using the porter stemmer, ranked with bm25.
+    """
+    table = 'products_product_fts'
+    # bm25 column weights for name, category and description
+    weights = (10.0, 4.0, 1.0)
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [self.table])
+            if cursor.fetchone():
+                return False
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {self.table} USING fts5("
+                "name, category, description, "
+                "tokenize = 'porter unicode61 remove_diacritics 2')")
+        return True
+
+    def index(self, products):
+        products = list(products)
+        self.remove([p.id for p in products])
+        rows = [(p.id, *self.document(p)) for p in products if p.available]
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {self.table} (rowid, name, category, description) '
+                    'VALUES (%s, %s, %s, %s)', rows)
+
+    def remove(self, product_ids):
+        if product_ids:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'DELETE FROM {self.table} WHERE rowid = %s',
+                    [(pk,) for pk in product_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def match(self, terms):
+        # Every term must match; the prefix operator keeps partially typed
+        # words working as the user types.
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def count(self, terms):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {self.table} WHERE {self.table} MATCH %s',
+                [self.match(terms)])
+            return cursor.fetchone()[0]
+
+    def ranked_ids(self, terms, offset, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, %s, %s, %s), rowid LIMIT %s OFFSET %s',
+                [self.match(terms), *self.weights, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    PostgreSQL tsvector index with a GIN index, ranked with ts_rank_cd.
+    """
+    table = 'products_product_search'
+
+    @property
+    def config(self):
+        return getattr(settings, 'PRODUCT_SEARCH_LANGUAGE', 'english')
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s)', [self.table])
+            if cursor.fetchone()[0]:
+                return False
+            cursor.execute(
+                f'CREATE TABLE {self.table} ('
+                'product_id bigint PRIMARY KEY, '
+                'document tsvector NOT NULL)')
+            cursor.execute(
+                f'CREATE INDEX {self.table}_document ON {self.table} USING GIN (document)')
+        return True
+
+    def index(self, products):
+        products = list(products)
+        self.remove([p.id for p in products if not p.available])
+        rows = []
+        for product in products:
+            if product.available:
+                name, category, description = self.document(product)
+                rows.append((product.id, self.config, name, self.config, category,
+                             self.config, description))
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {self.table} (product_id, document) VALUES (%s, '
+                    "setweight(to_tsvector(%s::regconfig, %s), 'A') || "
+                    "setweight(to_tsvector(%s::regconfig, %s), 'B') || "
+                    "setweight(to_tsvector(%s::regconfig, %s), 'C')) "
+                    'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                    rows)
+
+    def remove(self, product_ids):
+        if product_ids:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {self.table} WHERE product_id = ANY(%s)',
+                    [list(product_ids)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+    def tsquery(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def count(self, terms):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {self.table} '
+                'WHERE document @@ to_tsquery(%s::regconfig, %s)',
+                [self.config, self.tsquery(terms)])
+            return cursor.fetchone()[0]
+
+    def ranked_ids(self, terms, offset, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT product_id FROM {self.table}, '
+                'to_tsquery(%s::regconfig, %s) query WHERE document @@ query '
+                'ORDER BY ts_rank_cd(document, query) DESC, product_id '
+                'LIMIT %s OFFSET %s',
+                [self.config, self.tsquery(terms), limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SimpleSearchBackend(SearchBackend):
+    """
+    Fallback for databases without a full-text index: unranked icontains
+    matching on every term.
+    """
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def rebuild(self, batch_size=500):
+        pass
+
+    def queryset(self, terms):
+        products = Product.objects.filter(available=True)
+        for term in terms:
+            products = products.filter(
+                Q(name__icontains=term) |
+                Q(description__icontains=term) |
+                Q(category__name__icontains=term)
+            )
+        return products.order_by('name', 'id')
+
+    def count(self, terms):
+        return self.queryset(terms).count()
+
+    def ranked_ids(self, terms, offset, limit):
+        return list(self.queryset(terms).values_list('id', flat=True)[offset:offset + limit])
+
+
+_backends = {}
+
+
+def get_backend():
+    """
+    Return the search backend for the default database.
+    """
+    vendor = connection.vendor
+    if vendor not in _backends:
+        if vendor == 'postgresql':
+            _backends[vendor] = PostgresSearchBackend()
+        elif vendor == 'sqlite' and _sqlite_has_fts5():
+            _backends[vendor] = SQLiteSearchBackend()
+        else:
+            _backends[vendor] = SimpleSearchBackend()
+    return _backends[vendor]
+
+
+def _sqlite_has_fts5():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def search(query):
+    """
+    Search available products, best matches first.
+    """
+    return get_backend().search(query)
@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Category, Product, ProductImage, Review
+from . import autocomplete, cache, images, ratings, search
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.get_backend().index([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.get_backend().remove([instance.id])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, **kwargs):
+    # The category name is part of every product document
+    if not created and not raw:
+        search.get_backend().index(instance.products.select_related('category'))
+
+
+@receiver(post_save, sender=ProductImage)
+def assign_primary_image(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        Product.objects.filter(pk=instance.product_id, primary_image__isnull=True) \
+            .update(primary_image=instance)
+
+
+@receiver(post_save, sender=ProductImage)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw and images.variants_are_stale(instance, 'image', 'variants'):
+        images.schedule_variants(instance)
+
+
+@receiver(post_save, sender=Product)
+def build_product_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw and images.variants_are_stale(instance, 'image', 'image_variants'):
+        images.schedule_variants(instance)
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_files(sender, instance, **kwargs):
+    images.delete_image_files(instance.image, instance.variants)
+
+
+@receiver(post_delete, sender=Product)
+def delete_product_image_files(sender, instance, **kwargs):
+    images.delete_image_files(instance.image, instance.image_variants)
+
+
+@receiver(post_delete, sender=ProductImage)
+def replace_primary_image(sender, instance, **kwargs):
+    # The foreign key was already set to NULL if this was the primary image
+    Product.objects.filter(pk=instance.product_id).assign_primary_images()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_product(sender, instance, raw=False, **kwargs):
+    # Images are part of the product as far as its cached pages go
+    if not raw:
+        Product.objects.filter(pk=instance.product_id).update(updated=timezone.now())
+
+
+# The prefix index lives in process memory, so it only follows committed changes
+
+@receiver(post_save, sender=Product)
+def update_product_autocomplete(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: autocomplete.update_product(instance))
+
+
+@receiver(post_save, sender=Category)
+def update_category_autocomplete(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: autocomplete.update_category(instance))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    kind, pk = sender._meta.model_name, instance.pk
+    transaction.on_commit(lambda: autocomplete.remove(kind, pk))
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    counted = getattr(instance, '_counted', None)
+    current = (instance.product_id, instance.rating)
+    if counted == current:
+        # Only the comment changed; the call still marks the reviews as updated
+        ratings.apply_rating_change(instance.product_id)
+        return
+    if counted and counted[0] != instance.product_id:
+        ratings.apply_rating_change(counted[0], removed=counted[1])
+        # The cache receivers below only see the product it moved to
+        moved_from = counted[0]
+        transaction.on_commit(lambda: cache.invalidate_product(moved_from))
+        counted = None
+    ratings.apply_rating_change(instance.product_id, added=instance.rating,
+                                removed=counted[1] if counted else None)
+    instance._counted = current
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, **kwargs):
+    counted = getattr(instance, '_counted', (instance.product_id, instance.rating))
+    ratings.apply_rating_change(counted[0], removed=counted[1])
+
+
+# Cache invalidation is connected last so it runs after the handlers above
+# have updated the denormalized columns. Like the autocomplete index, the
+# cache only follows committed changes, so a concurrent request can't
+# cache the old rows again before the commit.
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    transaction.on_commit(cache.invalidate_catalogue)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: cache.invalidate_product(product_id))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_related_product_cache(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: cache.invalidate_product(product_id))
+
+
+def install_search_index(sender, **kwargs):
+    """
+    Create the search index after migrate, filling it if it is new.
+    """
+    backend = search.get_backend()
+    if backend.install():
+        backend.rebuild()
@@ -0,0 +1,48 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from products.images import VARIANT_WIDTHS, picture_source
+
+register = template.Library()
+
+# Rendered width of each variant in the page layout, for the sizes attribute
+SIZES = {
+    'thumbnail': '160px',
+    'card': '(min-width: 992px) 25vw, (min-width: 768px) 50vw, 100vw',
+    'detail': '(min-width: 992px) 50vw, 100vw',
+    'zoom': '100vw',
+}
+
+
+@register.simple_tag
+def picture(obj, variant='card', placeholder='img/no_image.png', **attrs):
+    """
+    Render a product or product image as a <picture> with WebP and JPEG
+    srcsets, falling back to the original file until variants exist.
+
+    Usage: {% picture product 'card' class="product-img" alt=product.name %}
+    """
+    file, variants = picture_source(obj)
+    attrs.setdefault('loading', 'lazy')
+    attributes = format_html_join('', ' {}="{}"', attrs.items())
+    if not file:
+        return format_html('<img src="{}"{}>', static(placeholder), attributes)
+    sizes = variants.get('sizes') if variants.get('source') == file.name else None
+    if not sizes or variant not in sizes:
+        return format_html('<img src="{}"{}>', file.url, attributes)
+
+    storage = file.storage
+    largest = sizes[variant]['width']
+    # Offer up to twice the nominal size for high density screens
+    candidates = [v for v in VARIANT_WIDTHS if v in sizes and sizes[v]['width'] <= largest * 2]
+
+    def srcset(ext):
+        return ', '.join(f"{storage.url(sizes[v][ext])} {sizes[v]['width']}w" for v in candidates)
+
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}"{}></picture>',
+        srcset('webp'), SIZES[variant],
+        storage.url(sizes[variant]['jpeg']), srcset('jpeg'), SIZES[variant],
+        sizes[variant]['width'], sizes[variant]['height'], attributes,
+    )
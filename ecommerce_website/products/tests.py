@@ -1,3 +1,1135 @@
-from django.test import TestCase
+import base64
+import functools
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from .models import CatalogueChanges, Category, Product, ProductImage, Review
+from .pagination import InvalidCursor, KeysetPaginator
+from . import autocomplete, cache, checks, images, search
 
-# Create your tests here.
+
+class PrimaryImageTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Lamp', price=10)
+
+    def test_first_image_becomes_primary(self):
+        first = ProductImage.objects.create(product=self.product, image='products/a.jpg')
+        ProductImage.objects.create(product=self.product, image='products/b.jpg')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, first)
+
+    def test_deleting_primary_promotes_next_image(self):
+        first = ProductImage.objects.create(product=self.product, image='products/a.jpg')
+        second = ProductImage.objects.create(product=self.product, image='products/b.jpg')
+        first.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, second)
+        second.delete()
+        self.product.refresh_from_db()
+        self.assertIsNone(self.product.primary_image)
+
+    def test_save_does_not_overwrite_primary_image(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        image = ProductImage.objects.create(product=self.product, image='products/a.jpg')
+        stale.name = 'Desk lamp'
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, image)
+
+
+@override_settings(PRODUCT_IMAGE_VARIANTS_ASYNC=False)
+class ProductImageVariantTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Lamp', price=10)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def upload(self, name, width, height):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def add_image(self, width=2000, height=1000):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=self.upload('lamp.jpg', width, height))
+        return ProductImage.objects.get(pk=image.pk)
+
+    def files(self, image):
+        return [image.image.name, *images.variant_files(image.variants)]
+
+    def exists(self, names):
+        return [default_storage.exists(name) for name in names]
+
+    def render(self, obj, variant='card'):
+        return Template('{% load product_images %}{% picture obj variant alt="Lamp" %}') \
+            .render(Context({'obj': obj, 'variant': variant}))
+
+    def test_variants_are_generated(self):
+        image = self.add_image()
+        self.assertEqual(image.variants['source'], image.image.name)
+        self.assertEqual({variant: (size['width'], size['height'])
+                          for variant, size in image.variants['sizes'].items()},
+                         {'thumbnail': (160, 80), 'card': (480, 240), 'detail': (960, 480),
+                          'zoom': (1600, 800)})
+        self.assertEqual(self.exists(self.files(image)), [True] * 9)
+        with default_storage.open(image.variants['sizes']['card']['webp']) as f, Image.open(f) as card:
+            self.assertEqual((card.format, card.size), ('WEBP', (480, 240)))
+        # Never enlarged
+        small = self.add_image(300, 200)
+        self.assertEqual({size['width'] for size in small.variants['sizes'].values()}, {160, 300})
+
+    def test_picture_tag(self):
+        image = self.add_image()
+        sizes = image.variants['sizes']
+        html = self.render(image)
+        self.assertInHTML(
+            '<picture><source type="image/webp" sizes="{0}" srcset="{1} 160w, {2} 480w, {3} 960w">'
+            '<img src="{4}" srcset="{5} 160w, {4} 480w, {6} 960w" sizes="{0}" width="480" height="240" '
+            'loading="lazy" alt="Lamp"></picture>'.format(
+                '(min-width: 992px) 25vw, (min-width: 768px) 50vw, 100vw',
+                *[default_storage.url(sizes[variant]['webp']) for variant in ('thumbnail', 'card', 'detail')],
+                default_storage.url(sizes['card']['jpeg']),
+                default_storage.url(sizes['thumbnail']['jpeg']),
+                default_storage.url(sizes['detail']['jpeg'])),
+            html)
+        # Products render their primary image
+        self.product.refresh_from_db()
+        self.assertEqual(self.render(self.product), html)
+        # The original until variants exist, and a placeholder without an image
+        ProductImage.objects.filter(pk=image.pk).update(variants={})
+        image.refresh_from_db()
+        self.assertInHTML(f'<img src="{image.image.url}" loading="lazy" alt="Lamp">', self.render(image))
+        self.assertIn('img/no_image.png', self.render(Product(name='Desk', price=1)))
+
+    def test_replaced_and_deleted_images_lose_their_files(self):
+        image = self.add_image()
+        old = self.files(image)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.image = self.upload('shade.jpg', 800, 800)
+            image.save()
+        image.refresh_from_db()
+        self.assertEqual(self.exists(old), [False] * 9)
+        new = self.files(image)
+        self.assertEqual(self.exists(new), [True] * 9)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertEqual(self.exists(new), [False] * 9)
+
+    def test_forced_rebuilds_replace_the_variant_files(self):
+        image = self.add_image()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('build_image_variants', force=True, stdout=StringIO())
+        image.refresh_from_db()
+        # Only the image and its current variants are left
+        directory = os.path.dirname(default_storage.path(image.image.name))
+        self.assertEqual(sorted(os.listdir(directory)),
+                         sorted(os.path.basename(name) for name in self.files(image)))
+
+    def test_deleted_products_lose_their_files(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Desk', price=1, image=self.upload('desk.jpg', 600, 300))
+        product.refresh_from_db()
+        files = [product.image.name, *images.variant_files(product.image_variants)]
+        self.assertEqual(self.exists(files), [True] * 9)
+        image = self.add_image()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+            self.product.delete()
+        self.assertEqual(self.exists(files + self.files(image)), [False] * 18)
+
+
+class ProductRatingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Lamp', price=10)
+        cls.other = Product.objects.create(name='Desk', price=50)
+        cls.users = [User.objects.create(username=f'user{i}') for i in range(3)]
+
+    def ratings(self, product):
+        product = Product.objects.get(pk=product.pk)
+        return (product.rating_count, round(product.rating_avg, 2),
+                [getattr(product, f'rating_{n}') for n in range(1, 6)])
+
+    def review(self, user, rating, product=None):
+        return Review.objects.create(product=product or self.product, user=user, rating=rating)
+
+    def test_reviews_update_the_aggregates(self):
+        first = self.review(self.users[0], 5)
+        self.review(self.users[1], 2)
+        self.assertEqual(self.ratings(self.product), (2, 3.5, [0, 1, 0, 0, 1]))
+        # Changing the rating, on a fresh instance too
+        first.rating = 4
+        first.save()
+        review = Review.objects.get(pk=first.pk)
+        review.rating = 3
+        review.save()
+        self.assertEqual(self.ratings(self.product), (2, 2.5, [0, 1, 1, 0, 0]))
+        # Comment only: counts stay, reviews_updated moves
+        before = Product.objects.get(pk=self.product.pk).reviews_updated
+        review.comment = 'Bright.'
+        review.save()
+        self.assertEqual(self.ratings(self.product), (2, 2.5, [0, 1, 1, 0, 0]))
+        self.assertGreaterEqual(Product.objects.get(pk=self.product.pk).reviews_updated, before)
+        review.delete()
+        self.assertEqual(self.ratings(self.product), (1, 2.0, [0, 1, 0, 0, 0]))
+        Review.objects.get().delete()
+        self.assertEqual(self.ratings(self.product), (0, 0.0, [0, 0, 0, 0, 0]))
+
+    def test_review_moving_to_another_product(self):
+        review = self.review(self.users[0], 4)
+        self.review(self.users[1], 2)
+        review.product = self.other
+        review.rating = 5
+        review.save()
+        self.assertEqual(self.ratings(self.product), (1, 2.0, [0, 1, 0, 0, 0]))
+        self.assertEqual(self.ratings(self.other), (1, 5.0, [0, 0, 0, 0, 1]))
+        review = Review.objects.get(pk=review.pk)
+        review.product = self.product
+        review.save()
+        self.assertEqual(self.ratings(self.product), (2, 3.5, [0, 1, 0, 0, 1]))
+        self.assertEqual(self.ratings(self.other), (0, 0.0, [0, 0, 0, 0, 0]))
+
+    def test_deleting_a_reviewed_product(self):
+        self.review(self.users[0], 4)
+        self.review(self.users[1], 2, self.other)
+        self.product.delete()
+        self.assertFalse(Review.objects.filter(product_id=self.product.pk).exists())
+        self.assertEqual(self.ratings(self.other), (1, 2.0, [0, 1, 0, 0, 0]))
+
+    def test_stale_product_saves_keep_derived_columns(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.review(self.users[0], 5)
+        image = ProductImage.objects.create(product=self.product, image='products/a.jpg')
+        stale.name = 'Desk Lamp'
+        stale.save()
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.name, 'Desk Lamp')
+        self.assertEqual((product.rating_count, product.rating_avg), (1, 5.0))
+        self.assertEqual(product.primary_image, image)
+        # Explicit update_fields and new products are left alone
+        stale.rating_count = 7
+        stale.save(update_fields=['rating_count'])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).rating_count, 7)
+        copy = Product(name='Copy', price=1, rating_count=3)
+        copy.save()
+        self.assertEqual(Product.objects.get(pk=copy.pk).rating_count, 3)
+
+    def test_rebuild_ratings(self):
+        for i, user in enumerate(self.users):
+            self.review(user, i + 3)
+        self.review(self.users[0], 1, self.other)
+        expected = [self.ratings(self.product), self.ratings(self.other)]
+        Product.objects.update(rating_count=9, rating_avg=1, rating_1=9, rating_5=0)
+        call_command('rebuild_ratings', batch_size=1, stdout=StringIO())
+        self.assertEqual([self.ratings(self.product), self.ratings(self.other)], expected)
+        self.assertEqual(expected[0], (3, 4.0, [0, 0, 1, 1, 1]))
+
+    def test_rebuild_ratings_keeps_other_changes(self):
+        self.review(self.users[0], 4)
+        Product.objects.update(rating_count=9)
+        reviewed = timezone.now() + timedelta(minutes=1)
+        bulk_update = Product.objects.bulk_update
+
+        def change_then_update(objs, fields, **kwargs):
+            # Written after the batch was loaded
+            Product.objects.filter(pk=self.product.pk).update(image_variants={'sizes': {'card': 'card.jpg'}},
+                                                              reviews_updated=reviewed)
+            return bulk_update(objs, fields, **kwargs)
+
+        with mock.patch.object(Product.objects, 'bulk_update', side_effect=change_then_update):
+            call_command('rebuild_ratings', stdout=StringIO())
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.image_variants, {'sizes': {'card': 'card.jpg'}})
+        self.assertEqual(product.reviews_updated, reviewed)
+        self.assertEqual(self.ratings(product), (1, 4.0, [0, 0, 0, 1, 0]))
+
+
+class ProductListQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(name=f'Category {i}') for i in range(3)]
+        users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        for i in range(30):
+            product = Product.objects.create(name=f'Product {i:02}', price=i + 1,
+                                             category=categories[i % 3])
+            ProductImage.objects.create(product=product, image=f'products/{i}.jpg')
+            ProductImage.objects.create(product=product, image=f'products/{i}b.jpg')
+            for user in users[:i % 4]:
+                Review.objects.create(product=product, user=user, rating=i % 5 + 1)
+
+    def setUp(self):
+        caches[settings.CATALOGUE_CACHE_ALIAS].clear()
+
+    def count_queries(self, url, per_page):
+        with override_settings(PRODUCTS_PER_PAGE=per_page):
+            # Warm the catalogue cache so both runs do the same lookups
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), per_page)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        url = reverse('products:product_list')
+        self.assertEqual(self.count_queries(url, 5), self.count_queries(url, 25))
+
+    def test_category_query_count_does_not_depend_on_page_size(self):
+        url = reverse('products:product_list_by_category', args=['category-1'])
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 10))
+
+    def test_home_page_renders_ratings_without_queries(self):
+        self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        # The change counter for the ETag and Last-Modified, then the cards,
+        # besides reads of the catalogue cache
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if settings.CACHES['catalogue']['LOCATION'] not in query['sql']]), 3)
+        # Product 27 has three reviews
+        self.assertContains(response, '<span class="ms-1 text-muted small">(3)</span>', html=True)
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Repeated names and prices, so pages break inside runs of ties
+        for i in range(9):
+            Product.objects.create(name=f'Lamp {i // 3}', price=i % 4 + 1)
+
+    def walk(self, paginator):
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([product.id for product in page])
+            if not page.has_next:
+                return pages, page
+            cursor = page.next_cursor
+
+    def test_pages_cover_the_ordering_once(self):
+        for ordering in [('name', 'id'), ('-price', 'id'), ('price', '-id')]:
+            paginator = KeysetPaginator(Product.objects.all(), ordering, per_page=2)
+            pages, last = self.walk(paginator)
+            expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+            self.assertEqual(sum(pages, []), expected, ordering)
+            self.assertEqual([len(page) for page in pages], [2, 2, 2, 2, 1])
+            # And back again from the last page
+            back, page = [], last
+            while page.has_previous:
+                page = paginator.page(page.previous_cursor)
+                back.append([product.id for product in page])
+            self.assertEqual(back, pages[-2::-1], ordering)
+
+    def test_rows_after_resumes_after_the_cursor_row(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('price', 'id'), per_page=None)
+        rows = list(paginator.rows_after())
+        self.assertEqual(list(paginator.rows_after(paginator.cursor_for(rows[3]))), rows[4:])
+        self.assertEqual(list(paginator.rows_after(paginator.cursor_for(rows[-1]))), [])
+
+    def test_cursors_keep_full_precision(self):
+        product = Product.objects.create(name='Lamp 0', price=Decimal('1.50'))
+        paginator = KeysetPaginator(Product.objects.all(), ('price', 'created', 'id'), per_page=2)
+        direction, values = paginator.decode_cursor(paginator.cursor_for(product))
+        self.assertEqual((direction, values), ('next', [product.price, product.created, product.id]))
+
+    def test_invalid_cursors(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('name', 'id'), per_page=2)
+        other = KeysetPaginator(Product.objects.all(), ('id',), per_page=2)
+        product = Product.objects.first()
+        encode = lambda value: base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+        for cursor in ['not a cursor', other.cursor_for(product), encode(['sideways', ['Lamp', '1']]),
+                       encode(['next', ['Lamp', 'one']]), encode({'next': 1})]:
+            with self.assertRaises(InvalidCursor, msg=cursor):
+                paginator.page(cursor)
+        # Listings show the first page instead
+        response = self.client.get(reverse('products:product_list'), {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page'].has_previous)
+
+
+class ProductFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lamps = Category.objects.create(name='Lamps')
+        cls.desks = Category.objects.create(name='Desks')
+        for price, stock, rating, category in [(10, 0, 5, cls.lamps), (30, 2, 4, cls.lamps),
+                                               (30, 0, 2, cls.lamps), (60, 1, 3, cls.desks),
+                                               (300, 5, 0, cls.desks)]:
+            Product.objects.create(name=f'Item {price}', price=price, stock=stock,
+                                   rating_avg=rating, category=category)
+        Product.objects.create(name='Hidden', price=30, stock=1, category=cls.lamps, available=False)
+
+    def setUp(self):
+        caches[settings.CATALOGUE_CACHE_ALIAS].clear()
+
+    def facets(self, url, **params):
+        response = self.client.get(url, params)
+        facets = response.context['facets']
+        return response, {
+            'categories': [(category.name, count) for category, count in facets['categories']],
+            'all': facets['category_all'],
+            'price': {option['key']: option['count'] for option in facets['price']},
+            'in_stock': facets['in_stock']['count'],
+            'rating': {option['threshold']: option['count'] for option in facets['rating']},
+        }
+
+    def test_counts_apply_every_other_filter(self):
+        url = reverse('products:product_list_by_category', args=['lamps'])
+        response, counts = self.facets(url, price='25-50')
+        self.assertEqual(len(response.context['products']), 2)
+        self.assertEqual(counts, {
+            # Categories are counted with the price filter, across the catalogue
+            'categories': [('Desks', 0), ('Lamps', 2)], 'all': 2,
+            # Prices ignore the price filter but stay within the category
+            'price': {'0-25': 1, '25-50': 2, '50-100': 0, '100-250': 0, '250-': 0},
+            'in_stock': 1,
+            'rating': {4: 1, 3: 1, 2: 2, 1: 2},
+        })
+        response, counts = self.facets(url, price='25-50', in_stock='1', rating='3')
+        self.assertEqual([product.name for product in response.context['products']], ['Item 30'])
+        self.assertEqual(counts['price'], {'0-25': 0, '25-50': 1, '50-100': 0, '100-250': 0, '250-': 0})
+        self.assertEqual((counts['in_stock'], counts['rating']), (1, {4: 1, 3: 1, 2: 1, 1: 1}))
+
+    def test_unknown_filters_are_ignored(self):
+        response, counts = self.facets(reverse('products:product_list'), price='cheap', rating='9')
+        self.assertEqual(len(response.context['products']), 5)
+        self.assertEqual(counts['all'], 5)
+
+    def test_counts_are_cached_until_the_catalogue_changes(self):
+        url = reverse('products:product_list')
+        self.facets(url)
+        with CaptureQueriesContext(connection) as queries:
+            response, counts = self.facets(url)
+        self.assertFalse([query for query in queries if 'FILTER' in query['sql']])
+        product = Product.objects.get(price=60)
+        product.stock = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response, counts = self.facets(url)
+        self.assertEqual(counts['in_stock'], 2)
+
+
+class CatalogueCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Lamps')
+        cls.product = Product.objects.create(name='Desk Lamp', price=20, category=cls.category)
+
+    def setUp(self):
+        caches[settings.CATALOGUE_CACHE_ALIAS].clear()
+
+    def counters(self, lookup):
+        return next((hits, misses) for name, hits, misses in cache.stats() if name == lookup)
+
+    def test_hits_and_misses_are_counted(self):
+        hits, misses = self.counters('product')
+        cache.get_product_or_404(self.product.id)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(cache.get_product_or_404(self.product.id).category, self.category)
+        self.assertFalse([query for query in queries.captured_queries if 'products_' in query['sql']])
+        self.assertEqual(self.counters('product'), (hits + 1, misses + 1))
+        # Missing products are cached too
+        for _ in range(2):
+            with self.assertRaises(Http404):
+                cache.get_product_or_404(0)
+        self.assertEqual(self.counters('product'), (hits + 2, misses + 2))
+        self.assertIn(('product', hits + 2, misses + 2), cache.stats())
+
+    def test_invalidation_reaches_other_processes(self):
+        cache.get_product_or_404(self.product.id)
+        Product.objects.filter(pk=self.product.pk).update(name='Floor Lamp')
+        # Another process has a cache connection of its own
+        other = caches.create_connection(settings.CATALOGUE_CACHE_ALIAS)
+        with mock.patch.object(cache, 'get_cache', return_value=other):
+            cache.invalidate_catalogue()
+        self.assertEqual(cache.get_product_or_404(self.product.id).name, 'Floor Lamp')
+
+    def test_process_local_cache_is_refused(self):
+        self.assertEqual(checks.check_catalogue_cache(None), [])
+        with self.settings(CATALOGUE_CACHE_ALIAS='default'):
+            self.assertEqual([error.id for error in checks.check_catalogue_cache(None)], ['products.E001'])
+
+    def test_changes_invalidate_on_commit(self):
+        cache.get_product_or_404(self.product.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Floor Lamp'
+            self.product.save()
+            # Still the committed row until the transaction commits
+            self.assertEqual(cache.get_product_or_404(self.product.id).name, 'Desk Lamp')
+        self.assertEqual(cache.get_product_or_404(self.product.id).name, 'Floor Lamp')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, user=User.objects.create(username='critic'),
+                                  rating=4)
+        self.assertEqual(cache.get_product_or_404(self.product.id).rating_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Lights'
+            self.category.save()
+        self.assertEqual(cache.get_product_or_404(self.product.id).category.name, 'Lights')
+        self.assertEqual([category.name for category in cache.get_categories()], ['Lights'])
+
+        product_id = self.product.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        with self.assertRaises(Http404):
+            cache.get_product_or_404(product_id)
+
+    def test_review_moving_products_invalidates_both(self):
+        other = Product.objects.create(name='Floor Lamp', price=80)
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(product=self.product, rating=5,
+                                           user=User.objects.create(username='critic'))
+        for product in (self.product, other):
+            cache.get_product_or_404(product.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            review.product = other
+            review.save()
+        self.assertEqual(cache.get_product_or_404(self.product.id).rating_count, 0)
+        self.assertEqual(cache.get_product_or_404(other.id).rating_count, 1)
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        self.index = self.enterContext(mock.patch.object(autocomplete, '_index', autocomplete.PrefixIndex()))
+
+    def suggest(self, query):
+        response = self.client.get(reverse('products:product_autocomplete'), {'q': query})
+        return [(result['type'], result['label']) for result in response.json()['results']]
+
+    def test_lookup_matches_word_prefixes_categories_first(self):
+        self.index.build([('product', i, f'Lamp {i:02}', f'/p/{i}/') for i in range(20)]
+                         + [('product', 20, 'Running Shoes', '/p/20/'),
+                            ('category', 1, 'Lamps', '/c/lamps/')])
+        # The category sorts after every product key starting with 'lamp '
+        self.assertEqual([entry['label'] for entry in self.index.lookup('LAM', limit=3)],
+                         ['Lamps', 'Lamp 00', 'Lamp 01'])
+        self.assertEqual(self.index.lookup('sho'), [{'type': 'product', 'label': 'Running Shoes',
+                                                      'url': '/p/20/'}])
+        self.assertEqual(self.index.lookup('  running   SH '), self.index.lookup('sho'))
+        self.assertEqual(len(self.index.lookup('lamp', limit=50)), 21)
+        self.assertEqual(self.index.lookup(''), [])
+
+    def test_follows_committed_changes(self):
+        lamps = Category.objects.create(name='Lamps')
+        product = Product.objects.create(name='Desk Lamp', price=10, category=lamps)
+        self.assertEqual(self.suggest('desk'), [('product', 'Desk Lamp')])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = 'Floor Lamp'
+            product.save()
+            lamps.name = 'Lighting'
+            lamps.save()
+        self.assertEqual(self.suggest('desk'), [])
+        self.assertEqual(self.suggest('l'), [('category', 'Lighting'), ('product', 'Floor Lamp')])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.available = False
+            product.save()
+            lamps.delete()
+        self.assertEqual(self.suggest('l'), [])
+
+    def test_stale_index_is_rebuilt_in_the_background(self):
+        self.index.build([('product', 1, 'Desk Lamp', '/p/1/')])
+        self.index.built_at -= settings.AUTOCOMPLETE_INDEX_MAX_AGE + 1
+        reading = threading.Event()
+
+        def entries():
+            reading.wait(5)
+            yield 'product', 2, 'Floor Lamp', '/p/2/'
+
+        with mock.patch.object(autocomplete, 'catalogue_entries', entries):
+            # Requests keep the current index while the new one is read
+            self.assertEqual(self.suggest('lamp'), [('product', 'Desk Lamp')])
+            self.assertEqual(self.suggest('lamp'), [('product', 'Desk Lamp')])
+            reading.set()
+            for thread in threading.enumerate():
+                if thread.name == 'autocomplete-rebuild':
+                    thread.join()
+        self.assertEqual(self.suggest('lamp'), [('product', 'Floor Lamp')])
+
+
+class SearchBackendTestsMixin:
+    """
+    Tests run against the full-text backend of the database in use.
+    """
+    backend_class = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Shoes')
+        cls.lamps = Category.objects.create(name='Lamps')
+        cls.trail = Product.objects.create(name='Trail Running Shoe', price=90, category=cls.shoes,
+                                           description='Grippy soles.')
+        cls.road = Product.objects.create(name='Road Shoe', price=80, category=cls.shoes,
+                                          description='For runners who run on roads.')
+        cls.lamp = Product.objects.create(name='Desk Lamp', price=20, category=cls.lamps,
+                                          description='Bright enough to read by.')
+
+    def setUp(self):
+        if not isinstance(search.get_backend(), self.backend_class):
+            self.skipTest(f'{self.backend_class.__name__} is not in use')
+
+    def ids(self, query):
+        return [product.id for product in search.search(query)[:10]]
+
+    def test_ranking_prefers_name_matches(self):
+        # Both mention running; only one has it in its name
+        self.assertEqual(self.ids('running'), [self.trail.id, self.road.id])
+        self.assertEqual(set(self.ids('shoes')), {self.trail.id, self.road.id})
+        # Names outrank categories, which outrank descriptions
+        oil = Product.objects.create(name='Lamp Oil', price=5, description='For oil lamps.')
+        shade = Product.objects.create(name='Shade', price=15, category=self.lamps)
+        cord = Product.objects.create(name='Cord', price=5, description='Fits any lamp.')
+        ranked = self.ids('lamp')
+        self.assertEqual(set(ranked[:2]), {oil.id, self.lamp.id})
+        self.assertEqual(ranked[2:], [shade.id, cord.id])
+
+    def test_stemming_and_prefixes(self):
+        self.assertEqual(set(self.ids('runs')), {self.trail.id, self.road.id})
+        self.assertEqual(self.ids('gripp'), [self.trail.id])
+        self.assertEqual(self.ids('desk lam'), [self.lamp.id])
+        self.assertEqual(self.ids('desk shoe'), [])
+        # Query syntax is never passed through
+        self.assertEqual(self.ids('desk" OR "shoe'), [])
+        self.assertEqual(self.ids('*'), [])
+
+    def test_pagination(self):
+        for i in range(5):
+            Product.objects.create(name=f'Floor Lamp {i}', price=30, category=self.lamps)
+        results = search.search('lamp')
+        self.assertEqual(results.count(), 6)
+        pages = [[product.id for product in results[start:start + 4]] for start in (0, 4)]
+        self.assertEqual([len(page) for page in pages], [4, 2])
+        self.assertEqual(len(set(pages[0] + pages[1])), 6)
+        with override_settings(SEARCH_RESULTS_PER_PAGE=4):
+            response = self.client.get(reverse('products:product_search'), {'q': 'lamp', 'page': 2})
+        self.assertEqual([product.id for product in response.context['products']], pages[1])
+        self.assertEqual(response.context['page_obj'].paginator.num_pages, 2)
+
+    def test_index_follows_product_and_category_changes(self):
+        self.lamp.name = 'Reading Light'
+        self.lamp.save()
+        self.assertEqual(self.ids('desk'), [])
+        self.assertEqual(self.ids('light'), [self.lamp.id])
+        self.lamp.available = False
+        self.lamp.save()
+        self.assertEqual(self.ids('light'), [])
+        self.lamp.available = True
+        self.lamp.save()
+        self.assertEqual(self.ids('light'), [self.lamp.id])
+
+        self.shoes.name = 'Footwear'
+        self.shoes.save()
+        self.assertEqual(set(self.ids('footwear')), {self.trail.id, self.road.id})
+
+        self.road.delete()
+        self.assertEqual(self.ids('footwear'), [self.trail.id])
+
+    def test_rebuild(self):
+        search.get_backend().clear()
+        self.assertEqual(self.ids('lamp'), [])
+        search.get_backend().rebuild(batch_size=2)
+        self.assertEqual(self.ids('lamp'), [self.lamp.id])
+        self.assertEqual(search.search('shoe').count(), 2)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 index tests')
+class SQLiteSearchTests(SearchBackendTestsMixin, TestCase):
+    backend_class = search.SQLiteSearchBackend
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL full-text index tests')
+class PostgresSearchTests(SearchBackendTestsMixin, TestCase):
+    backend_class = search.PostgresSearchBackend
+
+
+class ProductDetailFragmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Lamp', price=10,
+                                             category=Category.objects.create(name='Lamps'))
+        cls.user = User.objects.create(username='critic')
+
+    def setUp(self):
+        for alias in ('default', settings.CATALOGUE_CACHE_ALIAS):
+            caches[alias].clear()
+
+    def settle(self):
+        # Keys hold the change times, so start from ones in the past
+        Product.objects.filter(pk=self.product.pk).update(
+            updated=timezone.now() - timedelta(minutes=1), reviews_updated=timezone.now() - timedelta(minutes=1))
+        cache.invalidate_product(self.product.pk)
+
+    def page(self):
+        response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_review_changes_show_up(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(product=self.product, user=self.user, rating=4, comment='Bright.')
+        self.settle()
+        self.assertIn('Bright.', self.page())
+        # Served from the fragment cache while nothing changes
+        Review.objects.filter(pk=review.pk).update(comment='Changed behind its back.')
+        self.assertIn('Bright.', self.page())
+        with self.captureOnCommitCallbacks(execute=True):
+            review.comment = 'Too dim.'
+            review.save()
+        content = self.page()
+        self.assertIn('Too dim.', content)
+        self.assertNotIn('Bright.', content)
+        with self.captureOnCommitCallbacks(execute=True):
+            review.delete()
+        self.assertNotIn('Too dim.', self.page())
+
+    def test_image_changes_show_up(self):
+        # The files don't exist, so there are no variants to build
+        self.enterContext(mock.patch('products.images.schedule_variants'))
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/first.jpg')
+        self.settle()
+        self.assertIn('products/first.jpg', self.page())
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/second.jpg')
+        self.assertIn('products/second.jpg', self.page())
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Chairs')
+        cls.product = Product.objects.create(name='Chair', price=10, category=cls.category)
+
+    def setUp(self):
+        caches[settings.CATALOGUE_CACHE_ALIAS].clear()
+        self.urls = [reverse('home'), reverse('products:product_list'),
+                     reverse('products:product_list_by_category', args=['chairs']),
+                     self.product.get_absolute_url()]
+
+    def settle(self):
+        # Last-Modified is only sent once the second of the last change is over
+        cache.touch()
+        CatalogueChanges.objects.update(changed=timezone.now() - timedelta(seconds=10))
+
+    def revalidate(self, url):
+        # The first page issues the CSRF cookie the ETag depends on
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return self.client.get(url, headers={'If-None-Match': response['ETag']})
+
+    def test_unchanged_pages_are_not_rendered(self):
+        for url in self.urls:
+            response = self.revalidate(url)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertFalse(response.templates)
+
+    def test_catalogue_changes_invalidate_etags(self):
+        self.client.get(self.urls[-1])
+        for change in (lambda: self.product.save(),
+                       lambda: self.category.save(),
+                       lambda: Review.objects.create(product=self.product, rating=4,
+                                                     user=User.objects.create(username='critic'))):
+            response = self.client.get(self.urls[-1])
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            response = self.client.get(self.urls[-1], headers={'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        self.settle()
+        response = self.client.get(self.urls[0])
+        last_modified = response['Last-Modified']
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(self.urls[0], headers={'If-Modified-Since': last_modified})
+                         .status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(self.urls[0], headers={'If-Modified-Since': last_modified})
+                         .status_code, 200)
+
+    def test_personalized_pages(self):
+        self.settle()
+        self.client.get(self.urls[1])
+        anonymous = self.client.get(self.urls[1])
+        self.client.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 1})
+        with_cart = self.client.get(self.urls[1])
+        self.assertNotEqual(with_cart['ETag'], anonymous['ETag'])
+        self.assertFalse(with_cart.has_header('Last-Modified'))
+        self.client.force_login(User.objects.create(username='shopper'))
+        response = self.client.get(self.urls[1])
+        self.assertNotEqual(response['ETag'], with_cart['ETag'])
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(self.urls[1], headers={'If-None-Match': response['ETag']})
+                         .status_code, 304)
+
+
+class SharedChangeCounterTests(TransactionTestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Chair', price=10,
+                                              category=Category.objects.create(name='Chairs'))
+
+    def etag(self):
+        self.client.get(self.product.get_absolute_url())
+        return self.client.get(self.product.get_absolute_url())['ETag']
+
+    def test_changes_made_through_other_connections_move_etags(self):
+        before = self.etag()
+        # What this process keeps in its caches doesn't matter
+        caches[settings.CATALOGUE_CACHE_ALIAS].clear()
+        self.assertEqual(self.etag(), before)
+
+        # Threads have connections of their own, as other processes do
+        def change():
+            try:
+                cache.touch()
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=change)
+        thread.start()
+        thread.join()
+        self.assertNotEqual(self.etag(), before)
+
+
+class CatalogueFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.second = datetime(2025, 1, 1, 12, 0, 0, tzinfo=dt_timezone.utc)
+        cls.products = [Product.objects.create(name=f'Lamp {i}', price=10) for i in range(5)]
+        for i, product in enumerate(cls.products):
+            Product.objects.filter(pk=product.pk).update(
+                updated=cls.second - timedelta(minutes=5 - i, microseconds=-200000))
+
+    def fetch(self, **params):
+        headers = {}
+        if 'since' in params:
+            headers['If-Modified-Since'] = params.pop('since')
+        response = self.client.get(reverse('products:catalogue_feed'), params, headers=headers)
+        if response.status_code != 200:
+            return response, []
+        return response, [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_resume_from_cursor(self):
+        response, rows = self.fetch()
+        self.assertEqual([row['id'] for row in rows], [product.id for product in self.products])
+        response, rest = self.fetch(cursor=rows[1]['cursor'])
+        self.assertEqual(rest, rows[2:])
+        self.assertEqual(self.fetch(cursor='not a cursor')[0].status_code, 400)
+
+    def test_changes_within_the_second_of_last_modified(self):
+        Product.objects.filter(pk=self.products[0].pk).update(updated=self.second + timedelta(microseconds=200000))
+        response, rows = self.fetch()
+        last_modified = response['Last-Modified']
+        self.assertEqual(last_modified, http_date(self.second.timestamp()))
+        # Changed later in the same second
+        Product.objects.filter(pk=self.products[1].pk).update(updated=self.second + timedelta(microseconds=700000))
+        response, rows = self.fetch(since=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in rows], [self.products[0].id, self.products[1].id])
+        # A sync interrupted after the first row resumes from its cursor
+        response, rows = self.fetch(since=last_modified, cursor=rows[0]['cursor'])
+        self.assertEqual([row['id'] for row in rows], [self.products[1].id])
+        self.assertEqual(self.fetch(since=http_date(self.second.timestamp() + 1))[0].status_code, 304)
+
+    def test_new_reviews_are_in_the_next_sync(self):
+        since = http_date(self.second.timestamp())
+        self.assertEqual(self.fetch(since=since)[0].status_code, 304)
+        Review.objects.create(product=self.products[2], user=User.objects.create(username='critic'), rating=4)
+        response, rows = self.fetch(since=since)
+        self.assertEqual([(row['id'], row['rating_avg']) for row in rows], [(self.products[2].id, 4.0)])
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class PopulateProductsTests(TestCase):
+    """
+    Imports run against fixture files served by a local HTTP server.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fixtures_dir = tempfile.mkdtemp()
+        cls.media_root = tempfile.mkdtemp()
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        with open(os.path.join(cls.fixtures_dir, 'shirt.png'), 'wb') as f:
+            f.write(buffer.getvalue())
+        handler = functools.partial(QuietHandler, directory=cls.fixtures_dir)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.fixtures_dir)
+        shutil.rmtree(cls.media_root)
+        super().tearDownClass()
+
+    def setUp(self):
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def write_fixture(self, name, records):
+        with open(os.path.join(self.fixtures_dir, name), 'w') as f:
+            if name.endswith('.jsonl'):
+                f.write('\n'.join(json.dumps(record) for record in records))
+            else:
+                json.dump(records, f)
+
+    def record(self, i, image='shirt.png'):
+        return {'id': i, 'title': f'Shirt {i}', 'price': 10 + i, 'description': 'Cotton',
+                'category': "men's clothing", 'image': f'{self.base_url}/{image}'}
+
+    def populate(self, source, **options):
+        call_command('populate_products', source, stdout=StringIO(), retries=0, **options)
+
+    def test_import_from_api(self):
+        self.write_fixture('products.json', [self.record(1), self.record(2, image='missing.png')])
+        self.populate(f'{self.base_url}/products.json')
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Category.objects.get().slug, 'mens-clothing')
+        product = Product.objects.get(slug='shirt-1')
+        self.assertEqual(product.stock, 10)
+        self.assertEqual(product.images.count(), 1)
+        self.assertEqual(product.primary_image, product.images.get())
+        # A broken image URL doesn't stop the import
+        self.assertFalse(Product.objects.get(slug='shirt-2').images.exists())
+
+    def test_reimport_updates_without_duplicates(self):
+        self.write_fixture('products.json', [self.record(1)])
+        self.populate(f'{self.base_url}/products.json')
+        self.write_fixture('products.json', [dict(self.record(1), price=99)])
+        self.populate(f'{self.base_url}/products.json')
+        product = Product.objects.get()
+        self.assertEqual(product.price, 99)
+        self.assertEqual(product.images.count(), 1)
+
+    def test_import_local_jsonl_with_relative_images(self):
+        self.write_fixture('products.jsonl', [
+            {'name': 'Scarf', 'price': '12.50', 'stock': 3, 'image': 'shirt.png'},
+            {'name': '', 'price': 1},
+        ])
+        self.populate(os.path.join(self.fixtures_dir, 'products.jsonl'))
+        product = Product.objects.get()
+        self.assertEqual((product.name, product.stock), ('Scarf', 3))
+        self.assertIsNone(product.category)
+        self.assertEqual(product.images.count(), 1)
+
+    def test_bad_records_are_skipped_and_reported(self):
+        Product.objects.create(name='Hat', price=5)
+        Product.objects.create(name='Hat', price=6)
+        self.write_fixture('products.jsonl', [
+            {'name': 'Scarf', 'price': 12, 'stock': -1},
+            {'name': 'Gloves', 'price': 123456789, 'stock': 1},
+            {'name': 'Hat', 'price': 7},
+            {'name': 'Socks', 'price': 3, 'stock': 4},
+        ])
+        out = StringIO()
+        call_command('populate_products', os.path.join(self.fixtures_dir, 'products.jsonl'),
+                     no_images=True, stdout=out)
+        self.assertEqual(Product.objects.get(slug='socks').stock, 4)
+        self.assertFalse(Product.objects.filter(slug__in=['scarf', 'gloves']).exists())
+        self.assertEqual(sorted(Product.objects.filter(slug='hat').values_list('price', flat=True)), [5, 6])
+        output = out.getvalue()
+        self.assertIn('Skipping record 1: stock:', output)
+        self.assertIn('Skipping record 2: price:', output)
+        self.assertIn("Skipping 'hat': several products have this slug", output)
+        self.assertIn('1 created, 0 updated, 3 skipped', output)
+
+    def test_resumes_from_checkpoint(self):
+        self.write_fixture('products.json', [self.record(i) for i in range(1, 5)])
+        source = f'{self.base_url}/products.json'
+        checkpoint = os.path.join(self.media_root, 'import.json')
+        with open(checkpoint, 'w') as f:
+            json.dump({'source': source, 'done': 2}, f)
+        self.populate(source, batch_size=2, no_images=True, checkpoint=checkpoint)
+        self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)),
+                         ['shirt-3', 'shirt-4'])
+        self.assertFalse(os.path.exists(checkpoint))
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Base class for tests that request pages and fail if any query they
+    make reads a large table with a full scan.
+    """
+    # Tables that grow with the shop; small lookup tables may be scanned
+    LARGE_TABLES = {'products_product', 'products_productimage', 'products_review',
+                    'orders_order', 'orders_orderitem', 'orders_copurchase'}
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('Query plans are only checked on SQLite and PostgreSQL')
+        caches[settings.CATALOGUE_CACHE_ALIAS].clear()
+
+    def capture_selects(self, url):
+        selects = []
+
+        def record(execute, sql, params, many, context):
+            if not many and sql.lstrip().upper().startswith('SELECT'):
+                selects.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return selects
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Test tables are tiny, so make the planner use an index if it can
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}', params)
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, sql, plan):
+        """
+        Return the large tables the plan reads in full, through the table
+        or through a whole index, rather than a restricted range of one.
+
+        Walking an index in the order asked for under a LIMIT stops after a
+        page of rows, so that alone is not a full scan.
+        """
+        scanned = []
+        if connection.vendor == 'postgresql':
+            for i, line in enumerate(plan):
+                m = re.search(r'(Seq Scan|Index Scan|Index Only Scan|Bitmap Index Scan)'
+                              r'(?: Backward)?(?: using (\w+))? on (\w+)', line)
+                if not m:
+                    continue
+                # The node's own lines run up to its first child
+                details = []
+                for detail in plan[i + 1:]:
+                    if '->' in detail:
+                        break
+                    details.append(detail)
+                if any('Index Cond' in detail for detail in details):
+                    continue
+                if m.group(1) != 'Seq Scan' and self.under_limit(plan, i):
+                    continue
+                scanned.append((m.group(3), m.group(2)))
+        else:
+            # A sort of the right part of the ORDER BY only reorders ties
+            ordered_page = re.search(r'\bLIMIT\b', sql) and \
+                not any(line.strip() == 'USE TEMP B-TREE FOR ORDER BY' for line in plan)
+            for line in plan:
+                m = re.search(r'^SCAN (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?', line.strip())
+                if m and not (m.group(2) and ordered_page):
+                    scanned.append((m.group(1), m.group(2)))
+        return [f'{table} ({index})' if index else table for table, index in scanned
+                if table in self.LARGE_TABLES]
+
+    def under_limit(self, plan, i):
+        # Whether the nearest ancestor of node i that could consume all its
+        # rows is a Limit, so the scan stops early
+        indent = len(plan[i]) - len(plan[i].lstrip())
+        for line in reversed(plan[:i]):
+            line_indent = len(line) - len(line.lstrip())
+            if line_indent >= indent or not ('->' in line or line_indent == 0):
+                continue
+            indent = line_indent
+            node = line.strip().removeprefix('->').strip()
+            if node.startswith('Limit'):
+                return True
+            if node.startswith(('Sort', 'Incremental Sort', 'Aggregate', 'HashAggregate',
+                                'GroupAggregate', 'Hash', 'Materialize', 'Unique')):
+                return False
+        return False
+
+    def assertNoFullScans(self, url, allowed=()):
+        """
+        Fail if any query of the page reads a large table in full, other
+        than the queries allowed to, given by the start of their SQL.
+        """
+        for sql, params in self.capture_selects(url):
+            if sql.startswith(tuple(allowed)):
+                continue
+            plan = self.explain(sql, params)
+            scanned = self.full_scans(sql, plan)
+            self.assertFalse(scanned, f'{url} scans {", ".join(scanned)}:\n{sql}\n' + '\n'.join(plan))
+
+
+class CatalogueQueryPlanTests(QueryPlanTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Lamps')
+        user = User.objects.create(username='reviewer')
+        for i in range(20):
+            product = Product.objects.create(name=f'Lamp {i}', price=i * 10, stock=i % 6,
+                                             category=category)
+            ProductImage.objects.create(product=product, image=f'products/{i}.jpg')
+            Review.objects.create(product=product, user=user, rating=i % 5 + 1)
+        cls.product = product
+
+    def test_home(self):
+        self.assertNoFullScans(reverse('home'))
+
+    # Facet counts cover every category, so they read the whole facet
+    # index, though never the table
+    FACETS = ['SELECT COUNT("products_product"."id") FILTER']
+
+    def test_product_list(self):
+        self.assertNoFullScans(reverse('products:product_list'), allowed=self.FACETS)
+
+    def test_category_list(self):
+        self.assertNoFullScans(reverse('products:product_list_by_category', args=['lamps']),
+                               allowed=self.FACETS)
+
+    def test_filtered_category_list(self):
+        url = reverse('products:product_list_by_category', args=['lamps'])
+        self.assertNoFullScans(f'{url}?price=25-50&in_stock=1&rating=3', allowed=self.FACETS)
+
+    def test_product_detail(self):
+        self.assertNoFullScans(self.product.get_absolute_url())
+
+    def test_search(self):
+        self.assertNoFullScans(reverse('products:product_search') + '?q=lamp')
+
+    def test_catalogue_feed(self):
+        url = reverse('products:catalogue_feed')
+        # A first sync exports the whole catalogue, in one walk of the
+        # change order index rather than a scan and sort of the table
+        scans = [self.full_scans(sql, self.explain(sql, params)) for sql, params in self.capture_selects(url)]
+        self.assertEqual([scanned for scanned in scans if scanned], [['products_product (product_updated_idx)']])
+        lines = b''.join(self.client.get(url).streaming_content).splitlines()
+        cursor = json.loads(lines[5])['cursor']
+        self.assertNoFullScans(f'{url}?cursor={cursor}')
@@ -8,4 +8,6 @@ urlpatterns = [
     path('category/<slug:category_slug>/', views.product_list, name='product_list_by_category'),
     path('<int:id>/<slug:slug>/', views.product_detail, name='product_detail'),
     path('search/', views.search_products, name='product_search'),
+    path('autocomplete/', views.autocomplete_products, name='product_autocomplete'),
+    path('feed/', views.catalogue_feed, name='catalogue_feed'),
 ]
\ No newline at end of file
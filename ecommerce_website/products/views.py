@@ -1,50 +1,131 @@
-from django.shortcuts import render, get_object_or_404
-from django.db.models import Q, Avg
-from .models import Category, Product, Review
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_GET
+from .conditional import catalogue_condition
+from .models import Product
+from .facets import ProductFacets
+from .pagination import KeysetPaginator, InvalidCursor
+from . import autocomplete, cache, feed, search
 from cart.forms import CartAddProductForm
+from orders import bestsellers
+from orders.recommendations import recommended_products
 
+@catalogue_condition
 def product_list(request, category_slug=None):
     category = None
-    categories = Category.objects.all()
-    products = Product.objects.filter(available=True)
+    categories = cache.get_categories()
+    catalogue = Product.objects.filter(available=True)
+    products = catalogue
     
     if category_slug:
-        category = get_object_or_404(Category, slug=category_slug)
+        category = cache.get_category_or_404(category_slug)
         products = products.filter(category=category)
     
+    facets = ProductFacets(request.GET)
+    products = facets.filter(products).for_cards()
+    
+    # Seek pagination on the model's name ordering, with id as tie-breaker
+    paginator = KeysetPaginator(products, ('name', 'id'), settings.PRODUCTS_PER_PAGE)
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page = paginator.page()
+    
+    # Category bestsellers head the first unfiltered page
+    top_sellers = []
+    if category and not page.has_previous and not facets.active:
+        top_sellers = bestsellers.top_products(category, limit=settings.CATEGORY_BESTSELLERS_SHOWN)
+    
     return render(request, 'products/list.html', {
         'category': category,
         'categories': categories,
-        'products': products
+        'products': page.object_list,
+        'top_sellers': top_sellers,
+        'page': page,
+        'facets': facets.counts(catalogue, categories, category),
+        'filter_query': facets.query(),
+        'filters_active': facets.active,
     })
 
+@catalogue_condition
 def product_detail(request, id, slug):
-    product = get_object_or_404(Product, id=id, slug=slug, available=True)
-    reviews = product.reviews.all()
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
+    product = cache.get_product_or_404(id)
+    if product.slug != slug or not product.available:
+        raise Http404('No Product matches the given query.')
+    # Both querysets are only evaluated if their template fragment isn't cached
+    images = product.images.all()
+    reviews = product.reviews.select_related('user')
+    avg_rating = product.rating_avg if product.rating_count else None
     
     # Add cart product form
     cart_product_form = CartAddProductForm()
     
     return render(request, 'products/detail.html', {
         'product': product,
+        'images': images,
         'reviews': reviews,
         'avg_rating': avg_rating,
-        'cart_product_form': cart_product_form
+        'cart_product_form': cart_product_form,
+        'recommended_products': recommended_products([product.id]),
+        'fragment_timeout': settings.PRODUCT_FRAGMENT_CACHE_TIMEOUT,
     })
 
 def search_products(request):
-    query = request.GET.get('q')
+    query = request.GET.get('q', '').strip()
     products = []
+    page_obj = None
     
     if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        ).filter(available=True).distinct()
+        paginator = Paginator(search.search(query), settings.SEARCH_RESULTS_PER_PAGE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        products = page_obj.object_list
     
     return render(request, 'products/search_results.html', {
         'products': products,
+        'page_obj': page_obj,
         'query': query
     })
+
+def autocomplete_products(request):
+    query = request.GET.get('q', '')[:100]
+    results = autocomplete.get_index().lookup(query, limit=settings.AUTOCOMPLETE_LIMIT)
+    return JsonResponse({'query': query, 'results': results})
+
+@require_GET
+def catalogue_feed(request):
+    """
+    Stream the catalogue as NDJSON (or a JSON array with ?format=json).
+
+    Send If-Modified-Since to only receive products changed since then,
+    and ?cursor= with the cursor of the last row received to resume an
+    interrupted transfer.
+    """
+    latest = feed.latest_update()
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    # Last-Modified drops the fraction of a second, so a change later in
+    # that second is newer at full precision and is still sent; rows of
+    # that second may be sent twice, but none are missed
+    if since is not None and (latest is None or latest.timestamp() <= since):
+        return HttpResponseNotModified()
+    
+    try:
+        paginator, products = feed.changed_products(
+            since=datetime.fromtimestamp(since, timezone.utc) if since is not None else None,
+            cursor=request.GET.get('cursor'),
+        )
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    
+    records = feed.stream_records(paginator, products, request.build_absolute_uri,
+                                  settings.CATALOGUE_FEED_CHUNK_SIZE)
+    if request.GET.get('format') == 'json':
+        response = StreamingHttpResponse(feed.json_array(records), content_type='application/json')
+    else:
+        response = StreamingHttpResponse(feed.ndjson_lines(records), content_type='application/x-ndjson')
+    if latest is not None:
+        response['Last-Modified'] = http_date(latest.timestamp())
+    return response
@@ -0,0 +1,48 @@
+// Typeahead suggestions for the search boxes
+document.querySelectorAll('input[data-autocomplete]').forEach(function(input) {
+    const menu = document.createElement('ul');
+    menu.className = 'dropdown-menu w-100';
+    menu.style.top = '100%';
+    input.parentNode.appendChild(menu);
+    let timer = null;
+    let controller = null;
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            const query = input.value.trim();
+            if (controller) controller.abort();
+            if (!query) {
+                menu.classList.remove('show');
+                return;
+            }
+            controller = new AbortController();
+            fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(query), {signal: controller.signal})
+                .then(function(response) { return response.json(); })
+                .then(function(data) {
+                    menu.innerHTML = '';
+                    data.results.forEach(function(result) {
+                        const item = document.createElement('li');
+                        const link = document.createElement('a');
+                        link.className = 'dropdown-item';
+                        link.href = result.url;
+                        link.textContent = result.label;
+                        if (result.type === 'category') {
+                            const badge = document.createElement('span');
+                            badge.className = 'badge bg-light text-muted ms-2';
+                            badge.textContent = 'Category';
+                            link.appendChild(badge);
+                        }
+                        item.appendChild(link);
+                        menu.appendChild(item);
+                    });
+                    menu.classList.toggle('show', data.results.length > 0);
+                })
+                .catch(function() {});
+        }, 80);
+    });
+
+    input.addEventListener('blur', function() {
+        setTimeout(function() { menu.classList.remove('show'); }, 200);
+    });
+});
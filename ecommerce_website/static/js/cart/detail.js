@@ -0,0 +1,117 @@
+function decrementCartQuantity(inputId, minValue) {
+    const input = document.getElementById(inputId);
+    const currentValue = parseInt(input.value);
+    if (currentValue > minValue) {
+        input.value = currentValue - 1;
+        animateQuantityChange(input, 'decrease');
+    }
+}
+
+function incrementCartQuantity(inputId, maxValue) {
+    const input = document.getElementById(inputId);
+    const currentValue = parseInt(input.value);
+    if (currentValue < maxValue) {
+        input.value = currentValue + 1;
+        animateQuantityChange(input, 'increase');
+    }
+}
+
+function animateQuantityChange(element, direction) {
+    // Add animation class
+    element.classList.add('quantity-changed');
+
+    // Remove animation class after animation completes
+    setTimeout(() => {
+        element.classList.remove('quantity-changed');
+    }, 300);
+}
+
+// Add animation style
+document.addEventListener('DOMContentLoaded', function() {
+    const style = document.createElement('style');
+    style.textContent = `
+        .quantity-changed {
+            animation: pulse 0.3s ease-in-out;
+            background-color: rgba(var(--bs-primary-rgb), 0.1);
+        }
+
+        @keyframes pulse {
+            0% { transform: scale(1); }
+            50% { transform: scale(1.05); }
+            100% { transform: scale(1); }
+        }
+    `;
+    document.head.appendChild(style);
+});
+
+// Cart changes are posted to the JSON endpoints and applied in place
+function formatPrice(value) {
+    return '$' + value;
+}
+
+function updateCartBadge(count) {
+    const icon = document.querySelector('.cart-icon');
+    if (!icon) {
+        return;
+    }
+    let badge = icon.querySelector('.cart-count');
+    if (count > 0 && !badge) {
+        badge = document.createElement('span');
+        badge.className = 'cart-count';
+        icon.appendChild(badge);
+    }
+    if (badge) {
+        if (count > 0) {
+            badge.textContent = count;
+        } else {
+            badge.remove();
+        }
+    }
+}
+
+function applyCartDelta(data) {
+    if (data.count === 0) {
+        // Show the empty cart page
+        window.location.reload();
+        return;
+    }
+    const line = document.querySelector(`[data-cart-item="${data.product_id}"]`);
+    if (line && data.item === null) {
+        line.remove();
+    } else if (line) {
+        line.querySelector('[data-cart-item-total]').textContent = formatPrice(data.item.total_price);
+        const quantity = line.querySelector('select[name="quantity"]');
+        if (quantity) {
+            quantity.value = data.item.quantity;
+        }
+    }
+    document.querySelectorAll('[data-cart-count-label]').forEach(label => {
+        label.textContent = data.count + (data.count > 1 ? ' items' : ' item');
+    });
+    document.querySelectorAll('[data-cart-total]').forEach(total => {
+        total.textContent = formatPrice(data.total_price);
+    });
+    updateCartBadge(data.count);
+}
+
+document.addEventListener('submit', function(event) {
+    const form = event.target.closest('form[data-cart-form]');
+    if (!form || !window.fetch) {
+        return;
+    }
+    event.preventDefault();
+    fetch(form.dataset.cartForm, {
+        method: 'POST',
+        body: new FormData(form),
+        headers: {'Accept': 'application/json'},
+        credentials: 'same-origin'
+    }).then(response => {
+        if (!response.ok) {
+            throw new Error(response.statusText);
+        }
+        return response.json();
+    }).then(applyCartDelta).catch(() => {
+        // Fall back to the regular form post
+        form.submit();
+    });
+});
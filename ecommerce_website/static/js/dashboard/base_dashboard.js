@@ -0,0 +1,21 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Sidebar toggle functionality for mobile
+    const sidebarToggle = document.getElementById('sidebarToggle');
+    const sidebar = document.getElementById('sidebar');
+
+    if (sidebarToggle) {
+        sidebarToggle.addEventListener('click', function() {
+            sidebar.classList.toggle('show');
+        });
+    }
+
+    // Close sidebar when clicking outside on mobile
+    document.addEventListener('click', function(event) {
+        const isClickInsideSidebar = sidebar.contains(event.target);
+        const isClickInsideToggle = sidebarToggle.contains(event.target);
+
+        if (!isClickInsideSidebar && !isClickInsideToggle && sidebar.classList.contains('show')) {
+            sidebar.classList.remove('show');
+        }
+    });
+});
@@ -0,0 +1,71 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Auto-generate slug from name
+    const nameInput = document.getElementById('id_name');
+    const slugInput = document.getElementById('id_slug');
+
+    if (nameInput && slugInput) {
+        nameInput.addEventListener('blur', function() {
+            if (slugInput.value === '') {
+                const slug = nameInput.value
+                    .toLowerCase()
+                    .replace(/[^\w\s-]/g, '')
+                    .replace(/[\s_-]+/g, '-')
+                    .replace(/^-+|-+$/g, '');
+                slugInput.value = slug;
+            }
+        });
+    }
+
+    // Image preview functionality
+    const imageInput = document.getElementById('id_images');
+    const previewContainer = document.getElementById('imagePreviewContainer');
+
+    if (imageInput) {
+        imageInput.addEventListener('change', function() {
+            for (let i = 0; i < this.files.length; i++) {
+                const file = this.files[i];
+                if (!file.type.startsWith('image/')) continue;
+
+                const reader = new FileReader();
+                reader.onload = function(e) {
+                    const preview = document.createElement('div');
+                    preview.className = 'image-preview';
+                    preview.innerHTML = `
+                        <img src="${e.target.result}" alt="Preview">
+                        <div class="remove-image">
+                            <i class="fas fa-times"></i>
+                        </div>
+                    `;
+                    previewContainer.appendChild(preview);
+
+                    // Add remove functionality
+                    const removeBtn = preview.querySelector('.remove-image');
+                    removeBtn.addEventListener('click', function() {
+                        preview.remove();
+                    });
+                };
+                reader.readAsDataURL(file);
+            }
+        });
+    }
+
+    // Remove existing images
+    document.querySelectorAll('.remove-image').forEach(button => {
+        button.addEventListener('click', function() {
+            const imageId = this.getAttribute('data-id');
+            const preview = document.querySelector(`.image-preview[data-id="${imageId}"]`);
+
+            if (preview) {
+                // Create a hidden input to mark this image for deletion
+                const deleteInput = document.createElement('input');
+                deleteInput.type = 'hidden';
+                deleteInput.name = 'delete_images';
+                deleteInput.value = imageId;
+                document.getElementById('productForm').appendChild(deleteInput);
+
+                // Remove the preview
+                preview.remove();
+            }
+        });
+    });
+});
@@ -0,0 +1,7 @@
+// Add form-control class to all form inputs
+document.addEventListener('DOMContentLoaded', function() {
+  const formInputs = document.querySelectorAll('form input, form select, form textarea');
+  formInputs.forEach(input => {
+    input.classList.add('form-control');
+  });
+});
@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import Task
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'key', 'state', 'attempts', 'run_at', 'created', 'updated']
+    list_filter = ['state', 'name']
+    search_fields = ['name', 'key']
+    readonly_fields = ['created', 'updated']
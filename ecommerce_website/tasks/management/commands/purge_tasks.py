@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tasks import queue
+
+
+class Command(BaseCommand):
+    help = 'Delete background tasks that succeeded more than TASK_KEEP_DAYS ago'
+
+    def handle(self, *args, **options):
+        deleted = queue.purge(getattr(settings, 'TASK_KEEP_DAYS', 7))
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} tasks'))
@@ -0,0 +1,28 @@
+import signal
+from django.core.management.base import BaseCommand
+from tasks.queue import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int,
+                            help='Number of tasks run at once (default TASK_WORKER_CONCURRENCY)')
+        parser.add_argument('--poll-interval', type=float,
+                            help='Seconds to wait when no task is due (default TASK_POLL_INTERVAL)')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no task is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+
+        def stop(signum, frame):
+            # Finish the running tasks, but claim no more
+            worker.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f'Worker {worker.name} running {worker.concurrency} tasks at a time...')
+        count = worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully ran {count} tasks'))
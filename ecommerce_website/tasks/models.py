@@ -0,0 +1,44 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """
+    A call of a registered task function, queued in the database and run
+    by the runworker command.
+    """
+    STATE_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+    
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    # Enqueueing again with the same key returns the existing task
+    key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    # A running task whose worker stops renewing this is claimed again
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created']
+        indexes = [
+            # Due tasks, and running tasks whose worker died
+            models.Index(fields=['run_at'], condition=models.Q(state='queued'),
+                         name='task_queued_run_at_idx'),
+            models.Index(fields=['locked_until'], condition=models.Q(state='running'),
+                         name='task_running_lease_idx'),
+            models.Index(fields=['state', '-created'], name='task_state_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.name} ({self.state})'
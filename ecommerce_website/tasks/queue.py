@@ -0,0 +1,237 @@
+import logging
+import os
+import socket
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Tasks are claimed with conditional UPDATEs, like stock in orders.stock,
+# so any number of workers can share the table without locking reads.
+
+
+def task(max_attempts=5):
+    """
+    Register a function as a task that enqueue() can queue. Its keyword
+    arguments must be JSON serialisable.
+
+    A task runs in a transaction that also records its success, so its
+    database changes are made exactly once; anything else it does, such
+    as calling Stripe, may be repeated after a failure and should be safe
+    to repeat.
+    """
+    def register(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts
+        return func
+    return register
+
+
+def enqueue(func, key=None, delay=None, **kwargs):
+    """
+    Queue a call of a task as part of the current transaction, so it only
+    runs if the transaction commits. Given an idempotency key already used,
+    the task queued under it is returned instead, whatever its state.
+    """
+    fields = {
+        'name': func.task_name,
+        'kwargs': kwargs,
+        'max_attempts': func.max_attempts,
+        'run_at': timezone.now() + (delay or timedelta(0)),
+    }
+    if key is None:
+        return Task.objects.create(**fields)
+    return Task.objects.get_or_create(key=key, defaults=fields)[0]
+
+
+def lease():
+    return timedelta(seconds=getattr(settings, 'TASK_LEASE_SECONDS', 300))
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff: TASK_RETRY_DELAY seconds after the first failure,
+    doubling after each further one up to TASK_RETRY_MAX_DELAY.
+    """
+    delay = getattr(settings, 'TASK_RETRY_DELAY', 10) * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, getattr(settings, 'TASK_RETRY_MAX_DELAY', 60 * 60)))
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _claimable(now):
+    # Due tasks, and tasks whose worker stopped before finishing them
+    return Q(state='queued', run_at__lte=now) | Q(state='running', locked_until__lt=now)
+
+
+def claim(worker, limit):
+    """
+    Mark up to limit due tasks as running for the worker and return them,
+    oldest due first.
+    """
+    now = timezone.now()
+    candidates = list(Task.objects.filter(state='queued', run_at__lte=now)
+                      .order_by('run_at').values_list('id', flat=True)[:limit])
+    if len(candidates) < limit:
+        candidates += Task.objects.filter(state='running', locked_until__lt=now) \
+            .order_by('locked_until').values_list('id', flat=True)[:limit - len(candidates)]
+    claimed = []
+    for task_id in candidates:
+        # Another worker may have claimed it since it was read
+        if Task.objects.filter(_claimable(now), pk=task_id).update(
+                state='running', locked_by=worker, locked_until=now + lease(),
+                attempts=F('attempts') + 1, updated=now):
+            claimed.append(task_id)
+    return list(Task.objects.filter(pk__in=claimed).order_by('run_at'))
+
+
+def renew(tasks, worker):
+    """
+    Extend the leases of the given tasks that the worker is still running.
+    Returns the number renewed.
+    """
+    now = timezone.now()
+    return Task.objects.filter(pk__in=[task.pk for task in tasks], state='running', locked_by=worker) \
+        .update(locked_until=now + lease(), updated=now)
+
+
+def _finish(task, worker, **fields):
+    # Only while the task is still this worker's to finish
+    return Task.objects.filter(pk=task.pk, state='running', locked_by=worker) \
+        .update(locked_until=None, updated=timezone.now(), **fields)
+
+
+def execute(task, worker):
+    """
+    Run a claimed task and record the outcome: success, a retry after the
+    backoff delay, or failure once it has used up its attempts.
+    """
+    if task.attempts > task.max_attempts:
+        # Claimed again after the workers running it stopped every time
+        _finish(task, worker, state='failed', last_error='Gave up after its workers stopped')
+        return False
+    try:
+        func = import_string(task.name)
+        with transaction.atomic():
+            func(**task.kwargs)
+            if not _finish(task, worker, state='succeeded', last_error=''):
+                # Its lease ran out and another worker has it; undo this run
+                raise RuntimeError(f'Task {task.pk} was claimed by another worker')
+    except Exception:
+        logger.exception('Task %s %s failed (attempt %s of %s)',
+                         task.pk, task.name, task.attempts, task.max_attempts)
+        error = traceback.format_exc()
+        if task.attempts >= task.max_attempts:
+            _finish(task, worker, state='failed', last_error=error)
+        else:
+            _finish(task, worker, state='queued', last_error=error,
+                    run_at=timezone.now() + retry_delay(task.attempts))
+        return False
+    return True
+
+
+def run_pending(worker=None):
+    """
+    Run due tasks in this thread until none are left. Returns the number
+    of tasks run.
+
+    Nothing renews the leases of tasks run this way, so one running longer
+    than TASK_LEASE_SECONDS may be claimed by a worker as well.
+    """
+    worker = worker or worker_name()
+    count = 0
+    while True:
+        tasks = claim(worker, 1)
+        if not tasks:
+            return count
+        execute(tasks[0], worker)
+        count += 1
+
+
+def retry(task_id):
+    """
+    Queue a failed task to run again now, with fresh attempts.
+    """
+    return Task.objects.filter(pk=task_id, state='failed').update(
+        state='queued', attempts=0, run_at=timezone.now(), updated=timezone.now())
+
+
+def purge(days):
+    """
+    Delete tasks that succeeded more than days ago, forgetting their
+    idempotency keys. Returns the number deleted.
+    """
+    return Task.objects.filter(state='succeeded', updated__lt=timezone.now() - timedelta(days=days)) \
+        .delete()[0]
+
+
+class Worker:
+    """
+    Runs tasks from the queue in a pool of threads until stopped. Start
+    several runworker processes to use more than one process.
+
+    While tasks run, the worker renews their leases every third of
+    TASK_LEASE_SECONDS, so only tasks of a worker that stopped are claimed
+    again, however long they take.
+    """
+    def __init__(self, concurrency=None, poll_interval=None, name=None):
+        self.concurrency = concurrency or getattr(settings, 'TASK_WORKER_CONCURRENCY', 4)
+        self.poll_interval = poll_interval or getattr(settings, 'TASK_POLL_INTERVAL', 1)
+        self.heartbeat = lease().total_seconds() / 3
+        self.name = name or worker_name()
+        self.stopping = False
+
+    def _execute(self, task):
+        try:
+            execute(task, self.name)
+        finally:
+            close_old_connections()
+
+    def _renew(self, tasks):
+        try:
+            renew(tasks, self.name)
+        except DatabaseError:
+            # Tried again at the next heartbeat, well before the leases end
+            logger.warning('Could not renew the leases of running tasks', exc_info=True)
+
+    def run(self, once=False):
+        """
+        Keep the pool busy with due tasks. With once, return as soon as no
+        task is due or running. Returns the number of tasks run.
+        """
+        count = 0
+        running = {}
+        renewed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='task-worker') as pool:
+            while not self.stopping:
+                running = {future: task for future, task in running.items() if not future.done()}
+                if time.monotonic() - renewed >= self.heartbeat:
+                    if running:
+                        self._renew(running.values())
+                    renewed = time.monotonic()
+                tasks = claim(self.name, self.concurrency - len(running)) \
+                    if len(running) < self.concurrency else []
+                for task in tasks:
+                    running[pool.submit(self._execute, task)] = task
+                count += len(tasks)
+                if tasks:
+                    continue
+                if once and not running:
+                    break
+                if running:
+                    wait(running, timeout=min(self.poll_interval, self.heartbeat),
+                         return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(self.poll_interval)
+            # Running tasks are finished before the pool shuts down
+        return count
@@ -0,0 +1,201 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from orders.models import Order, ProductSales
+from orders.tests import create_order
+from products.models import Category, Product
+from .models import Task
+from . import queue
+from .queue import enqueue, task
+
+calls = []
+
+
+@task(max_attempts=3)
+def remember(value):
+    calls.append(value)
+    Category.objects.create(name=value)
+
+
+@task(max_attempts=2)
+def broken(value):
+    Category.objects.create(name=value)
+    raise ValueError('broken')
+
+
+@task(max_attempts=3)
+def slow(value, seconds):
+    time.sleep(seconds)
+    Category.objects.create(name=value)
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def state(self, task):
+        return Task.objects.get(pk=task.pk)
+
+    def test_tasks_run_once_per_key(self):
+        first = enqueue(remember, key='one', value='Lamps')
+        self.assertEqual(enqueue(remember, key='one', value='Desks'), first)
+        enqueue(remember, value='Chairs')
+        enqueue(remember, value='Later', delay=timedelta(hours=1))
+        self.assertEqual(queue.run_pending(), 2)
+        self.assertEqual(sorted(calls), ['Chairs', 'Lamps'])
+        self.assertEqual(self.state(first).state, 'succeeded')
+        # The key stays taken after the task ran
+        enqueue(remember, key='one', value='Desks')
+        self.assertEqual(queue.run_pending(), 0)
+
+    @override_settings(TASK_RETRY_DELAY=10)
+    def test_failures_are_retried_with_backoff_then_fail(self):
+        queued = enqueue(broken, value='Lamps')
+        before = timezone.now()
+        with self.assertLogs('tasks.queue', 'ERROR'):
+            queue.run_pending()
+        queued = self.state(queued)
+        self.assertEqual((queued.state, queued.attempts), ('queued', 1))
+        self.assertIn('ValueError: broken', queued.last_error)
+        self.assertGreaterEqual(queued.run_at, before + timedelta(seconds=10))
+        # The failed run's changes were rolled back
+        self.assertFalse(Category.objects.exists())
+
+        self.assertEqual(queue.run_pending(), 0)
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('tasks.queue', 'ERROR'):
+            queue.run_pending()
+        self.assertEqual((self.state(queued).state, self.state(queued).attempts), ('failed', 2))
+
+        self.assertEqual(queue.retry(queued.pk), 1)
+        self.assertEqual((self.state(queued).state, self.state(queued).attempts), ('queued', 0))
+
+    def test_retry_delay_doubles_up_to_the_maximum(self):
+        with self.settings(TASK_RETRY_DELAY=10, TASK_RETRY_MAX_DELAY=60):
+            self.assertEqual([queue.retry_delay(attempts).seconds for attempts in range(1, 6)],
+                             [10, 20, 40, 60, 60])
+
+    def test_tasks_of_stopped_workers_are_claimed_again(self):
+        queued = enqueue(remember, value='Lamps')
+        self.assertEqual(queue.claim('gone', 5), [queued])
+        self.assertEqual(queue.claim('other', 5), [])
+        Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(queue.run_pending('other'), 1)
+        queued = self.state(queued)
+        self.assertEqual((queued.state, queued.attempts, queued.locked_by), ('succeeded', 2, 'other'))
+        # The first worker can no longer finish it
+        self.assertEqual(queue._finish(queued, 'gone', state='failed'), 0)
+
+    def test_running_tasks_renew_their_lease(self):
+        queued = enqueue(remember, value='Lamps')
+        queue.claim('worker', 5)
+        Task.objects.update(locked_until=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(queue.renew([queued], 'other'), 0)
+        self.assertEqual(queue.renew([queued], 'worker'), 1)
+        self.assertGreater(self.state(queued).locked_until, timezone.now() + timedelta(seconds=200))
+        self.assertEqual(queue.claim('other', 5), [])
+
+    def test_purge(self):
+        old, recent = enqueue(remember, value='Lamps'), enqueue(remember, value='Desks')
+        queue.run_pending()
+        Task.objects.filter(pk=old.pk).update(updated=timezone.now() - timedelta(days=8))
+        self.assertEqual(queue.purge(7), 1)
+        self.assertEqual(list(Task.objects.all()), [recent])
+
+
+class PostCheckoutTaskTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('staff', is_staff=True)
+        cls.products = [Product.objects.create(name=f'Mug {i}', price=5) for i in range(2)]
+
+    def test_paid_orders_are_counted_by_the_worker(self):
+        order = create_order(self.user, self.products)
+        order.paid = True
+        order.save()
+        order.save()
+        self.assertEqual(Task.objects.filter(state='queued').count(), 2)
+        self.assertFalse(ProductSales.objects.exists())
+        queue.run_pending()
+        self.assertEqual(ProductSales.objects.count(), 2)
+        self.assertEqual(Task.objects.filter(state='succeeded').count(), 2)
+
+    def test_stripe_webhook_queues_fulfilment_once(self):
+        order = create_order(self.user, self.products)
+        event = {'id': 'evt_1', 'type': 'checkout.session.completed',
+                 'data': {'object': {'metadata': {'order_id': str(order.id)}, 'payment_intent': 'pi_1'}}}
+        with mock.patch('stripe.Webhook.construct_event', return_value=event):
+            for _ in range(2):
+                response = self.client.post(reverse('payment:webhook'), b'{}', content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+        self.assertFalse(Order.objects.get().paid)
+        self.assertEqual(Task.objects.count(), 1)
+        queue.run_pending()
+        order = Order.objects.get()
+        self.assertEqual((order.paid, order.stripe_id, order.status), (True, 'pi_1', 'processing'))
+        self.assertEqual(Task.objects.filter(state='succeeded').count(), 3)
+
+    def test_dashboard(self):
+        failed = enqueue(broken, value='Lamps')
+        Task.objects.filter(pk=failed.pk).update(state='failed')
+        enqueue(remember, value='Desks')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('dashboard:task_queue'), {'state': 'failed'})
+        self.assertEqual([task.pk for task in response.context['tasks']], [failed.pk])
+        self.assertIn(('queued', 'Queued', 1), response.context['counts'])
+        self.client.post(reverse('dashboard:retry_task', args=[failed.pk]))
+        self.assertEqual(Task.objects.get(pk=failed.pk).state, 'queued')
+
+
+class WorkerTests(TransactionTestCase):
+    def test_worker_pool_runs_every_task_once(self):
+        for i in range(20):
+            enqueue(remember, value=f'Category {i}')
+        counts = []
+
+        def work(name):
+            try:
+                counts.append(queue.Worker(concurrency=4, poll_interval=0.01, name=name).run(once=True))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(f'worker {i}',)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(counts), 20)
+        self.assertEqual(Category.objects.count(), 20)
+        self.assertEqual(Task.objects.filter(state='succeeded', attempts=1).count(), 20)
+
+    @override_settings(TASK_LEASE_SECONDS=0.3)
+    def test_tasks_outliving_their_lease_stay_claimed(self):
+        queued = enqueue(slow, value='Lamps', seconds=1.2)
+        claimed = []
+
+        def work():
+            try:
+                queue.Worker(concurrency=1, poll_interval=0.01, name='worker').run(once=True)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        try:
+            while not Task.objects.filter(state='running').exists():
+                time.sleep(0.01)
+            # Another worker keeps looking for tasks whose worker stopped
+            while thread.is_alive():
+                claimed += queue.claim('other', 1)
+                time.sleep(0.05)
+        finally:
+            thread.join()
+        self.assertEqual(claimed, [])
+        queued = Task.objects.get(pk=queued.pk)
+        self.assertEqual((queued.state, queued.attempts, queued.locked_by), ('succeeded', 1, 'worker'))